@@ -0,0 +1,120 @@
+from __future__ import annotations
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+
+from app.repo import Repo
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityBuffer:
+    """
+    Write-behind буфер активности: last_seen копится в памяти
+    (по одному значению на пользователя) и раз в interval секунд
+    пишется в БД одним UPDATE на всю пачку.
+    """
+
+    def __init__(self, repo: Repo, interval: float = 5.0, max_pending: int = 50000):
+        self.repo = repo
+        self.interval = interval
+        self.max_pending = max_pending
+        self._pending: dict[int, datetime] = {}
+        self._task: asyncio.Task | None = None
+        self._overflow: set[asyncio.Task] = set()  # внеочередные flush (держим ссылки до завершения)
+        self._lock = asyncio.Lock()
+        # метрики
+        self.events = 0
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.errors = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.peak_pending = 0
+
+    def touch(self, tg_user_id: int, at: datetime | None = None) -> None:
+        at = at or datetime.now(timezone.utc)
+        prev = self._pending.get(tg_user_id)
+        if prev is None or at > prev:
+            self._pending[tg_user_id] = at
+        self.events += 1
+        n = len(self._pending)
+        if n > self.peak_pending:
+            self.peak_pending = n
+        if n >= self.max_pending and not self._overflow and not self._lock.locked():
+            task = asyncio.get_running_loop().create_task(self._flush_logged())
+            self._overflow.add(task)
+            task.add_done_callback(self._overflow.discard)
+
+    async def flush(self) -> int:
+        async with self._lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            ids = sorted(batch)  # один порядок блокировок строк у всех flush
+            started = time.perf_counter()
+            try:
+                await self.repo.touch_users_batch(ids, [batch[i] for i in ids])
+            except BaseException as e:
+                # ошибка БД или отмена (stop() посреди flush) — возвращаем
+                # пачку в буфер, не затирая более свежие отметки; повторная
+                # запись безопасна (GREATEST)
+                if isinstance(e, Exception):
+                    self.errors += 1
+                for uid, at in batch.items():
+                    cur = self._pending.get(uid)
+                    if cur is None or at > cur:
+                        self._pending[uid] = at
+                raise
+            ms = (time.perf_counter() - started) * 1000
+            self.flushes += 1
+            self.rows_flushed += len(ids)
+            self.last_flush_ms = ms
+            self.max_flush_ms = max(self.max_flush_ms, ms)
+            logger.debug("activity flush: %d users in %.1f ms", len(ids), ms)
+            return len(ids)
+
+    async def _flush_logged(self) -> None:
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("activity flush failed, %d users pending", len(self._pending))
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self._flush_logged()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Останавливает фоновый flush и сбрасывает остаток в БД. Ошибку только
+        логирует: stop() зовётся при завершении, и дальше ещё закрываются
+        storage и пул БД.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._overflow:
+            await asyncio.gather(*self._overflow)
+        await self._flush_logged()
+
+    def metrics(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "peak_pending": self.peak_pending,
+            "events": self.events,
+            "flushes": self.flushes,
+            "rows_flushed": self.rows_flushed,
+            "errors": self.errors,
+            "last_flush_ms": round(self.last_flush_ms, 1),
+            "max_flush_ms": round(self.max_flush_ms, 1),
+        }
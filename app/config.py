@@ -23,6 +23,16 @@ class Config:
     yookassa_secret_key: str | None
     base_currency: str = "RUB"
     log_level: str = "INFO"
+    fsm_storage: str = "postgres"   # memory / postgres / redis
+    redis_url: str | None = None
+    fsm_cache_ttl: float = 2.0      # сек, кэш чтения FSM в процессе (postgres)
+    fsm_ttl_hours: int = 72         # брошенные диалоги удаляются
+    payment_provider: str = "yookassa"      # yookassa / fake (локальная проверка без оплаты)
+    allow_fake_payments: bool = False       # явное разрешение для fake — только для разработки
+    payment_webhook_port: int | None = None  # если задан — слушаем уведомления YooKassa
+    payment_webhook_host: str = "0.0.0.0"
+    payment_webhook_path: str = "/yookassa/webhook"
+    payment_webhook_check_ip: bool = False   # пускать только адреса YooKassa
 
 def load_config() -> Config:
     token = os.getenv("BOT_TOKEN", "").strip()
@@ -42,4 +52,14 @@ def load_config() -> Config:
         yookassa_secret_key=os.getenv("YOOKASSA_SECRET_KEY") or None,
         base_currency=os.getenv("BASE_CURRENCY", "RUB"),
         log_level=os.getenv("LOG_LEVEL", "INFO"),
+        fsm_storage=os.getenv("FSM_STORAGE", "postgres").strip().lower(),
+        redis_url=os.getenv("REDIS_URL") or None,
+        fsm_cache_ttl=float(os.getenv("FSM_CACHE_TTL", "2")),
+        fsm_ttl_hours=int(os.getenv("FSM_TTL_HOURS", "72")),
+        payment_provider=os.getenv("PAYMENT_PROVIDER", "yookassa").strip().lower(),
+        allow_fake_payments=os.getenv("ALLOW_FAKE_PAYMENTS", "0").strip().lower() in ("1", "true", "yes"),
+        payment_webhook_port=int(os.getenv("PAYMENT_WEBHOOK_PORT")) if os.getenv("PAYMENT_WEBHOOK_PORT") else None,
+        payment_webhook_host=os.getenv("PAYMENT_WEBHOOK_HOST", "0.0.0.0"),
+        payment_webhook_path=os.getenv("PAYMENT_WEBHOOK_PATH", "/yookassa/webhook"),
+        payment_webhook_check_ip=os.getenv("PAYMENT_WEBHOOK_CHECK_IP", "0").strip().lower() in ("1", "true", "yes"),
     )
@@ -22,3 +22,7 @@ PACKS = [
     (50, 2990),
     (100, 4990),
 ]
+
+# Пакетная загрузка SKU файлом
+BULK_MAX_ROWS = 10000
+BULK_MAX_FILE_MB = 20  # лимит скачивания файлов в Bot API
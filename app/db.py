@@ -1,6 +1,7 @@
 from __future__ import annotations
 import asyncpg
-from typing import Any
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator
 
 CREATE_SQL = [
     """CREATE TABLE IF NOT EXISTS users (
@@ -48,6 +49,164 @@ CREATE_SQL = [
         updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
         UNIQUE(marketplace, scheme, key)
     );""",
+    # Состояния диалогов aiogram (app/fsm_storage.py)
+    """CREATE TABLE IF NOT EXISTS fsm_states (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data JSONB NOT NULL DEFAULT '{}',
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );""",
+    """CREATE INDEX IF NOT EXISTS fsm_states_updated_idx ON fsm_states (updated_at);""",
+    # Пользователь заблокировал бота / удалил аккаунт (ставит рассылка, снимает любая активность)
+    """ALTER TABLE users ADD COLUMN IF NOT EXISTS blocked_at TIMESTAMPTZ;""",
+    """CREATE INDEX IF NOT EXISTS users_reachable_idx ON users (tg_user_id) WHERE blocked_at IS NULL;""",
+    # «Мои расчёты» и поиск расчёта пользователя — без полного скана calculations
+    """CREATE INDEX IF NOT EXISTS calculations_user_created_idx
+        ON calculations (user_id, created_at DESC);""",
+    # Сверка незавершённых оплат (PaymentPoller): обходит только PENDING
+    """CREATE INDEX IF NOT EXISTS payments_pending_idx ON payments (id) WHERE status = 'PENDING';""",
+    # Счётчики для админ-статистики: ведутся триггерами в тех же транзакциях,
+    # что и изменения users/calculations/payments. Строки-слоты (slot 1..8 по
+    # backend pid) убирают конкуренцию за одну строку; slot 0 — базовая строка
+    # из Repo.rebuild_stats(). Итог = SUM по всем слотам.
+    """CREATE TABLE IF NOT EXISTS stats_counters (
+        slot SMALLINT PRIMARY KEY,
+        users_total BIGINT NOT NULL DEFAULT 0,
+        users_started BIGINT NOT NULL DEFAULT 0,
+        starts_total BIGINT NOT NULL DEFAULT 0,
+        calculations_total BIGINT NOT NULL DEFAULT 0,
+        free_calculations BIGINT NOT NULL DEFAULT 0,
+        paid_calculations BIGINT NOT NULL DEFAULT 0,
+        payments_count BIGINT NOT NULL DEFAULT 0,
+        payments_sum_rub BIGINT NOT NULL DEFAULT 0
+    );""",
+    """ALTER TABLE stats_counters ADD COLUMN IF NOT EXISTS users_blocked BIGINT NOT NULL DEFAULT 0;""",
+    """CREATE OR REPLACE FUNCTION stats_bump_blocked(d BIGINT) RETURNS void LANGUAGE sql AS $$
+        INSERT INTO stats_counters AS s (slot, users_blocked) VALUES (1 + pg_backend_pid() % 8, d)
+        ON CONFLICT (slot) DO UPDATE SET users_blocked = s.users_blocked + EXCLUDED.users_blocked
+    $$;""",
+    """CREATE OR REPLACE FUNCTION stats_users_blocked_trg() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        PERFORM stats_bump_blocked(CASE WHEN NEW.blocked_at IS NULL THEN -1 ELSE 1 END);
+        RETURN NULL;
+    END $$;""",
+    """CREATE OR REPLACE FUNCTION stats_bump(
+        d_users_total BIGINT DEFAULT 0, d_users_started BIGINT DEFAULT 0, d_starts_total BIGINT DEFAULT 0,
+        d_calculations_total BIGINT DEFAULT 0, d_free_calculations BIGINT DEFAULT 0,
+        d_paid_calculations BIGINT DEFAULT 0, d_payments_count BIGINT DEFAULT 0, d_payments_sum_rub BIGINT DEFAULT 0
+    ) RETURNS void LANGUAGE sql AS $$
+        INSERT INTO stats_counters AS s (slot, users_total, users_started, starts_total, calculations_total,
+                                         free_calculations, paid_calculations, payments_count, payments_sum_rub)
+        VALUES (1 + pg_backend_pid() % 8, d_users_total, d_users_started, d_starts_total, d_calculations_total,
+                d_free_calculations, d_paid_calculations, d_payments_count, d_payments_sum_rub)
+        ON CONFLICT (slot) DO UPDATE SET
+            users_total = s.users_total + EXCLUDED.users_total,
+            users_started = s.users_started + EXCLUDED.users_started,
+            starts_total = s.starts_total + EXCLUDED.starts_total,
+            calculations_total = s.calculations_total + EXCLUDED.calculations_total,
+            free_calculations = s.free_calculations + EXCLUDED.free_calculations,
+            paid_calculations = s.paid_calculations + EXCLUDED.paid_calculations,
+            payments_count = s.payments_count + EXCLUDED.payments_count,
+            payments_sum_rub = s.payments_sum_rub + EXCLUDED.payments_sum_rub
+    $$;""",
+    # users: по строке (вставки единичные, UPDATE только при смене started_count)
+    """CREATE OR REPLACE FUNCTION stats_users_trg() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            PERFORM stats_bump(d_users_total => 1, d_users_started => (NEW.started_count > 0)::int,
+                               d_starts_total => NEW.started_count);
+        ELSIF TG_OP = 'UPDATE' THEN
+            PERFORM stats_bump(d_users_started => (NEW.started_count > 0)::int - (OLD.started_count > 0)::int,
+                               d_starts_total => NEW.started_count - OLD.started_count);
+        ELSE
+            PERFORM stats_bump(d_users_total => -1, d_users_started => -(OLD.started_count > 0)::int,
+                               d_starts_total => -OLD.started_count);
+            IF OLD.blocked_at IS NOT NULL THEN
+                PERFORM stats_bump_blocked(-1);
+            END IF;
+        END IF;
+        RETURN NULL;
+    END $$;""",
+    # calculations: на оператор через transition tables — пакетный COPY даёт одно обновление
+    """CREATE OR REPLACE FUNCTION stats_calculations_trg() RETURNS trigger LANGUAGE plpgsql AS $$
+    DECLARE
+        k INT := CASE WHEN TG_OP = 'INSERT' THEN 1 ELSE -1 END;
+        c_all BIGINT; c_free BIGINT; c_paid BIGINT;
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            SELECT COUNT(*), COUNT(*) FILTER (WHERE used_credit_type='FREE'), COUNT(*) FILTER (WHERE used_credit_type='PAID')
+              INTO c_all, c_free, c_paid FROM new_rows;
+        ELSE
+            SELECT COUNT(*), COUNT(*) FILTER (WHERE used_credit_type='FREE'), COUNT(*) FILTER (WHERE used_credit_type='PAID')
+              INTO c_all, c_free, c_paid FROM old_rows;
+        END IF;
+        IF c_all > 0 THEN
+            PERFORM stats_bump(d_calculations_total => k * c_all, d_free_calculations => k * c_free,
+                               d_paid_calculations => k * c_paid);
+        END IF;
+        RETURN NULL;
+    END $$;""",
+    # payments: учитываются только SUCCEEDED
+    """CREATE OR REPLACE FUNCTION stats_payments_trg() RETURNS trigger LANGUAGE plpgsql AS $$
+    DECLARE
+        d_cnt BIGINT := 0; d_sum BIGINT := 0;
+    BEGIN
+        IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.status = 'SUCCEEDED' THEN
+            d_cnt := d_cnt + 1; d_sum := d_sum + NEW.amount_rub;
+        END IF;
+        IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.status = 'SUCCEEDED' THEN
+            d_cnt := d_cnt - 1; d_sum := d_sum - OLD.amount_rub;
+        END IF;
+        IF d_cnt <> 0 OR d_sum <> 0 THEN
+            PERFORM stats_bump(d_payments_count => d_cnt, d_payments_sum_rub => d_sum);
+        END IF;
+        RETURN NULL;
+    END $$;""",
+    # Рассылки: задание + получатели; воркер забирает PENDING пачками (SKIP LOCKED)
+    """CREATE TABLE IF NOT EXISTS broadcasts (
+        id BIGSERIAL PRIMARY KEY,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        created_by BIGINT NOT NULL,
+        segment TEXT NOT NULL,
+        text TEXT NOT NULL,
+        media TEXT,
+        media_type TEXT,
+        status TEXT NOT NULL DEFAULT 'RUNNING',
+        total INT NOT NULL DEFAULT 0,
+        progress_chat_id BIGINT,
+        progress_message_id BIGINT,
+        finished_at TIMESTAMPTZ
+    );""",
+    """CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+        broadcast_id BIGINT NOT NULL REFERENCES broadcasts(id) ON DELETE CASCADE,
+        tg_user_id BIGINT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'PENDING',
+        claimed_at TIMESTAMPTZ,
+        sent_at TIMESTAMPTZ,
+        PRIMARY KEY (broadcast_id, tg_user_id)
+    );""",
+    """CREATE INDEX IF NOT EXISTS broadcast_deliveries_open_idx
+        ON broadcast_deliveries (broadcast_id, tg_user_id) WHERE status IN ('PENDING', 'SENDING');""",
+    """DROP TRIGGER IF EXISTS stats_users_ins_del ON users;""",
+    """CREATE TRIGGER stats_users_ins_del AFTER INSERT OR DELETE ON users
+        FOR EACH ROW EXECUTE FUNCTION stats_users_trg();""",
+    """DROP TRIGGER IF EXISTS stats_users_upd ON users;""",
+    """CREATE TRIGGER stats_users_upd AFTER UPDATE OF started_count ON users
+        FOR EACH ROW WHEN (OLD.started_count IS DISTINCT FROM NEW.started_count)
+        EXECUTE FUNCTION stats_users_trg();""",
+    """DROP TRIGGER IF EXISTS stats_users_blocked ON users;""",
+    """CREATE TRIGGER stats_users_blocked AFTER UPDATE OF blocked_at ON users
+        FOR EACH ROW WHEN ((OLD.blocked_at IS NULL) <> (NEW.blocked_at IS NULL))
+        EXECUTE FUNCTION stats_users_blocked_trg();""",
+    """DROP TRIGGER IF EXISTS stats_calculations_ins ON calculations;""",
+    """CREATE TRIGGER stats_calculations_ins AFTER INSERT ON calculations
+        REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION stats_calculations_trg();""",
+    """DROP TRIGGER IF EXISTS stats_calculations_del ON calculations;""",
+    """CREATE TRIGGER stats_calculations_del AFTER DELETE ON calculations
+        REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION stats_calculations_trg();""",
+    """DROP TRIGGER IF EXISTS stats_payments ON payments;""",
+    """CREATE TRIGGER stats_payments AFTER INSERT OR UPDATE OF status, amount_rub OR DELETE ON payments
+        FOR EACH ROW EXECUTE FUNCTION stats_payments_trg();""",
 ]
 
 class Database:
@@ -75,6 +234,11 @@ class Database:
         async with self.pool.acquire() as conn:
             return await conn.fetch(sql, *args)
 
+    async def fetchval(self, sql: str, *args) -> Any:
+        assert self.pool
+        async with self.pool.acquire() as conn:
+            return await conn.fetchval(sql, *args)
+
     async def execute(self, sql: str, *args) -> str:
         assert self.pool
         async with self.pool.acquire() as conn:
@@ -84,3 +248,10 @@ class Database:
         assert self.pool
         async with self.pool.acquire() as conn:
             await conn.executemany(sql, args_list)
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[asyncpg.Connection]:
+        assert self.pool
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                yield conn
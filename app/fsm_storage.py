@@ -0,0 +1,155 @@
+from __future__ import annotations
+import asyncio
+import json
+import logging
+import math
+import time
+from typing import Any, Mapping
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from app.config import Config
+from app.db import Database
+
+logger = logging.getLogger(__name__)
+
+
+def _jsonable(v: Any) -> Any:
+    # JSONB не принимает NaN/Infinity
+    if isinstance(v, float) and not math.isfinite(v):
+        return None
+    if isinstance(v, dict):
+        return {k: _jsonable(x) for k, x in v.items()}
+    if isinstance(v, (list, tuple)):
+        return [_jsonable(x) for x in v]
+    return v
+
+
+class PostgresStorage(BaseStorage):
+    """
+    FSM aiogram в таблице fsm_states (state + data JSONB на ключ чат/пользователь).
+    Запись — сразу в БД, чтение — через короткоживущий кэш в процессе:
+    за один апдейт хендлеры многократно зовут get_state/get_data, и это
+    не должно каждый раз идти в базу. cache_ttl держим маленьким, если
+    апдейты одного пользователя могут попасть в разные процессы.
+    set_state пишет только state, set_data — только data: апдейты
+    обрабатываются параллельно, и запись одного поля не должна затирать
+    другое. Кэш обновляется строкой, которую вернул upsert.
+    Пустые записи удаляются сразу, брошенные диалоги — по max_age.
+    """
+
+    def __init__(self, db: Database, *, cache_ttl: float = 2.0, max_age_hours: int = 72,
+                 cleanup_interval: float = 3600.0, key_builder: KeyBuilder | None = None):
+        self.db = db
+        self.cache_ttl = cache_ttl
+        self.max_age_hours = max_age_hours
+        self.cleanup_interval = cleanup_interval
+        self.key_builder = key_builder or DefaultKeyBuilder()
+        self._cache: dict[str, tuple[float, str | None, dict]] = {}
+        self._task: asyncio.Task | None = None
+
+    async def _load(self, key: str) -> tuple[str | None, dict]:
+        hit = self._cache.get(key)
+        if hit is not None and hit[0] > time.monotonic():
+            return hit[1], hit[2]
+        row = await self.db.fetchrow("SELECT state, data FROM fsm_states WHERE key=$1", key)
+        state, data = (row["state"], json.loads(row["data"])) if row else (None, {})
+        self._remember(key, state, data)
+        return state, data
+
+    def _remember(self, key: str, state: str | None, data: dict) -> None:
+        self._cache[key] = (time.monotonic() + self.cache_ttl, state, data)
+        if len(self._cache) > 10000:
+            now = time.monotonic()
+            self._cache = {k: v for k, v in self._cache.items() if v[0] > now}
+
+    async def _saved(self, key: str, row) -> None:
+        state, data = row["state"], json.loads(row["data"])
+        if state is None and not data:
+            # пустую запись удаляем, если её не успели заполнить параллельно
+            await self.db.execute(
+                "DELETE FROM fsm_states WHERE key=$1 AND state IS NULL AND data='{}'::jsonb", key
+            )
+        self._remember(key, state, data)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        k = self.key_builder.build(key)
+        row = await self.db.fetchrow(
+            """INSERT INTO fsm_states (key, state, updated_at) VALUES ($1, $2, now())
+               ON CONFLICT (key) DO UPDATE SET state=EXCLUDED.state, updated_at=now()
+               RETURNING state, data""",
+            k, state.state if isinstance(state, State) else state
+        )
+        await self._saved(k, row)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        state, _ = await self._load(self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        k = self.key_builder.build(key)
+        row = await self.db.fetchrow(
+            """INSERT INTO fsm_states (key, data, updated_at) VALUES ($1, $2::jsonb, now())
+               ON CONFLICT (key) DO UPDATE SET data=EXCLUDED.data, updated_at=now()
+               RETURNING state, data""",
+            k, json.dumps(_jsonable(dict(data)), ensure_ascii=False)
+        )
+        await self._saved(k, row)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        _, data = await self._load(self.key_builder.build(key))
+        return dict(data)  # копия: вызывающий код может менять словарь
+
+    async def cleanup(self) -> int:
+        """Удаляет диалоги, не менявшиеся дольше max_age_hours."""
+        res = await self.db.execute(
+            "DELETE FROM fsm_states WHERE updated_at < now() - make_interval(hours => $1)", self.max_age_hours
+        )
+        return int(res.split()[-1])
+
+    async def _run_cleanup(self) -> None:
+        while True:
+            try:
+                n = await self.cleanup()
+                if n:
+                    logger.info("fsm cleanup: %d stale states removed", n)
+            except Exception:
+                logger.exception("fsm cleanup failed")
+            await asyncio.sleep(self.cleanup_interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run_cleanup())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._cache.clear()
+
+
+def create_storage(config: Config, db: Database) -> BaseStorage:
+    """FSM storage по FSM_STORAGE: memory / postgres (по умолчанию) / redis."""
+    kind = config.fsm_storage
+    if kind == "memory":
+        return MemoryStorage()
+    if kind == "redis":
+        if not config.redis_url:
+            raise RuntimeError("REDIS_URL is required for FSM_STORAGE=redis")
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+        except ImportError as e:
+            raise RuntimeError("FSM_STORAGE=redis needs the 'redis' package (pip install redis)") from e
+        return RedisStorage.from_url(config.redis_url, state_ttl=config.fsm_ttl_hours * 3600,
+                                     data_ttl=config.fsm_ttl_hours * 3600)
+    if kind == "postgres":
+        storage = PostgresStorage(db, cache_ttl=config.fsm_cache_ttl, max_age_hours=config.fsm_ttl_hours)
+        storage.start()
+        return storage
+    raise RuntimeError(f"Unknown FSM_STORAGE: {kind}")
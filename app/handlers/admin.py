@@ -1,15 +1,20 @@
 from __future__ import annotations
 
-import csv
+import asyncio
+import logging
+import math
+import os
+import tempfile
 
 from aiogram import Router, F, Bot
-from aiogram.types import Message, CallbackQuery, BufferedInputFile
-from aiogram.types import BufferedInputFile
+from aiogram.types import Message, CallbackQuery, FSInputFile
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 
 from app.config import Config
 from app.repo import Repo
+from app.activity import ActivityBuffer
+from app.services.payments import LATENCY_BUCKETS_MS, PaymentProvider
 from app.keyboards import (
     admin_menu_kb,
     admin_broadcast_segment_kb,
@@ -17,9 +22,11 @@ from app.keyboards import (
     admin_broadcast_confirm_kb,
 )
 from app.states import BroadcastFlow, AdminCreditsFlow
-from app.services.export_xlsx import build_admin_export
+from app.services.export_xlsx import AdminExportWriter
+from app.services.broadcast import RecipientCsv
 
 router = Router()
+logger = logging.getLogger(__name__)
 
 
 def _is_admin(user_id: int, config: Config) -> bool:
@@ -40,7 +47,8 @@ async def admin_entry(message: Message, config: Config):
 
 
 @router.callback_query(F.data == "admin:stats")
-async def admin_stats(cb: CallbackQuery, repo: Repo, config: Config):
+async def admin_stats(cb: CallbackQuery, repo: Repo, config: Config, activity: ActivityBuffer | None = None,
+                      payments: PaymentProvider | None = None):
     if not _is_admin(cb.from_user.id, config):
         return
     s = await repo.admin_stats()
@@ -48,6 +56,7 @@ async def admin_stats(cb: CallbackQuery, repo: Repo, config: Config):
         "📊 Статистика\n\n"
         f"• Пользователей в базе: {s['users_total']}\n"
         f"• Пользователей запускали бота: {s['users_started']}\n"
+        f"• Доступны для рассылки: {s['users_reachable']} (заблокировали бота: {s['users_blocked']})\n"
         f"• Всего запусков (/start): {s['starts_total']}\n"
         f"• Всего расчётов: {s['calculations_total']}\n"
         f"• Бесплатных расчётов: {s['free_calculations']}\n"
@@ -55,9 +64,42 @@ async def admin_stats(cb: CallbackQuery, repo: Repo, config: Config):
         f"• Покупок: {s['payments_count']}\n"
         f"• Сумма покупок: {s['payments_sum_rub']} ₽\n"
     )
+    if activity is not None:
+        m = activity.metrics()
+        text += (
+            f"\n• Буфер активности: {m['pending']} (пик {m['peak_pending']}), "
+            f"flush {m['last_flush_ms']} мс (макс {m['max_flush_ms']}), ошибок {m['errors']}\n"
+        )
+    if payments is not None and payments.enabled:
+        pm = payments.metrics
+        p95 = pm.percentile(0.95)
+        if p95 is None:
+            p95_text = "—"
+        elif math.isinf(p95):
+            p95_text = f"> {LATENCY_BUCKETS_MS[-1]} мс"
+        else:
+            p95_text = f"≤ {p95:.0f} мс"
+        text += (
+            f"• Платежи ({payments.name}): запросов {sum(pm.calls.values())}, "
+            f"p95 {p95_text}, "
+            f"ошибок {sum(pm.errors.values())}, ретраев {pm.retries}\n"
+        )
     await cb.message.edit_text(text, reply_markup=admin_menu_kb())
 
 
+@router.message(Command("stats_rebuild"))
+async def admin_stats_rebuild(message: Message, repo: Repo, config: Config):
+    """Пересчёт счётчиков статистики по таблицам (после ручных правок/бэкфилла)."""
+    if not _is_admin(message.from_user.id, config):
+        return
+    s = await repo.rebuild_stats()
+    await message.answer(
+        f"Счётчики пересчитаны: пользователей {s['users_total']}, расчётов {s['calculations_total']}, "
+        f"покупок {s['payments_count']}.",
+        reply_markup=admin_menu_kb(),
+    )
+
+
 # --- экспорт ---
 
 
@@ -66,21 +108,24 @@ async def admin_export(cb: CallbackQuery, repo: Repo, config: Config, bot: Bot):
     if not _is_admin(cb.from_user.id, config):
         return
 
+    await cb.answer("Готовлю выгрузку…")
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
     try:
-        users_rows, payments_rows = await repo.admin_export_rows()
-        xlsx_bytes = build_admin_export(users_rows, payments_rows)
-        
-        if not xlsx_bytes or len(xlsx_bytes) < 100:
-            await cb.answer("Ошибка: файл не сгенерирован или слишком мал", show_alert=True)
-            return
-            
-        doc = BufferedInputFile(xlsx_bytes, filename="admin_export.xlsx")
-        await bot.send_document(cb.from_user.id, doc)
-        await cb.answer("✅ Экспорт отправлен", show_alert=False)
-        
+        # БД читается курсором пачками, запись в xlsx — вне event loop
+        writer = await asyncio.to_thread(AdminExportWriter)
+        async for chunk in repo.iter_export_users():
+            await asyncio.to_thread(writer.add_users, chunk)
+        async for chunk in repo.iter_export_payments():
+            await asyncio.to_thread(writer.add_payments, chunk)
+        await asyncio.to_thread(writer.save, path)
+
+        await bot.send_document(cb.from_user.id, FSInputFile(path, filename="admin_export.xlsx"))
     except Exception as e:
-        await cb.answer(f"Ошибка экспорта: {str(e)[:50]}", show_alert=True)
-        print(f"Export error: {e}")  # Для логов
+        logger.exception("admin export failed")
+        await bot.send_message(cb.from_user.id, f"Ошибка экспорта: {str(e)[:200]}")
+    finally:
+        os.remove(path)
 
 
 # --- начисление SKU ---
@@ -187,9 +232,10 @@ async def admin_credits_user_amount(
 
 
 @router.callback_query(F.data == "admin:broadcast:start")
-async def bc_start(cb: CallbackQuery, state: FSMContext, config: Config):
+async def bc_start(cb: CallbackQuery, state: FSMContext, repo: Repo, config: Config):
     if not _is_admin(cb.from_user.id, config):
         return
+    await _drop_draft(state, repo)
     await state.clear()
     await state.set_state(BroadcastFlow.choosing_segment)
     await cb.message.edit_text(
@@ -198,13 +244,22 @@ async def bc_start(cb: CallbackQuery, state: FSMContext, config: Config):
     )
 
 
+async def _drop_draft(state: FSMContext, repo: Repo) -> None:
+    """Удаляет неподтверждённый черновик рассылки из FSM (если был)."""
+    bid = (await state.get_data()).get("broadcast_id")
+    if bid:
+        await repo.delete_broadcast_draft(bid)
+
+
 @router.callback_query(F.data.startswith("admin:broadcast:seg:"))
 async def bc_segment(cb: CallbackQuery, state: FSMContext, repo: Repo, config: Config):
     if not _is_admin(cb.from_user.id, config):
         return
     seg = cb.data.split(":")[-1]
+    await _drop_draft(state, repo)
+    # в FSM — только id черновика и число получателей, сам список лежит в БД
     await state.update_data(
-        segment=seg, user_ids=None, text=None, media=None, media_type=None
+        segment=seg, broadcast_id=None, recipients=0, text=None, media=None, media_type=None
     )
     if seg == "csv":
         await state.set_state(BroadcastFlow.waiting_csv)
@@ -214,48 +269,49 @@ async def bc_segment(cb: CallbackQuery, state: FSMContext, repo: Repo, config: C
         )
         return
 
-    user_ids = await repo.list_user_ids(seg)
-    await state.update_data(user_ids=user_ids)
+    bid, total = await repo.create_broadcast_draft(created_by=cb.from_user.id, segment=seg)
+    await state.update_data(broadcast_id=bid, recipients=total)
     await state.set_state(BroadcastFlow.waiting_text)
     await cb.message.edit_text(
-        f"Сегмент выбран. Получателей: {len(user_ids)}\n\n"
+        f"Сегмент выбран. Получателей: {total}\n\n"
         f"Пришлите текст рассылки.",
         reply_markup=None,
     )
 
 
 @router.message(BroadcastFlow.waiting_csv)
-async def bc_csv(message: Message, state: FSMContext, config: Config, bot: Bot):
+async def bc_csv(message: Message, state: FSMContext, repo: Repo, config: Config, bot: Bot):
     if not _is_admin(message.from_user.id, config):
         return
     if not message.document:
         await message.answer("Нужен CSV-файл документом.")
         return
-    file = await bot.get_file(message.document.file_id)
-    content = await bot.download_file(file.file_path)
-    data = content.read()
-    user_ids: list[int] = []
+    fd, path = tempfile.mkstemp(suffix=".csv")
+    os.close(fd)
     try:
-        text = data.decode("utf-8-sig")
-        reader = csv.reader(text.splitlines())
-        for row in reader:
-            if not row:
-                continue
-            cell = row[0].strip()
-            if not cell or not cell.isdigit():
-                continue
-            user_ids.append(int(cell))
+        # файл — на диск, разбор — пачками, дедуп и сверка с users — в БД
+        await bot.download(message.document, destination=path)
+        reader = RecipientCsv(path)
+        bid, summary = await repo.create_broadcast_draft_from_chunks(
+            created_by=message.from_user.id, chunks=reader.achunks()
+        )
     except Exception:
+        logger.exception("broadcast csv upload failed")
         await message.answer(
             "Не смог прочитать CSV. Формат: одна колонка с числовыми user_id."
         )
         return
+    finally:
+        os.remove(path)
 
-    user_ids = sorted(set(user_ids))
-    await state.update_data(user_ids=user_ids, segment="csv")
+    await state.update_data(broadcast_id=bid, recipients=summary["valid"], segment="csv")
     await state.set_state(BroadcastFlow.waiting_text)
     await message.answer(
-        f"CSV загружен. Получателей: {len(user_ids)}\n\nПришлите текст рассылки."
+        f"CSV загружен: строк с id {summary['uploaded']}, нечисловых строк {reader.invalid}.\n"
+        f"• дубликатов: {summary['duplicates']}\n"
+        f"• нет в базе бота: {summary['unknown']}\n"
+        f"• заблокировали бота: {summary['blocked']}\n"
+        f"Получателей: {summary['valid']}\n\nПришлите текст рассылки."
     )
 
 
@@ -316,7 +372,7 @@ async def bc_media(message: Message, state: FSMContext, config: Config):
 
 async def _bc_preview(message_or_msg, state: FSMContext, config: Config):
     data = await state.get_data()
-    user_ids = data.get("user_ids") or []
+    recipients = data.get("recipients") or 0
     txt = data.get("text") or ""
     media = data.get("media")
     media_type = data.get("media_type")
@@ -324,7 +380,7 @@ async def _bc_preview(message_or_msg, state: FSMContext, config: Config):
 
     await message_or_msg.answer(
         f"👀 Предпросмотр рассылки\n"
-        f"Получателей: {len(user_ids)}\n\n"
+        f"Получателей: {recipients}\n\n"
         f"Текст:\n{txt}"
     )
     if media:
@@ -343,56 +399,31 @@ async def _bc_preview(message_or_msg, state: FSMContext, config: Config):
 
 
 @router.callback_query(F.data == "admin:broadcast:confirm")
-async def bc_confirm(cb: CallbackQuery, state: FSMContext, config: Config, bot: Bot):
+async def bc_confirm(cb: CallbackQuery, state: FSMContext, repo: Repo, config: Config):
     if not _is_admin(cb.from_user.id, config):
         return
     data = await state.get_data()
-    user_ids = data.get("user_ids") or []
-    txt = data.get("text") or ""
-    media = data.get("media")
-    media_type = data.get("media_type")
-    await cb.message.edit_text(
-        f"🚀 Запускаю рассылку… Получателей: {len(user_ids)}"
-    )
+    bid = data.get("broadcast_id")
+    total = await repo.start_broadcast(
+        bid, text=data.get("text") or "", media=data.get("media"), media_type=data.get("media_type")
+    ) if bid else None
     await state.clear()
-
-    sent = 0
-    failed = 0
-    for uid in user_ids:
-        try:
-            if media:
-                if media_type == "photo":
-                    await bot.send_photo(uid, media, caption=txt)
-                elif media_type == "video":
-                    await bot.send_video(uid, media, caption=txt)
-                elif media_type == "animation":
-                    await bot.send_animation(uid, media, caption=txt)
-                elif media_type == "document":
-                    await bot.send_document(uid, media, caption=txt)
-                else:
-                    await bot.send_message(uid, txt)
-            else:
-                await bot.send_message(uid, txt)
-            sent += 1
-        except Exception:
-            failed += 1
-        if (sent + failed) % 50 == 0:
-            try:
-                await cb.message.answer(
-                    f"Прогресс: {sent} отправлено, {failed} ошибок…"
-                )
-            except Exception:
-                pass
-
-    await cb.message.answer(
-        f"✅ Рассылка завершена. Отправлено: {sent}, ошибок: {failed}"
+    if total is None:
+        await cb.message.edit_text("Черновик рассылки не найден — начните заново.", reply_markup=admin_menu_kb())
+        return
+    await cb.message.edit_text(
+        f"🚀 Рассылка #{bid} поставлена в очередь. Получателей: {total}"
     )
+    # прогресс обновляет BroadcastWorker в этом сообщении
+    status_msg = await cb.message.answer(f"📣 Рассылка #{bid}: 0/{total}")
+    await repo.set_broadcast_progress_message(bid, status_msg.chat.id, status_msg.message_id)
 
 
 @router.callback_query(F.data == "admin:broadcast:cancel")
-async def bc_cancel(cb: CallbackQuery, state: FSMContext, config: Config):
+async def bc_cancel(cb: CallbackQuery, state: FSMContext, repo: Repo, config: Config):
     if not _is_admin(cb.from_user.id, config):
         return
+    await _drop_draft(state, repo)
     await state.clear()
     await cb.message.edit_text(
         "Рассылка отменена.",
@@ -5,7 +5,7 @@ from aiogram.fsm.context import FSMContext
 from app.config import Config
 from app.repo import Repo
 from app.keyboards import packs_kb, main_menu_kb, yes_no_kb
-from app.services.payments import YooKassaClient
+from app.services.payments import PaymentError, PaymentProvider
 
 router = Router()
 
@@ -14,24 +14,27 @@ async def buy_back(cb: CallbackQuery):
     await cb.message.edit_text("Меню:", reply_markup=main_menu_kb())
 
 @router.callback_query(F.data.startswith("buy:pack:"))
-async def buy_pack(cb: CallbackQuery, repo: Repo, config: Config, state: FSMContext):
+async def buy_pack(cb: CallbackQuery, repo: Repo, config: Config, state: FSMContext, payments: PaymentProvider):
     parts = cb.data.split(":")
     credits = int(parts[-2])
     price = int(parts[-1])
 
-    if not (config.yookassa_shop_id and config.yookassa_secret_key):
+    if not payments.enabled:
         await cb.answer("YooKassa не настроена. Добавьте YOOKASSA_SHOP_ID и YOOKASSA_SECRET_KEY в .env", show_alert=True)
         return
 
-    client = YooKassaClient(config.yookassa_shop_id, config.yookassa_secret_key)
     return_url = "https://t.me/"  # not used by bot, required by YooKassa; can be any
     desc = f"Пакет {credits} SKU"
-    pay = client.create_payment(price, desc, return_url)
+    try:
+        pay = await payments.create_payment(price, desc, return_url)
+    except PaymentError:
+        await cb.answer("Платёжный сервис сейчас недоступен. Попробуйте через минуту.", show_alert=True)
+        return
 
     # store pending in FSM to check later
     await state.update_data(pending_payment_id=pay.payment_id, pending_pack_credits=credits, pending_pack_price=price)
     await repo.create_payment_record(
-        cb.from_user.id, provider="yookassa", provider_payment_id=pay.payment_id,
+        cb.from_user.id, provider=payments.name, provider_payment_id=pay.payment_id,
         status="PENDING", pack_credits=credits, amount_rub=price, raw={"confirmation_url": pay.confirmation_url}
     )
 
@@ -44,26 +47,31 @@ async def buy_pack(cb: CallbackQuery, repo: Repo, config: Config, state: FSMCont
     await cb.message.edit_text(text, reply_markup=yes_no_kb("buy:check", "menu", yes_text="✅ Я оплатил", no_text="🏠 В меню"))
 
 @router.callback_query(F.data == "buy:check")
-async def buy_check(cb: CallbackQuery, repo: Repo, config: Config, state: FSMContext):
+async def buy_check(cb: CallbackQuery, repo: Repo, config: Config, state: FSMContext, payments: PaymentProvider):
     data = await state.get_data()
     pay_id = data.get("pending_payment_id")
-    credits = data.get("pending_pack_credits")
     price = data.get("pending_pack_price")
     if not pay_id:
         await cb.answer("Нет ожидаемой оплаты.", show_alert=True)
         return
 
-    client = YooKassaClient(config.yookassa_shop_id, config.yookassa_secret_key)
-    status = client.get_status(pay_id)
+    try:
+        status = await payments.get_status(pay_id)
+    except PaymentError:
+        await cb.answer("Не удалось проверить оплату. Попробуйте через минуту.", show_alert=True)
+        return
 
     if status == "succeeded":
-        await repo.update_payment_status(pay_id, "SUCCEEDED", {"status": status})
-        await repo.add_paid_credits(cb.from_user.id, int(credits))
+        # начисление и баланс — одним запросом; повторный тап или уже
+        # сработавший поллер/вебхук второй раз не начислят
+        res = await repo.settle_payment(pay_id, "SUCCEEDED", {"status": status})
         await state.update_data(pending_payment_id=None, pending_pack_credits=None, pending_pack_price=None)
-        u = await repo.get_user(cb.from_user.id)
+        if res is None:
+            await cb.message.edit_text("Платёж не найден. Напишите в поддержку.", reply_markup=main_menu_kb())
+            return
         await cb.message.edit_text(
-            f"✅ Оплата подтверждена! Начислено {credits} SKU.\n"
-            f"Доступно: бесплатных {u['free_credits']}, платных {u['paid_credits']}.",
+            f"✅ Оплата подтверждена! Начислено {res['credits']} SKU.\n"
+            f"Доступно: бесплатных {res['free_credits']}, платных {res['paid_credits']}.",
             reply_markup=main_menu_kb()
         )
         return
@@ -73,6 +81,6 @@ async def buy_check(cb: CallbackQuery, repo: Repo, config: Config, state: FSMCon
         return
 
     # canceled/failed
-    await repo.update_payment_status(pay_id, status.upper(), {"status": status})
+    await repo.settle_payment(pay_id, status.upper(), {"status": status})
     await state.update_data(pending_payment_id=None, pending_pack_credits=None, pending_pack_price=None)
     await cb.message.edit_text("Оплата не прошла или отменена. Можете попробовать снова:", reply_markup=packs_kb())
@@ -1,7 +1,10 @@
 from __future__ import annotations
 
+import asyncio
 import json
 import logging
+import os
+import tempfile
 
 from aiogram import Router, F, Bot
 from aiogram.types import BufferedInputFile, Message, CallbackQuery, InlineKeyboardButton
@@ -21,9 +24,25 @@ from app.keyboards import (
     result_kb,
     packs_kb,
     result_saved_kb,
+    bulk_upload_kb,
+    elasticity_kb,
+    ads_response_kb,
 )
-from app.states import CalcFlow
-from app.services.calc import CalcInputs, compute
+from app.constants import BULK_MAX_FILE_MB, BULK_MAX_ROWS
+from app.states import BulkFlow, CalcFlow
+from app.services.bulk_import import BulkFileError, compute_rows, parse_file
+from app.reference_data import get_default_input
+from app.services.calc import (
+    ADS_RESPONSE_TABLES,
+    CalcInputs,
+    compute,
+    optimize_price,
+    price_grid,
+    simulate_risk,
+    sweep_price,
+)
+from app.services.charts import build_profit_chart
+from app.services.export_xlsx import build_bulk_result
 from app.services.pdf_report import build_pdf
 from app.utils import fmt_money, fmt_pct
 
@@ -61,7 +80,8 @@ def _notes(data_inputs: dict) -> tuple[str, list[str]]:
     defaults = [
         k
         for k, v in data_inputs.items()
-        if v.get("source") == "DEFAULT" and float(v.get("value") or 0) != 0
+        if v.get("source") == "DEFAULT"
+        and (isinstance(v.get("value"), str) or float(v.get("value") or 0) != 0)
     ]
     zeros = [
         k
@@ -86,6 +106,41 @@ def _notes(data_inputs: dict) -> tuple[str, list[str]]:
     return lvl, notes
 
 
+# Риск-режим: разброс справочных значений и распределение доли возвратов
+RISK_SPREAD = 0.3
+RISK_RETURNS = (0.0, 0.05, 0.25)  # min, наиболее вероятная, max
+RISK_SAMPLES = 20000
+
+
+def _risk_ranges(data_inputs: dict, mp: str | None, scheme: str | None) -> dict:
+    """Диапазоны (min, mode, max) для неточных полей — тех же DEFAULT/ZERO, что в _notes."""
+    ranges = {}
+    for k, v in data_inputs.items():
+        source, value = v.get("source"), v.get("value")
+        if source not in ("DEFAULT", "ZERO") or isinstance(value, str):
+            continue
+        value = float(value or 0)
+        if source == "ZERO":
+            if k == "returns_pct":
+                ranges[k] = RISK_RETURNS
+                continue
+            # «не учитывать» → от 0 до справочного значения с запасом
+            ref = get_default_input(mp, scheme, k)
+            if ref > 0:
+                ranges[k] = (0.0, 0.0, ref * (1 + RISK_SPREAD))
+            continue
+        ranges[k] = (value * (1 - RISK_SPREAD), value, value * (1 + RISK_SPREAD))
+    return ranges
+
+
+def _risk_summary(ci: CalcInputs, data_inputs: dict, mp: str | None, scheme: str | None) -> dict | None:
+    ranges = _risk_ranges(data_inputs, mp, scheme)
+    if not ranges:
+        return None
+    # фиксированный seed — одинаковый результат при повторном открытии расчёта
+    return simulate_risk(ci, ranges, samples=RISK_SAMPLES, seed=0)
+
+
 def _build_calcinputs(data_inputs: dict) -> CalcInputs:
     return CalcInputs(
         price=float(_get_input(data_inputs, "price")),
@@ -185,7 +240,7 @@ def _field_prompt(field: str, state_data: dict) -> tuple[str, str]:
     
     # Динамические подсказки
     if field == "commission_value":
-        cm = (state_data.get("inputs", {}).get("commission_mode", {}) or {}).get("value")
+        cm = _load_inputs(state_data).get("commission_mode", {}).get("value")
         if cm == "PCT":
             return (
                 "🏪 <b>Введите комиссию маркетплейса (%)</b>",
@@ -197,7 +252,7 @@ def _field_prompt(field: str, state_data: dict) -> tuple[str, str]:
         )
     
     if field == "ads_value":
-        am = (state_data.get("inputs", {}).get("ads_mode", {}) or {}).get("value")
+        am = _load_inputs(state_data).get("ads_mode", {}).get("value")
         if am == "DRR":
             return (
                 "📢 <b>Введите ДРР (%)</b>",
@@ -245,21 +300,9 @@ async def _apply_default(repo: Repo, state: FSMContext, field: str) -> float:
     scheme = data.get("scheme")
     
     try:
-        from app.reference_data import get_reference_value
-        
-        key_map = {
-            "logistics": "logistics_rub_per_sale",
-            "storage": "storage_rub_per_sale",
-            "return_cost": "return_cost_rub",
-            "other_fees": "other_fees_rub_per_sale",
-            "opex_var": "opex_var_rub_per_sale",
-        }
-        
-        key = key_map.get(field)
-        if not key or not mp or not scheme:
-            return 0.0
-        
-        return get_reference_value(mp, scheme, key)
+        from app.reference_data import get_default_input
+
+        return get_default_input(mp, scheme, field)
     except ImportError:
         logger.warning("reference_data.py not found, using fallback values")
         # Запасные значения
@@ -291,6 +334,48 @@ _FIELD_ORDER = [
 ]
 
 
+# Компактные inputs в FSM: значения в порядке _FIELD_ORDER + источник одной буквой
+# ("U" — ввёл пользователь, "D" — справочное, "Z" — не учитывать, "-" — ещё не введено).
+# Старый формат {field: {"value", "source"}} читается как есть.
+INPUTS_VERSION = 1
+_SOURCE_CODES = {"USER": "U", "DEFAULT": "D", "ZERO": "Z"}
+_CODE_SOURCES = {c: s for s, c in _SOURCE_CODES.items()}
+
+
+def _pack_inputs(data_inputs: dict) -> dict:
+    values, sources = [], []
+    for f in _FIELD_ORDER:
+        item = data_inputs.get(f)
+        values.append(None if item is None else item["value"])
+        sources.append("-" if item is None else _SOURCE_CODES.get(item["source"], "U"))
+    return {"v": INPUTS_VERSION, "vals": values, "src": "".join(sources)}
+
+
+def _unpack_inputs(packed: dict | None) -> dict:
+    if not packed:
+        return {}
+    if packed.get("v") != INPUTS_VERSION:
+        return dict(packed)
+    return {
+        f: {"value": v, "source": _CODE_SOURCES[c]}
+        for f, v, c in zip(_FIELD_ORDER, packed["vals"], packed["src"])
+        if c != "-"
+    }
+
+
+def _load_inputs(data: dict) -> dict:
+    return _unpack_inputs(data.get("inputs"))
+
+
+def _calc_view(data: dict) -> tuple[dict, CalcInputs, dict, str, list[str]]:
+    """Результаты в FSM не храним — пересчитываем по inputs (это дешевле сериализации)."""
+    inputs = _load_inputs(data)
+    ci = _build_calcinputs(inputs)
+    results = compute(ci)
+    acc, notes = _notes(inputs)
+    return inputs, ci, results, acc, notes
+
+
 def _next_field(data_inputs: dict) -> str | None:
     for f in _FIELD_ORDER:
         if f not in data_inputs:
@@ -307,7 +392,7 @@ def _prev_field(current: str) -> str | None:
     return _FIELD_ORDER[idx - 1]
 
 
-def _build_result_text(mp: str, scheme: str, inputs: dict, results: dict, accuracy: str, notes: list[str], options: list[str], sku_label: str | None = None) -> str:
+def _build_result_text(mp: str, scheme: str, inputs: dict, results: dict, accuracy: str, notes: list[str], options: list[str], sku_label: str | None = None, risk: dict | None = None) -> str:
     title_line = f"📦 {sku_label}" if sku_label else "📦 SKU"
     header = f"{title_line}\n{mp} / {scheme}"
 
@@ -340,6 +425,18 @@ def _build_result_text(mp: str, scheme: str, inputs: dict, results: dict, accura
         "📍 Ключевые точки:",
         f"• Точка безубыточности (цена): {fmt_money(results.get('breakeven_price'))}",
         f"• Макс. реклама без убытка: {fmt_money(results.get('max_ads_rub'))} (до {fmt_pct(results.get('max_drr_pct'))} ДРР)",
+    ]
+
+    if risk:
+        text_parts += [
+            "",
+            f"🎲 Риск по неточным полям ({risk['samples']} сценариев):",
+            f"• Вероятность убытка: {fmt_pct(risk['p_loss'])}",
+            f"• Прибыль: пессимистично {fmt_money(risk['p5'])} / типично {fmt_money(risk['p50'])} / "
+            f"оптимистично {fmt_money(risk['p95'])}",
+        ]
+
+    text_parts += [
         "",
         f"Точность: {accuracy}",
     ]
@@ -389,20 +486,12 @@ def _build_options(ci: CalcInputs, results: dict) -> list[str]:
     
     # Рекомендации по цене
     if P > 0:
-        # +5% к цене
-        new_price_5 = P * 1.05
-        ci_5 = CalcInputs(**{**ci.__dict__, "price": new_price_5})
-        r_5 = compute(ci_5)
-        profit_5 = r_5["net_profit"]
-        margin_5 = r_5["margin_pct"]
-        
-        # +10% к цене
-        new_price_10 = P * 1.10
-        ci_10 = CalcInputs(**{**ci.__dict__, "price": new_price_10})
-        r_10 = compute(ci_10)
-        profit_10 = r_10["net_profit"]
-        margin_10 = r_10["margin_pct"]
-        
+        # +5% и +10% к цене — одним проходом
+        new_price_5, new_price_10 = P * 1.05, P * 1.10
+        sw = sweep_price(ci, [new_price_5, new_price_10])
+        profit_5, profit_10 = sw["net_profit"].tolist()
+        margin_5, margin_10 = sw["margin_pct"].tolist()
+
         opts.append(f"💰 <b>Тест цены:</b>\n"
                    f"• +5% ({fmt_money(new_price_5)}) → прибыль {fmt_money(profit_5)} (маржа {fmt_pct(margin_5)})\n"
                    f"• +10% ({fmt_money(new_price_10)}) → прибыль {fmt_money(profit_10)} (маржа {fmt_pct(margin_10)})")
@@ -441,6 +530,12 @@ def _build_options(ci: CalcInputs, results: dict) -> list[str]:
     return opts[:5]  # Максимум 5 рекомендаций
 
 
+def _profit_chart(ci: CalcInputs, results: dict) -> bytes:
+    breakeven = results.get("breakeven_price")
+    sw = sweep_price(ci, price_grid(ci.price, breakeven))
+    return build_profit_chart(sw["price"], sw["net_profit"], ci.price, breakeven)
+
+
 async def _finish_and_show_result(message_or_cb, repo: Repo, state: FSMContext, from_history: bool = False):
     data = await state.get_data()
     
@@ -454,14 +549,11 @@ async def _finish_and_show_result(message_or_cb, repo: Repo, state: FSMContext,
             await message_or_cb.message.answer(error_text)
         return
     
-    inputs = data.get("inputs", {})
     mp = data["marketplace"]
     scheme = data["scheme"]
     sku_label = data.get("sku_label", "")
 
-    ci = _build_calcinputs(inputs)
-    results = compute(ci)
-    acc, notes = _notes(inputs)
+    inputs, ci, results, acc, notes = _calc_view(data)
     options = _build_options(ci, results)
 
     # списываем кредит только для "живого" расчёта
@@ -481,14 +573,10 @@ async def _finish_and_show_result(message_or_cb, repo: Repo, state: FSMContext,
             raise
         await state.update_data(used_credit_type=used)
 
-    text = _build_result_text(mp, scheme, inputs, results, acc, notes, options, sku_label=sku_label)
+    risk = _risk_summary(ci, inputs, mp, scheme)
+    text = _build_result_text(mp, scheme, inputs, results, acc, notes, options, sku_label=sku_label, risk=risk)
 
-    await state.update_data(
-        results=results,
-        accuracy=acc,
-        accuracy_notes=notes,
-        options=options,
-    )
+    await state.update_data(calc_ready=True)
 
     if isinstance(message_or_cb, Message):
         await message_or_cb.answer(text, reply_markup=result_kb())
@@ -500,9 +588,8 @@ async def _finish_and_show_result(message_or_cb, repo: Repo, state: FSMContext,
 
 @router.message(CommandStart())
 async def cmd_start(message: Message, repo: Repo):
-    await repo.upsert_user_on_start(message.from_user.id)
-    u = await repo.get_user(message.from_user.id)
-    left = u["free_credits"] if u else 0
+    u = await repo.upsert_user_on_start(message.from_user.id)
+    left = u["free_credits"]
     await message.answer(
         "Привет! Я помогу точно посчитать прибыль/убыток по SKU с учётом комиссий, логистики, рекламы и налогов.\n\n"
         f"Осталось бесплатных расчётов: {left}",
@@ -654,7 +741,7 @@ async def enter_value_message(message: Message, state: FSMContext, repo: Repo):
     if not field:
         return
 
-    inputs = data.get("inputs", {})
+    inputs = _load_inputs(data)
 
     try:
         if field in {"returns_pct", "commission_value", "ads_value", "tax_rate"}:
@@ -674,7 +761,7 @@ async def enter_value_message(message: Message, state: FSMContext, repo: Repo):
             v = _safe_float(message.text)
 
         _set_input(inputs, field, v, "USER")
-        await state.update_data(inputs=inputs)
+        await state.update_data(inputs=_pack_inputs(inputs))
     except Exception:
         await message.answer("Не смог распознать число. Пример: 1234 или 12,5")
         return
@@ -691,9 +778,9 @@ async def enter_value_message(message: Message, state: FSMContext, repo: Repo):
 async def commode(cb: CallbackQuery, state: FSMContext):
     mode = cb.data.split(":")[-1]
     data = await state.get_data()
-    inputs = data.get("inputs", {})
+    inputs = _load_inputs(data)
     _set_input(inputs, "commission_mode", mode, "USER")
-    await state.update_data(inputs=inputs)
+    await state.update_data(inputs=_pack_inputs(inputs))
     await _ask_field(cb, state, "commission_value")
 
 
@@ -701,9 +788,9 @@ async def commode(cb: CallbackQuery, state: FSMContext):
 async def adsmode(cb: CallbackQuery, state: FSMContext):
     mode = cb.data.split(":")[-1]
     data = await state.get_data()
-    inputs = data.get("inputs", {})
+    inputs = _load_inputs(data)
     _set_input(inputs, "ads_mode", mode, "USER")
-    await state.update_data(inputs=inputs)
+    await state.update_data(inputs=_pack_inputs(inputs))
     await _ask_field(cb, state, "ads_value")
 
 
@@ -711,9 +798,9 @@ async def adsmode(cb: CallbackQuery, state: FSMContext):
 async def taxmode(cb: CallbackQuery, state: FSMContext):
     mode = cb.data.split(":")[-1]
     data = await state.get_data()
-    inputs = data.get("inputs", {})
+    inputs = _load_inputs(data)
     _set_input(inputs, "tax_mode", mode, "USER")
-    await state.update_data(inputs=inputs)
+    await state.update_data(inputs=_pack_inputs(inputs))
     await _ask_field(cb, state, "tax_rate")
 
 
@@ -721,11 +808,11 @@ async def taxmode(cb: CallbackQuery, state: FSMContext):
 async def field_default(cb: CallbackQuery, state: FSMContext, repo: Repo):
     field = cb.data.split(":")[-1]
     data = await state.get_data()
-    inputs = data.get("inputs", {})
+    inputs = _load_inputs(data)
     v = await _apply_default(repo, state, field)
     source = "DEFAULT" if v != 0 else "ZERO"
     _set_input(inputs, field, v, source)
-    await state.update_data(inputs=inputs)
+    await state.update_data(inputs=_pack_inputs(inputs))
     nextf = _next_field(inputs)
     if nextf:
         await _ask_field(cb, state, nextf)
@@ -737,9 +824,9 @@ async def field_default(cb: CallbackQuery, state: FSMContext, repo: Repo):
 async def field_zero(cb: CallbackQuery, state: FSMContext):
     field = cb.data.split(":")[-1]
     data = await state.get_data()
-    inputs = data.get("inputs", {})
+    inputs = _load_inputs(data)
     _set_input(inputs, field, 0.0, "ZERO")
-    await state.update_data(inputs=inputs)
+    await state.update_data(inputs=_pack_inputs(inputs))
     nextf = _next_field(inputs)
     if nextf:
         await _ask_field(cb, state, nextf)
@@ -750,7 +837,7 @@ async def save_calc(cb: CallbackQuery, state: FSMContext, repo: Repo):
     data = await state.get_data()
     
     # Проверяем необходимые поля
-    required_fields = ["results", "marketplace", "scheme"]
+    required_fields = ["calc_ready", "marketplace", "scheme"]
     missing_fields = [field for field in required_fields if field not in data or not data[field]]
     
     if missing_fields:
@@ -759,12 +846,10 @@ async def save_calc(cb: CallbackQuery, state: FSMContext, repo: Repo):
         return
     
     try:
-        inputs = data.get("inputs", {})
-        results = data["results"]
+        inputs, _, results, acc, _ = _calc_view(data)
         mp = data["marketplace"]
         scheme = data["scheme"]
         used = data.get("used_credit_type", "FREE")
-        acc = data.get("accuracy", "")
         sku_label = data.get("sku_label", "Без названия")
         
         logger.info(f"Saving calculation for user {cb.from_user.id}: mp={mp}, scheme={scheme}, label={sku_label}")
@@ -791,17 +876,14 @@ async def save_calc(cb: CallbackQuery, state: FSMContext, repo: Repo):
 @router.callback_query(F.data == "calc:pdf")
 async def pdf_calc(cb: CallbackQuery, state: FSMContext, repo: Repo, bot: Bot):
     data = await state.get_data()
-    if "results" not in data:
+    if not data.get("calc_ready"):
         await cb.answer("Сначала сделайте расчёт", show_alert=True)
         return
 
     mp = data.get("marketplace", "")
     scheme = data.get("scheme", "")
-    inputs = data.get("inputs", {})
-    results = data.get("results", {})
-    acc = data.get("accuracy", "")
-    notes = data.get("accuracy_notes", [])
-    options = data.get("options", [])
+    inputs, ci, results, acc, notes = _calc_view(data)
+    options = _build_options(ci, results)
     sku_label = data.get("sku_label", "")
 
     def getv(k):
@@ -833,6 +915,12 @@ async def pdf_calc(cb: CallbackQuery, state: FSMContext, repo: Repo, bot: Bot):
         ("Ожид. затраты на возвраты", fmt_money(results.get("returns_cost_expected", 0))),
     ]
 
+    try:
+        chart_png = await asyncio.to_thread(_profit_chart, ci, results)
+    except Exception:
+        logger.exception("Profit chart failed")
+        chart_png = None
+
     pdf_bytes = build_pdf(
         title="Отчёт по SKU (1 продажа)",
         subtitle=f"{mp} / {scheme}" if mp and scheme else "Без маркетплейса",
@@ -841,7 +929,8 @@ async def pdf_calc(cb: CallbackQuery, state: FSMContext, repo: Repo, bot: Bot):
         accuracy=acc,
         accuracy_notes=notes,
         options=options,
-	sku_name=sku_label,
+        sku_name=sku_label,
+        chart_png=chart_png,
     )
 
     doc = BufferedInputFile(pdf_bytes, filename="sku_report.pdf")
@@ -849,6 +938,82 @@ async def pdf_calc(cb: CallbackQuery, state: FSMContext, repo: Repo, bot: Bot):
     await cb.answer()
 
 
+@router.callback_query(F.data == "calc:chart")
+async def chart_calc(cb: CallbackQuery, state: FSMContext, bot: Bot):
+    data = await state.get_data()
+    if not data.get("calc_ready"):
+        await cb.answer("Сначала сделайте расчёт", show_alert=True)
+        return
+
+    _, ci, results, _, _ = _calc_view(data)
+    png = await asyncio.to_thread(_profit_chart, ci, results)
+    await bot.send_photo(
+        cb.from_user.id,
+        BufferedInputFile(png, filename="profit_chart.png"),
+        caption="📈 Чистая прибыль на 1 продажу в зависимости от цены",
+    )
+    await cb.answer()
+
+
+@router.callback_query(F.data == "calc:opt")
+async def optimize_start(cb: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    if not data.get("calc_ready"):
+        await cb.answer("Сначала сделайте расчёт", show_alert=True)
+        return
+    await cb.message.answer(
+        "🎯 <b>Подбор оптимальной цены</b>\n\n"
+        "Насколько сильно продажи падают при росте цены?",
+        reply_markup=elasticity_kb(),
+    )
+    await cb.answer()
+
+
+@router.callback_query(F.data.startswith("calc:opt:e:"))
+async def optimize_ads(cb: CallbackQuery):
+    elasticity = cb.data.split(":")[-1]
+    await cb.message.edit_text(
+        "🎯 <b>Подбор оптимальной цены и ДРР</b>\n\n"
+        "Насколько реклама увеличивает продажи?",
+        reply_markup=ads_response_kb(elasticity),
+    )
+    await cb.answer()
+
+
+@router.callback_query(F.data.startswith("calc:opt:r:"))
+async def optimize_show(cb: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    if not data.get("calc_ready"):
+        await cb.answer("Сначала сделайте расчёт", show_alert=True)
+        return
+    _, _, _, e_raw, response = cb.data.split(":")
+    elasticity = float(e_raw)
+    ci = _build_calcinputs(_load_inputs(data))
+    opt = optimize_price(ci, elasticity, drr_table=ADS_RESPONSE_TABLES.get(response))
+    if not opt:
+        await cb.answer("Не удалось подобрать цену", show_alert=True)
+        return
+
+    lines = [
+        "🎯 <b>Оптимальная цена</b>" + (" и ДРР" if opt["drr_pct"] is not None else ""),
+        f"(эластичность спроса {elasticity:g}: +1% к цене → −{elasticity:g}% продаж)",
+        "",
+        f"• Цена: {fmt_money(opt['price'])} (сейчас {fmt_money(ci.price)})",
+    ]
+    if opt["drr_pct"] is not None:
+        current_drr = ci.ads_value if ci.ads_mode == "DRR" else ci.ads_value / ci.price
+        lines.append(f"• ДРР: {fmt_pct(opt['drr_pct'])} (сейчас {fmt_pct(current_drr * 100)})")
+    lines += [
+        f"• Прибыль с 1 продажи: {fmt_money(opt['net_profit'])}",
+        f"• Изменение числа продаж: {opt['volume_change_pct']:+.1f}%",
+    ]
+    if opt["profit_change_pct"] is not None:
+        lines.append(f"• Изменение общей прибыли: {opt['profit_change_pct']:+.1f}%")
+    lines += ["", "Оценка по модели спроса — проверяйте новую цену тестом."]
+    await cb.message.edit_text("\n".join(lines), reply_markup=None)
+    await cb.answer()
+
+
 @router.callback_query(F.data.startswith("calc:history:"))
 async def history(cb: CallbackQuery, repo: Repo):
     offset = int(cb.data.split(":")[-1])
@@ -950,40 +1115,33 @@ async def open_saved(cb: CallbackQuery, repo: Repo, state: FSMContext):
     scheme = row.get("scheme", "")
     sku_label = row.get("sku_label", "")
 
-    # Сохраняем в state
+    # В state — только компактные inputs; результаты пересчитываются по запросу
     await state.update_data(
-        inputs=inputs,
-        results=results,
+        inputs=_pack_inputs(inputs),
         marketplace=mp,
         scheme=scheme,
         sku_label=sku_label,
-        accuracy=row.get("accuracy_level", ""),
-        accuracy_notes=[],
-        options=[],
         used_credit_type=row.get("used_credit_type", "HISTORY"),
         current_calc_id=calc_id,
+        # график и PDF доступны, только если пересчёт ниже удастся
+        calc_ready=False,
     )
 
-    # Пытаемся пересчитать
-    ci = None
+    # Пытаемся пересчитать; если не вышло — показываем сохранённые результаты
+    risk = None
     try:
         ci = _build_calcinputs(inputs)
         results = compute(ci)
         acc, notes = _notes(inputs)
-        options = _build_options(ci, results) if ci is not None else []
-        
-        await state.update_data(
-            results=results,
-            accuracy=acc,
-            accuracy_notes=notes,
-            options=options
-        )
+        options = _build_options(ci, results)
+        risk = _risk_summary(ci, inputs, mp, scheme)
+        await state.update_data(calc_ready=True)
     except Exception:
         acc = row.get("accuracy_level", "")
         notes = []
         options = []
 
-    text = _build_result_text(mp, scheme, inputs, results, acc, notes, options, sku_label=sku_label)
+    text = _build_result_text(mp, scheme, inputs, results, acc, notes, options, sku_label=sku_label, risk=risk)
     await cb.message.edit_text(text, reply_markup=result_saved_kb(calc_id))
 
 
@@ -1022,3 +1180,101 @@ async def delete_saved(cb: CallbackQuery, repo: Repo, state: FSMContext):
     kb.row(InlineKeyboardButton(text="🏠 Меню", callback_data="menu"))
 
     await cb.message.edit_text("\n".join(lines), reply_markup=kb.as_markup())
+
+
+# ====== BULK UPLOAD ======
+
+BULK_HELP_TEXT = (
+    "📥 <b>Пакетный расчёт из файла</b>\n\n"
+    "Пришлите CSV или XLSX, первая строка — заголовки:\n"
+    "• обязательно: <code>marketplace</code>, <code>scheme</code>, <code>price</code>, <code>cogs</code>\n"
+    "• по желанию: <code>sku_label</code>, <code>commission_mode</code> (PCT/RUB), <code>commission_value</code>, "
+    "<code>logistics</code>, <code>storage</code>, <code>returns_pct</code>, <code>return_cost</code>, "
+    "<code>ads_mode</code> (PER_SALE/DRR), <code>ads_value</code>, <code>other_fees</code>, <code>opex_var</code>, "
+    "<code>tax_mode</code> (REV/PROFIT), <code>tax_rate</code>, "
+    "<code>elasticity</code> (эластичность спроса — тогда посчитаем оптимальную цену)\n\n"
+    "Проценты указываются числом (18 = 18%). Пустые логистика, хранение, возвраты и сборы "
+    "берутся из справочника, остальные пустые поля считаются нулём.\n"
+    f"Каждая строка — 1 расчёт, максимум {BULK_MAX_ROWS} строк."
+)
+
+
+def _bulk_parse_and_compute(path: str, filename: str):
+    parsed = parse_file(path, filename, max_rows=BULK_MAX_ROWS)
+    return parsed, compute_rows(parsed.rows)
+
+
+@router.callback_query(F.data == "bulk:start")
+async def bulk_start(cb: CallbackQuery, state: FSMContext):
+    await state.clear()
+    await state.set_state(BulkFlow.waiting_file)
+    await cb.message.edit_text(BULK_HELP_TEXT, reply_markup=bulk_upload_kb())
+
+
+@router.message(BulkFlow.waiting_file)
+async def bulk_file(message: Message, state: FSMContext, repo: Repo, bot: Bot):
+    doc = message.document
+    if not doc:
+        await message.answer("Пришлите файл .csv или .xlsx документом.", reply_markup=bulk_upload_kb())
+        return
+    if doc.file_size and doc.file_size > BULK_MAX_FILE_MB * 1024 * 1024:
+        await message.answer(f"Файл больше {BULK_MAX_FILE_MB} МБ — разбейте его на части.")
+        return
+
+    filename = doc.file_name or ""
+    fd, path = tempfile.mkstemp(suffix=os.path.splitext(filename)[1])
+    os.close(fd)
+    try:
+        await bot.download(doc, destination=path)
+        # разбор и расчёт — в отдельном потоке, чтобы не блокировать event loop
+        parsed, results = await asyncio.to_thread(_bulk_parse_and_compute, path, filename)
+    except BulkFileError as e:
+        await message.answer(f"Не получилось прочитать файл: {e}", reply_markup=bulk_upload_kb())
+        return
+    finally:
+        os.remove(path)
+
+    if not parsed.rows:
+        errors = "\n".join(f"• строка {line}: {msg}" for line, msg in parsed.errors[:10])
+        await message.answer(f"В файле нет строк для расчёта.\n\n{errors}", reply_markup=bulk_upload_kb())
+        return
+
+    accuracies = [_notes(r.inputs)[0] for r in parsed.rows]
+    try:
+        used = await repo.save_calculations_batch(
+            message.from_user.id,
+            [
+                {
+                    "marketplace": r.marketplace,
+                    "scheme": r.scheme,
+                    "sku_label": r.sku_label,
+                    "inputs": r.inputs,
+                    "results": res,
+                    "accuracy_level": acc,
+                }
+                for r, res, acc in zip(parsed.rows, results, accuracies)
+            ],
+        )
+    except RuntimeError as e:
+        if str(e) == "NO_CREDITS":
+            u = await repo.get_user(message.from_user.id)
+            available = (u["free_credits"] + u["paid_credits"]) if u else 0
+            await message.answer(
+                f"Для файла нужно {len(parsed.rows)} расчётов, доступно {available}. "
+                "Купите пакет SKU или уменьшите файл.",
+                reply_markup=packs_kb(),
+            )
+            return
+        raise
+
+    xlsx_bytes = await asyncio.to_thread(build_bulk_result, parsed.rows, results, accuracies, parsed.errors)
+    await state.clear()
+    await message.answer_document(
+        BufferedInputFile(xlsx_bytes, filename="sku_bulk_result.xlsx"),
+        caption=(
+            f"✅ Рассчитано SKU: {len(parsed.rows)} "
+            f"(бесплатных {used.count('FREE')}, платных {used.count('PAID')}).\n"
+            f"Строк с ошибками: {len(parsed.errors)}. Расчёты сохранены в «Мои расчёты»."
+        ),
+        reply_markup=main_menu_kb(),
+    )
@@ -9,6 +9,7 @@ from app.constants import MARKETPLACES, SCHEMES_BY_MP, PACKS
 def main_menu_kb() -> InlineKeyboardMarkup:
     kb = InlineKeyboardBuilder()
     kb.button(text="▶️ Рассчитать SKU", callback_data="calc:start")
+    kb.button(text="📥 Загрузить файл SKU", callback_data="bulk:start")
     kb.button(text="📁 Мои расчёты", callback_data="calc:history:0")
     kb.button(text="ℹ️ Как считается", callback_data="help:how")
     kb.adjust(1)
@@ -113,14 +114,23 @@ def packs_kb() -> InlineKeyboardMarkup:
     return kb.as_markup()
 
 
+def bulk_upload_kb() -> InlineKeyboardMarkup:
+    kb = InlineKeyboardBuilder()
+    kb.button(text="🏠 Главное меню", callback_data="menu")
+    kb.adjust(1)
+    return kb.as_markup()
+
+
 def result_kb(calc_id: int | None = None) -> InlineKeyboardMarkup:
     kb = InlineKeyboardBuilder()
     kb.button(text="💾 Сохранить", callback_data="calc:save")
     kb.button(text="📄 Скачать PDF (A4)", callback_data="calc:pdf")
+    kb.button(text="📈 График прибыли", callback_data="calc:chart")
+    kb.button(text="🎯 Оптимальная цена", callback_data="calc:opt")
     kb.button(text="🔁 Начать расчёт заново", callback_data="calc:start")
     kb.button(text="➕ Рассчитать ещё SKU", callback_data="calc:start")
     kb.button(text="🏠 Главное меню", callback_data="menu")
-    kb.adjust(2, 2, 1)
+    kb.adjust(2, 2, 2, 1)
     return kb.as_markup()
 
 
@@ -130,6 +140,8 @@ def result_saved_kb(calc_id: int) -> InlineKeyboardMarkup:
     """
     kb = InlineKeyboardBuilder()
     kb.button(text="📄 Скачать PDF (A4)", callback_data="calc:pdf")
+    kb.button(text="📈 График прибыли", callback_data="calc:chart")
+    kb.button(text="🎯 Оптимальная цена", callback_data="calc:opt")
     kb.button(
         text="🗑 Удалить из сохранённых",
         callback_data=f"calc:delete:{calc_id}",
@@ -143,6 +155,27 @@ def result_saved_kb(calc_id: int) -> InlineKeyboardMarkup:
     return kb.as_markup()
 
 
+def elasticity_kb() -> InlineKeyboardMarkup:
+    """Насколько продажи зависят от цены (эластичность спроса)."""
+    kb = InlineKeyboardBuilder()
+    kb.button(text="Слабо (товар нужен всегда)", callback_data="calc:opt:e:1.5")
+    kb.button(text="Средне (есть аналоги)", callback_data="calc:opt:e:2.5")
+    kb.button(text="Сильно (много конкурентов)", callback_data="calc:opt:e:4")
+    kb.adjust(1)
+    return kb.as_markup()
+
+
+def ads_response_kb(elasticity: str) -> InlineKeyboardMarkup:
+    """Насколько реклама увеличивает продажи (для подбора ДРР); ключи — calc.ADS_RESPONSE_TABLES."""
+    kb = InlineKeyboardBuilder()
+    kb.button(text="Слабо", callback_data=f"calc:opt:r:{elasticity}:weak")
+    kb.button(text="Заметно", callback_data=f"calc:opt:r:{elasticity}:medium")
+    kb.button(text="Сильно (без рекламы почти не продаётся)", callback_data=f"calc:opt:r:{elasticity}:strong")
+    kb.button(text="Не подбирать ДРР", callback_data=f"calc:opt:r:{elasticity}:none")
+    kb.adjust(1)
+    return kb.as_markup()
+
+
 def history_nav_kb(offset: int) -> InlineKeyboardMarkup:
     kb = InlineKeyboardBuilder()
     prev_off = max(0, offset - 20)
@@ -1,16 +1,22 @@
 from __future__ import annotations
 import asyncio
 import logging
+from contextlib import AsyncExitStack
 
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.default import DefaultBotProperties  # <-- ВАЖНЫЙ импорт
 
 from app.config import load_config
 from app.db import Database
 from app.repo import Repo
-from app.middlewares import InjectMiddleware
+from app.middlewares import InjectMiddleware, ActivityMiddleware
+from app.activity import ActivityBuffer
+from app.fsm_storage import create_storage
+from app.services.broadcast import BroadcastWorker
+from app.services.payment_poller import PaymentPoller
+from app.services.payment_webhook import PaymentWebhook
+from app.services.payments import create_payment_provider
 from app.handlers import user, admin, buy
 
 
@@ -20,29 +26,54 @@ async def main():
         level=getattr(logging, config.log_level.upper(), logging.INFO)
     )
 
-    db = Database(config.db_dsn)
-    await db.connect()
-    repo = Repo(db)
+    # ресурсы закрываются в обратном порядке; ошибка одного шага не мешает остальным
+    async with AsyncExitStack() as shutdown:
+        db = Database(config.db_dsn)
+        await db.connect()
+        shutdown.push_async_callback(db.close)
+        repo = Repo(db)
+        await repo.ensure_stats()
+        activity = ActivityBuffer(repo)
 
-    # ИСПРАВЛЕНО: убрали parse_mode=..., используем default=DefaultBotProperties(...)
-    bot = Bot(
-        token=config.bot_token,
-        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
-    )
+        # ИСПРАВЛЕНО: убрали parse_mode=..., используем default=DefaultBotProperties(...)
+        bot = Bot(
+            token=config.bot_token,
+            default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+        )
 
-    dp = Dispatcher(storage=MemoryStorage())
-    dp.message.middleware(InjectMiddleware(repo, config))
-    dp.callback_query.middleware(InjectMiddleware(repo, config))
+        # один платёжный провайдер (и его HTTP-сессия) на процесс
+        payments = create_payment_provider(config)
+        shutdown.push_async_callback(payments.close)
 
-    dp.include_router(admin.router)
-    dp.include_router(buy.router)
-    dp.include_router(user.router)
+        dp = Dispatcher(storage=create_storage(config, db))
+        shutdown.push_async_callback(dp.storage.close)
+        dp.update.outer_middleware(ActivityMiddleware(activity))
+        dp.message.middleware(InjectMiddleware(repo, config, payments))
+        dp.callback_query.middleware(InjectMiddleware(repo, config, payments))
 
-    try:
-        await dp.start_polling(bot)
-    finally:
-        await db.close()
+        dp.include_router(admin.router)
+        dp.include_router(buy.router)
+        dp.include_router(user.router)
+
+        broadcasts = BroadcastWorker(repo, bot)
+        use_webhook = payments.enabled and config.payment_webhook_port is not None
+        # с вебхуком поллер только страхует пропущенные уведомления
+        payment_poller = PaymentPoller(repo, bot, payments, interval=600 if use_webhook else 60)
+        payment_webhook = PaymentWebhook(repo, bot, payments, path=config.payment_webhook_path,
+                                         check_ip=config.payment_webhook_check_ip)
 
+        activity.start()
+        shutdown.push_async_callback(activity.stop)
+        broadcasts.start()
+        shutdown.push_async_callback(broadcasts.stop)
+        if payments.enabled:
+            payment_poller.start()
+            shutdown.push_async_callback(payment_poller.stop)
+        if use_webhook:
+            await payment_webhook.start(config.payment_webhook_host, config.payment_webhook_port)
+            shutdown.push_async_callback(payment_webhook.stop)
+
+        await dp.start_polling(bot)
 
 if __name__ == "__main__":
     asyncio.run(main())
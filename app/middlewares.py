@@ -4,11 +4,14 @@ from aiogram import BaseMiddleware
 from aiogram.types import TelegramObject
 from app.repo import Repo
 from app.config import Config
+from app.activity import ActivityBuffer
+from app.services.payments import PaymentProvider
 
 class InjectMiddleware(BaseMiddleware):
-    def __init__(self, repo: Repo, config: Config):
+    def __init__(self, repo: Repo, config: Config, payments: PaymentProvider):
         self.repo = repo
         self.config = config
+        self.payments = payments
 
     async def __call__(
         self,
@@ -18,4 +21,24 @@ class InjectMiddleware(BaseMiddleware):
     ) -> Any:
         data["repo"] = self.repo
         data["config"] = self.config
+        data["payments"] = self.payments
+        return await handler(event, data)
+
+
+class ActivityMiddleware(BaseMiddleware):
+    """Отмечает активность пользователя на каждом апдейте (пишется пачкой)."""
+
+    def __init__(self, activity: ActivityBuffer):
+        self.activity = activity
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is not None and not user.is_bot:
+            self.activity.touch(user.id)
+        data["activity"] = self.activity
         return await handler(event, data)
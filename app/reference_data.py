@@ -2,6 +2,7 @@
 Справочные данные по маркетплейсам.
 Обновляются вручную при изменении тарифов.
 """
+from __future__ import annotations
 
 REFERENCE_VALUES = {
     # OZON
@@ -102,3 +103,24 @@ def get_reference_value(marketplace: str, scheme: str, key: str) -> float:
         return 0.0
     
     return scheme_data.get(key, 0.0)
+
+
+# Поля расчёта, для которых есть справочные значения
+INPUT_REFERENCE_KEYS = {
+    "logistics": "logistics_rub_per_sale",
+    "storage": "storage_rub_per_sale",
+    "return_cost": "return_cost_rub",
+    "other_fees": "other_fees_rub_per_sale",
+    "opex_var": "opex_var_rub_per_sale",
+}
+
+
+def get_default_input(marketplace: str | None, scheme: str | None, field: str) -> float:
+    """
+    Справочное значение для поля расчёта (logistics, storage, ...).
+    Если справочника для поля/маркетплейса/схемы нет, возвращает 0.0
+    """
+    key = INPUT_REFERENCE_KEYS.get(field)
+    if not key or not marketplace or not scheme:
+        return 0.0
+    return get_reference_value(marketplace, scheme, key)
@@ -1,80 +1,193 @@
 from __future__ import annotations
 import json
-from typing import Any, Optional
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Optional
 from app.db import Database
 
+
+class UserIdCache:
+    """Ограниченный LRU-кэш tg_user_id → users.id (id пользователя не меняется)."""
+
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        self._data: OrderedDict[int, int] = OrderedDict()
+
+    def get(self, tg_user_id: int) -> int | None:
+        uid = self._data.get(tg_user_id)
+        if uid is not None:
+            self._data.move_to_end(tg_user_id)
+        return uid
+
+    def put(self, tg_user_id: int, user_id: int) -> None:
+        self._data[tg_user_id] = user_id
+        self._data.move_to_end(tg_user_id)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+# Списание n кредитов одним запросом: строка пользователя блокируется (FOR UPDATE),
+# сначала тратятся бесплатные, затем платные; при нехватке ничего не меняется.
+# Отдаёт users.id, сколько бесплатных ушло и прошло ли списание.
+_CHARGE_SQL = """
+WITH cur AS (
+    SELECT id, free_credits, paid_credits FROM users WHERE tg_user_id=$1 FOR UPDATE
+), upd AS (
+    UPDATE users u
+       SET free_credits = u.free_credits - LEAST(cur.free_credits, $2),
+           paid_credits = u.paid_credits - ($2 - LEAST(cur.free_credits, $2))
+      FROM cur
+     WHERE u.id = cur.id AND cur.free_credits + cur.paid_credits >= $2
+    RETURNING u.id
+)
+SELECT cur.id, LEAST(cur.free_credits, $2) AS free_used, EXISTS(SELECT 1 FROM upd) AS ok
+  FROM cur
+"""
+
+
+# Сегменты рассылки: условие на users u; заблокировавших бота не берём (users_reachable_idx)
+SEGMENT_WHERE = {
+    "all": "u.blocked_at IS NULL",
+    "free_remaining": "u.blocked_at IS NULL AND u.free_credits>0",
+    "free_finished": "u.blocked_at IS NULL AND u.free_credits=0",
+    "buyers": "u.blocked_at IS NULL AND EXISTS "
+              "(SELECT 1 FROM payments p WHERE p.user_id=u.id AND p.status='SUCCEEDED')",
+}
+
+
 class Repo:
-    def __init__(self, db: Database):
+    def __init__(self, db: Database, user_cache_size: int = 10000):
         self.db = db
+        self.user_ids = UserIdCache(user_cache_size)
+
+    def _user_ref(self, tg_user_id: int) -> tuple[str, int]:
+        """
+        SQL-выражение для users.id (параметр $1) и значение параметра:
+        id из кэша или подзапрос по tg_user_id — в обоих случаях один запрос к БД.
+        """
+        uid = self.user_ids.get(tg_user_id)
+        if uid is not None:
+            return "$1::bigint", uid
+        return "(SELECT id FROM users WHERE tg_user_id=$1)", tg_user_id
+
+    def _remember(self, row) -> None:
+        if row is not None:
+            self.user_ids.put(int(row["tg_user_id"]), int(row["id"]))
 
     async def upsert_user_on_start(self, tg_user_id: int) -> dict:
-        row = await self.db.fetchrow("SELECT * FROM users WHERE tg_user_id=$1", tg_user_id)
-        if row:
-            await self.db.execute("UPDATE users SET last_seen=now(), started_count=started_count+1 WHERE tg_user_id=$1", tg_user_id)
-        else:
-            await self.db.execute("INSERT INTO users (tg_user_id, started_count) VALUES ($1, 1)", tg_user_id)
-        row2 = await self.db.fetchrow("SELECT * FROM users WHERE tg_user_id=$1", tg_user_id)
-        return dict(row2)
+        row = await self.db.fetchrow(
+            """INSERT INTO users (tg_user_id, started_count) VALUES ($1, 1)
+               ON CONFLICT (tg_user_id) DO UPDATE
+                  SET last_seen=now(), started_count=users.started_count+1, blocked_at=NULL
+               RETURNING *""",
+            tg_user_id
+        )
+        self._remember(row)
+        return dict(row)
 
-    async def touch_user(self, tg_user_id: int) -> None:
-        await self.db.execute("UPDATE users SET last_seen=now() WHERE tg_user_id=$1", tg_user_id)
+    async def touch_users_batch(self, tg_user_ids: list[int], seen_at: list) -> None:
+        """last_seen для пачки пользователей одним запросом (для ActivityBuffer)."""
+        await self.db.execute(
+            """UPDATE users u SET last_seen = GREATEST(u.last_seen, a.seen_at), blocked_at = NULL
+                 FROM unnest($1::bigint[], $2::timestamptz[]) AS a(tg_user_id, seen_at)
+                WHERE u.tg_user_id = a.tg_user_id""",
+            tg_user_ids, seen_at
+        )
 
     async def get_user(self, tg_user_id: int) -> Optional[dict]:
         row = await self.db.fetchrow("SELECT * FROM users WHERE tg_user_id=$1", tg_user_id)
+        self._remember(row)
         return dict(row) if row else None
 
     async def ensure_user(self, tg_user_id: int) -> dict:
         row = await self.get_user(tg_user_id)
         if row:
             return row
-        await self.db.execute("INSERT INTO users (tg_user_id, started_count) VALUES ($1, 0)", tg_user_id)
-        return await self.get_user(tg_user_id)
+        row = await self.db.fetchrow(
+            """INSERT INTO users (tg_user_id, started_count) VALUES ($1, 0)
+               ON CONFLICT (tg_user_id) DO UPDATE SET tg_user_id=EXCLUDED.tg_user_id
+               RETURNING *""",
+            tg_user_id
+        )
+        self._remember(row)
+        return dict(row)
 
-    async def consume_credit(self, tg_user_id: int) -> str:
-        row = await self.db.fetchrow("SELECT free_credits, paid_credits FROM users WHERE tg_user_id=$1", tg_user_id)
+    async def _charge(self, conn, tg_user_id: int, n: int) -> tuple[int, list[str]]:
+        row = await conn.fetchrow(_CHARGE_SQL, tg_user_id, n)
         if not row:
             raise RuntimeError("User not found")
-        if row["free_credits"] > 0:
-            await self.db.execute("UPDATE users SET free_credits=free_credits-1 WHERE tg_user_id=$1", tg_user_id)
-            return "FREE"
-        if row["paid_credits"] > 0:
-            await self.db.execute("UPDATE users SET paid_credits=paid_credits-1 WHERE tg_user_id=$1", tg_user_id)
-            return "PAID"
-        raise RuntimeError("NO_CREDITS")
+        if not row["ok"]:
+            raise RuntimeError("NO_CREDITS")
+        self.user_ids.put(tg_user_id, int(row["id"]))
+        free_used = int(row["free_used"])
+        return int(row["id"]), ["FREE"] * free_used + ["PAID"] * (n - free_used)
+
+    async def consume_credit(self, tg_user_id: int) -> str:
+        _, used = await self._charge(self.db, tg_user_id, 1)
+        return used[0]
 
-    async def add_paid_credits(self, tg_user_id: int, credits: int) -> None:
-        await self.db.execute("UPDATE users SET paid_credits=paid_credits+$2 WHERE tg_user_id=$1", tg_user_id, credits)
+    async def reserve_credits(self, tg_user_id: int, n: int) -> list[str]:
+        """Списывает сразу n кредитов (всё или ничего); тип кредита — для каждого."""
+        if n <= 0:
+            return []
+        _, used = await self._charge(self.db, tg_user_id, n)
+        return used
 
     async def save_calculation(self, *, tg_user_id: int, marketplace: str, scheme: str, sku_label: str | None,
                                inputs: dict, results: dict, accuracy_level: str, used_credit_type: str) -> int:
-        user = await self.db.fetchrow("SELECT id FROM users WHERE tg_user_id=$1", tg_user_id)
-        if not user:
-            raise RuntimeError("User not found")
+        user, key = self._user_ref(tg_user_id)
         row = await self.db.fetchrow(
-            """INSERT INTO calculations (user_id, marketplace, scheme, sku_label, inputs, results, accuracy_level, used_credit_type)
-                 VALUES ($1,$2,$3,$4,$5::jsonb,$6::jsonb,$7,$8) RETURNING id""",
-            user["id"], marketplace, scheme, sku_label, json.dumps(inputs), json.dumps(results), accuracy_level, used_credit_type
+            f"""INSERT INTO calculations (user_id, marketplace, scheme, sku_label, inputs, results, accuracy_level, used_credit_type)
+                 SELECT u.id, $2, $3, $4, $5::jsonb, $6::jsonb, $7, $8 FROM users u WHERE u.id={user}
+                 RETURNING id, user_id""",
+            key, marketplace, scheme, sku_label, json.dumps(inputs), json.dumps(results), accuracy_level, used_credit_type
         )
+        if not row:
+            raise RuntimeError("User not found")
+        self.user_ids.put(tg_user_id, int(row["user_id"]))
         return int(row["id"])
 
-    async def list_calculations(self, tg_user_id: int, limit: int = 20, offset: int = 0, marketplace: str | None = None) -> list[dict]:
-        user = await self.db.fetchrow("SELECT id FROM users WHERE tg_user_id=$1", tg_user_id)
-        if not user:
+    async def save_calculations_batch(self, tg_user_id: int, rows: list[dict]) -> list[str]:
+        """
+        Пакетное сохранение: списывает len(rows) кредитов (сначала бесплатные)
+        и вставляет все расчёты через COPY — одной транзакцией, всё или ничего.
+        rows — словари с ключами marketplace, scheme, sku_label, inputs, results, accuracy_level.
+        Возвращает тип кредита для каждой строки.
+        """
+        n = len(rows)
+        if n == 0:
             return []
-        
+        async with self.db.transaction() as conn:
+            user_id, used = await self._charge(conn, tg_user_id, n)
+            await conn.copy_records_to_table(
+                "calculations",
+                columns=["user_id", "marketplace", "scheme", "sku_label", "inputs", "results",
+                         "accuracy_level", "used_credit_type"],
+                records=[
+                    (user_id, r["marketplace"], r["scheme"], r["sku_label"], json.dumps(r["inputs"]),
+                     json.dumps(r["results"]), r["accuracy_level"], u)
+                    for r, u in zip(rows, used)
+                ],
+            )
+        return used
+
+    async def list_calculations(self, tg_user_id: int, limit: int = 20, offset: int = 0, marketplace: str | None = None) -> list[dict]:
+        user, key = self._user_ref(tg_user_id)
         if marketplace:
             rows = await self.db.fetch(
-                """SELECT id, created_at, marketplace, scheme, sku_label, results, accuracy_level
-                   FROM calculations WHERE user_id=$1 AND marketplace=$2
+                f"""SELECT id, created_at, marketplace, scheme, sku_label, results, accuracy_level
+                   FROM calculations WHERE user_id={user} AND marketplace=$2
                    ORDER BY created_at DESC LIMIT $3 OFFSET $4""",
-                user["id"], marketplace, limit, offset
+                key, marketplace, limit, offset
             )
         else:
             rows = await self.db.fetch(
-                """SELECT id, created_at, marketplace, scheme, sku_label, results, accuracy_level
-                   FROM calculations WHERE user_id=$1
+                f"""SELECT id, created_at, marketplace, scheme, sku_label, results, accuracy_level
+                   FROM calculations WHERE user_id={user}
                    ORDER BY created_at DESC LIMIT $2 OFFSET $3""",
-                user["id"], limit, offset
+                key, limit, offset
             )
         
         out = []
@@ -84,17 +197,15 @@ class Repo:
 
     async def get_calculation(self, tg_user_id: int, calc_id: int) -> dict | None:
         """ИСПРАВЛЕННАЯ ВЕРСИЯ: использует user_id, а не tg_user_id"""
-        user = await self.db.fetchrow("SELECT id FROM users WHERE tg_user_id=$1", tg_user_id)
-        if not user:
-            return None
-
+        user, key = self._user_ref(tg_user_id)
         row = await self.db.fetchrow(
-            "SELECT * FROM calculations WHERE id=$1 AND user_id=$2",
+            f"SELECT * FROM calculations WHERE id=$2 AND user_id={user}",
+            key,
             calc_id,
-            user["id"],
         )
         if not row:
             return None
+        self.user_ids.put(tg_user_id, int(row["user_id"]))
 
         data = dict(row)
         for key in ("inputs", "results"):
@@ -107,97 +218,353 @@ class Repo:
         return data
 
     async def admin_stats(self) -> dict:
-        users_total = await self.db.fetchrow("SELECT COUNT(*) AS c FROM users")
-        started_total = await self.db.fetchrow("SELECT SUM(started_count) AS s FROM users")
-        users_started = await self.db.fetchrow("SELECT COUNT(*) AS c FROM users WHERE started_count>0")
-        calcs_total = await self.db.fetchrow("SELECT COUNT(*) AS c FROM calculations")
-        free_used = await self.db.fetchrow("SELECT COUNT(*) AS c FROM calculations WHERE used_credit_type='FREE'")
-        paid_used = await self.db.fetchrow("SELECT COUNT(*) AS c FROM calculations WHERE used_credit_type='PAID'")
-        pay_sum = await self.db.fetchrow("SELECT COALESCE(SUM(amount_rub),0) AS s FROM payments WHERE status='SUCCEEDED'")
-        pay_cnt = await self.db.fetchrow("SELECT COUNT(*) AS c FROM payments WHERE status='SUCCEEDED'")
-
-        return {
-            "users_total": int(users_total["c"]),
-            "users_started": int(users_started["c"]),
-            "starts_total": int(started_total["s"] or 0),
-            "calculations_total": int(calcs_total["c"]),
-            "free_calculations": int(free_used["c"]),
-            "paid_calculations": int(paid_used["c"]),
-            "payments_count": int(pay_cnt["c"]),
-            "payments_sum_rub": int(pay_sum["s"]),
-        }
+        """Читает счётчики stats_counters (ведутся триггерами) — один запрос."""
+        row = await self.db.fetchrow(
+            """SELECT COALESCE(SUM(users_total),0) AS users_total, COALESCE(SUM(users_started),0) AS users_started,
+                      COALESCE(SUM(starts_total),0) AS starts_total,
+                      COALESCE(SUM(calculations_total),0) AS calculations_total,
+                      COALESCE(SUM(free_calculations),0) AS free_calculations,
+                      COALESCE(SUM(paid_calculations),0) AS paid_calculations,
+                      COALESCE(SUM(payments_count),0) AS payments_count,
+                      COALESCE(SUM(payments_sum_rub),0) AS payments_sum_rub,
+                      COALESCE(SUM(users_blocked),0) AS users_blocked
+                 FROM stats_counters"""
+        )
+        stats = {k: int(v) for k, v in dict(row).items()}
+        stats["users_reachable"] = stats["users_total"] - stats["users_blocked"]
+        return stats
 
-    async def admin_export_rows(self) -> tuple[list[dict], list[dict]]:
-        rows = await self.db.fetch(
-            """SELECT u.tg_user_id, u.created_at, u.last_seen, u.started_count, u.free_credits, u.paid_credits,
-                      COALESCE(SUM(CASE WHEN c.used_credit_type='FREE' THEN 1 ELSE 0 END),0) AS free_used,
-                      COALESCE(SUM(CASE WHEN c.used_credit_type='PAID' THEN 1 ELSE 0 END),0) AS paid_used,
-                      COALESCE(COUNT(c.id),0) AS total_calcs
+    async def rebuild_stats(self) -> dict:
+        """
+        Пересчитывает stats_counters по таблицам (бэкфилл / сверка) без
+        блокировки записи. Один оператор — один снимок данных: слот 0 получает
+        «итог по таблицам минус слоты 1..8» в этом снимке. Изменения, которые
+        закоммитятся позже, не попадут в пересчёт, но останутся в слотах
+        1..8 — сумма по всем слотам сходится с таблицами.
+        """
+        await self.db.execute(
+            """INSERT INTO stats_counters AS s (slot, users_total, users_started, starts_total, calculations_total,
+                                                free_calculations, paid_calculations, payments_count,
+                                                payments_sum_rub, users_blocked)
+               SELECT 0, u.total - d.users_total, u.started - d.users_started, u.starts - d.starts_total,
+                      c.total - d.calculations_total, c.free - d.free_calculations, c.paid - d.paid_calculations,
+                      p.cnt - d.payments_count, p.sum - d.payments_sum_rub, u.blocked - d.users_blocked
+                 FROM (SELECT COUNT(*) AS total, COUNT(*) FILTER (WHERE started_count>0) AS started,
+                              COALESCE(SUM(started_count),0) AS starts,
+                              COUNT(*) FILTER (WHERE blocked_at IS NOT NULL) AS blocked FROM users) u,
+                      (SELECT COUNT(*) AS total, COUNT(*) FILTER (WHERE used_credit_type='FREE') AS free,
+                              COUNT(*) FILTER (WHERE used_credit_type='PAID') AS paid FROM calculations) c,
+                      (SELECT COUNT(*) AS cnt, COALESCE(SUM(amount_rub),0) AS sum
+                         FROM payments WHERE status='SUCCEEDED') p,
+                      (SELECT COALESCE(SUM(users_total),0) AS users_total, COALESCE(SUM(users_started),0) AS users_started,
+                              COALESCE(SUM(starts_total),0) AS starts_total,
+                              COALESCE(SUM(calculations_total),0) AS calculations_total,
+                              COALESCE(SUM(free_calculations),0) AS free_calculations,
+                              COALESCE(SUM(paid_calculations),0) AS paid_calculations,
+                              COALESCE(SUM(payments_count),0) AS payments_count,
+                              COALESCE(SUM(payments_sum_rub),0) AS payments_sum_rub,
+                              COALESCE(SUM(users_blocked),0) AS users_blocked
+                         FROM stats_counters WHERE slot <> 0) d
+               ON CONFLICT (slot) DO UPDATE SET
+                   users_total = EXCLUDED.users_total, users_started = EXCLUDED.users_started,
+                   starts_total = EXCLUDED.starts_total, calculations_total = EXCLUDED.calculations_total,
+                   free_calculations = EXCLUDED.free_calculations, paid_calculations = EXCLUDED.paid_calculations,
+                   payments_count = EXCLUDED.payments_count, payments_sum_rub = EXCLUDED.payments_sum_rub,
+                   users_blocked = EXCLUDED.users_blocked"""
+        )
+        return await self.admin_stats()
+
+    async def ensure_stats(self) -> None:
+        """Первый запуск на существующей базе: базовой строки ещё нет — считаем."""
+        row = await self.db.fetchrow("SELECT 1 FROM stats_counters WHERE slot=0")
+        if not row:
+            await self.rebuild_stats()
+
+    async def _iter_chunks(self, sql: str, chunk_size: int):
+        """Читает запрос серверным курсором пачками по chunk_size строк."""
+        async with self.db.transaction() as conn:
+            cur = await conn.cursor(sql)
+            while True:
+                rows = await cur.fetch(chunk_size)
+                if not rows:
+                    break
+                yield [dict(r) for r in rows]
+
+    def iter_export_users(self, chunk_size: int = 2000):
+        return self._iter_chunks(
+            """SELECT u.id, u.tg_user_id, u.created_at, u.last_seen, u.started_count, u.free_credits, u.paid_credits,
+                      COALESCE(c.free_used,0) AS free_used,
+                      COALESCE(c.paid_used,0) AS paid_used,
+                      COALESCE(c.total_calcs,0) AS total_calcs,
+                      COALESCE(p.succeeded,0) AS payments_succeeded
                  FROM users u
-                 LEFT JOIN calculations c ON c.user_id=u.id
-                 GROUP BY u.id
-                 ORDER BY u.created_at DESC"""
+                 LEFT JOIN (
+                     SELECT user_id,
+                            COUNT(*) FILTER (WHERE used_credit_type='FREE') AS free_used,
+                            COUNT(*) FILTER (WHERE used_credit_type='PAID') AS paid_used,
+                            COUNT(*) AS total_calcs
+                       FROM calculations GROUP BY user_id
+                 ) c ON c.user_id=u.id
+                 LEFT JOIN (
+                     SELECT user_id, COUNT(*) AS succeeded
+                       FROM payments WHERE status='SUCCEEDED' GROUP BY user_id
+                 ) p ON p.user_id=u.id
+                 ORDER BY u.created_at DESC""",
+            chunk_size,
         )
-        users_rows = [dict(r) for r in rows]
 
-        pays = await self.db.fetch(
-            """SELECT u.tg_user_id, p.created_at, p.provider_payment_id, p.status, p.pack_sku_credits, p.amount_rub
+    def iter_export_payments(self, chunk_size: int = 2000):
+        return self._iter_chunks(
+            """SELECT p.id, u.tg_user_id AS user_id, p.created_at, p.amount_rub,
+                      p.pack_sku_credits AS credits, p.provider, p.provider_payment_id AS external_id, p.status
                  FROM payments p
                  JOIN users u ON u.id=p.user_id
-                 ORDER BY p.created_at DESC"""
+                 ORDER BY p.created_at DESC""",
+            chunk_size,
         )
-        payments_rows = [dict(r) for r in pays]
-        return users_rows, payments_rows
 
     async def create_payment_record(self, tg_user_id: int, provider: str, provider_payment_id: str, status: str,
                                     pack_credits: int, amount_rub: int, raw: dict) -> None:
-        user = await self.db.fetchrow("SELECT id FROM users WHERE tg_user_id=$1", tg_user_id)
-        if not user:
+        user, key = self._user_ref(tg_user_id)
+        row = await self.db.fetchrow(
+            f"""WITH u AS (SELECT id FROM users WHERE id={user}),
+                 ins AS (
+                     INSERT INTO payments (user_id, provider, provider_payment_id, status, pack_sku_credits, amount_rub, raw)
+                     SELECT u.id, $2, $3, $4, $5, $6, $7::jsonb FROM u
+                     ON CONFLICT (provider_payment_id) DO NOTHING
+                 )
+                 SELECT id FROM u""",
+            key, provider, provider_payment_id, status, pack_credits, amount_rub, json.dumps(raw)
+        )
+        if not row:
             raise RuntimeError("User not found")
-        await self.db.execute(
-            """INSERT INTO payments (user_id, provider, provider_payment_id, status, pack_sku_credits, amount_rub, raw)
-                 VALUES ($1,$2,$3,$4,$5,$6,$7::jsonb)
-                 ON CONFLICT (provider_payment_id) DO NOTHING""",
-            user["id"], provider, provider_payment_id, status, pack_credits, amount_rub, json.dumps(raw)
+        self.user_ids.put(tg_user_id, int(row["id"]))
+
+    async def settle_payment(self, provider_payment_id: str, status: str, raw: dict) -> Optional[dict]:
+        """
+        Закрывает платёж одним запросом (одна транзакция, один round trip):
+        переход только из PENDING, при SUCCEEDED — начисление пакета.
+        Строки платежа и пользователя блокируются, поэтому параллельные
+        вызовы (двойной тап, поллер, вебхук) начисляют ровно один раз, а
+        проигравший видит уже итоговый баланс.
+        Возвращает tg_user_id, credits, applied (переход сделан этим вызовом),
+        status и баланс после операции; None — платежа нет.
+        """
+        row = await self.db.fetchrow(
+            """WITH cur AS (
+                   SELECT p.id, p.status, p.pack_sku_credits, u.id AS user_id, u.tg_user_id,
+                          u.free_credits, u.paid_credits
+                     FROM payments p JOIN users u ON u.id = p.user_id
+                    WHERE p.provider_payment_id = $1
+                      FOR UPDATE
+               ), upd AS (
+                   UPDATE payments p SET status = $2, raw = p.raw || $3::jsonb
+                     FROM cur WHERE p.id = cur.id AND cur.status = 'PENDING'
+               ), credit AS (
+                   UPDATE users u SET paid_credits = u.paid_credits + cur.pack_sku_credits
+                     FROM cur WHERE u.id = cur.user_id AND cur.status = 'PENDING' AND $2 = 'SUCCEEDED'
+               )
+               SELECT cur.user_id, cur.tg_user_id, cur.pack_sku_credits AS credits,
+                      cur.status = 'PENDING' AS applied,
+                      CASE WHEN cur.status = 'PENDING' THEN $2 ELSE cur.status END AS status,
+                      cur.free_credits,
+                      cur.paid_credits + CASE WHEN cur.status = 'PENDING' AND $2 = 'SUCCEEDED'
+                                              THEN cur.pack_sku_credits ELSE 0 END AS paid_credits
+                 FROM cur""",
+            provider_payment_id, status, json.dumps(raw)
+        )
+        if not row:
+            return None
+        self.user_ids.put(int(row["tg_user_id"]), int(row["user_id"]))
+        return dict(row)
+
+    async def list_pending_payments(self, *, after_id: int, limit: int,
+                                    min_age_sec: int, max_age_hours: int) -> list[dict]:
+        """PENDING-платежи по возрастанию id (keyset-пагинация по after_id)."""
+        rows = await self.db.fetch(
+            """SELECT id, provider_payment_id FROM payments
+                WHERE status='PENDING' AND id > $1
+                  AND created_at < now() - make_interval(secs => $3)
+                  AND created_at > now() - make_interval(hours => $4)
+                ORDER BY id LIMIT $2""",
+            after_id, limit, min_age_sec, max_age_hours
         )
+        return [dict(r) for r in rows]
+
+    # --- рассылки ---
+
+    async def create_broadcast_draft(self, *, created_by: int, segment: str) -> tuple[int, int]:
+        """
+        Черновик рассылки: получатели сегмента сразу раскладываются в
+        broadcast_deliveries на стороне БД. Возвращает (id, число получателей);
+        в FSM хранится только это.
+        """
+        async with self.db.transaction() as conn:
+            bid = await conn.fetchval(
+                """INSERT INTO broadcasts (created_by, segment, text, status)
+                   VALUES ($1, $2, '', 'DRAFT') RETURNING id""",
+                created_by, segment
+            )
+            where = SEGMENT_WHERE.get(segment, "false")
+            res = await conn.execute(
+                f"""INSERT INTO broadcast_deliveries (broadcast_id, tg_user_id)
+                    SELECT $1, u.tg_user_id FROM users u WHERE {where}""",
+                bid
+            )
+            total = int(res.split()[-1])
+            await conn.execute("UPDATE broadcasts SET total=$2 WHERE id=$1", bid, total)
+        return int(bid), total
+
+    async def create_broadcast_draft_from_chunks(self, *, created_by: int,
+                                                 chunks: AsyncIterator[list[int]]) -> tuple[int, dict]:
+        """
+        Черновик рассылки из загруженного списка id: пачки копируются (COPY)
+        во временную таблицу, дедуплицируются и сверяются с users уже в БД.
+        В получатели попадают только известные боту и не заблокировавшие его.
+        Возвращает (id, сводка: uploaded/duplicates/unknown/blocked/valid).
+        """
+        async with self.db.transaction() as conn:
+            await conn.execute("CREATE TEMP TABLE bc_staging (tg_user_id BIGINT NOT NULL) ON COMMIT DROP")
+            uploaded = 0
+            async for chunk in chunks:
+                await conn.copy_records_to_table("bc_staging", records=[(uid,) for uid in chunk])
+                uploaded += len(chunk)
+            bid = await conn.fetchval(
+                """INSERT INTO broadcasts (created_by, segment, text, status)
+                   VALUES ($1, 'csv', '', 'DRAFT') RETURNING id""",
+                created_by
+            )
+            row = await conn.fetchrow(
+                """WITH s AS (
+                       SELECT DISTINCT st.tg_user_id, u.id AS user_id, u.blocked_at
+                         FROM bc_staging st
+                         LEFT JOIN users u ON u.tg_user_id = st.tg_user_id
+                   ), ins AS (
+                       INSERT INTO broadcast_deliveries (broadcast_id, tg_user_id)
+                       SELECT $1, tg_user_id FROM s WHERE user_id IS NOT NULL AND blocked_at IS NULL
+                       RETURNING 1
+                   )
+                   SELECT (SELECT COUNT(*) FROM s) AS unique_ids,
+                          (SELECT COUNT(*) FROM s WHERE user_id IS NULL) AS unknown,
+                          (SELECT COUNT(*) FROM s WHERE blocked_at IS NOT NULL) AS blocked,
+                          (SELECT COUNT(*) FROM ins) AS valid""",
+                bid
+            )
+            await conn.execute("UPDATE broadcasts SET total=$2 WHERE id=$1", bid, row["valid"])
+        return int(bid), {
+            "uploaded": uploaded,
+            "duplicates": uploaded - int(row["unique_ids"]),
+            "unknown": int(row["unknown"]),
+            "blocked": int(row["blocked"]),
+            "valid": int(row["valid"]),
+        }
 
-    async def update_payment_status(self, provider_payment_id: str, status: str, raw: dict) -> None:
+    async def start_broadcast(self, broadcast_id: int, *, text: str, media: str | None,
+                              media_type: str | None) -> Optional[int]:
+        """Черновик → RUNNING (его подхватит BroadcastWorker); возвращает число получателей."""
+        return await self.db.fetchval(
+            """UPDATE broadcasts SET text=$2, media=$3, media_type=$4, status='RUNNING'
+                WHERE id=$1 AND status='DRAFT' RETURNING total""",
+            broadcast_id, text, media, media_type
+        )
+
+    async def delete_broadcast_draft(self, broadcast_id: int) -> None:
+        await self.db.execute("DELETE FROM broadcasts WHERE id=$1 AND status='DRAFT'", broadcast_id)
+
+    async def cleanup_broadcast_drafts(self, older_than_hours: int = 24) -> int:
+        """Брошенные черновики (админ не подтвердил рассылку)."""
+        res = await self.db.execute(
+            "DELETE FROM broadcasts WHERE status='DRAFT' AND created_at < now() - make_interval(hours => $1)",
+            older_than_hours
+        )
+        return int(res.split()[-1])
+
+    async def set_broadcast_progress_message(self, broadcast_id: int, chat_id: int, message_id: int) -> None:
         await self.db.execute(
-            "UPDATE payments SET status=$2, raw=$3::jsonb WHERE provider_payment_id=$1",
-            provider_payment_id, status, json.dumps(raw)
+            "UPDATE broadcasts SET progress_chat_id=$2, progress_message_id=$3 WHERE id=$1",
+            broadcast_id, chat_id, message_id
         )
 
-    async def get_payment(self, provider_payment_id: str) -> Optional[dict]:
-        row = await self.db.fetchrow("SELECT * FROM payments WHERE provider_payment_id=$1", provider_payment_id)
+    async def get_broadcast(self, broadcast_id: int) -> Optional[dict]:
+        row = await self.db.fetchrow("SELECT * FROM broadcasts WHERE id=$1", broadcast_id)
         return dict(row) if row else None
 
-    async def list_user_ids(self, segment: str) -> list[int]:
-        if segment == "all":
-            rows = await self.db.fetch("SELECT tg_user_id FROM users")
-        elif segment == "free_remaining":
-            rows = await self.db.fetch("SELECT tg_user_id FROM users WHERE free_credits>0")
-        elif segment == "free_finished":
-            rows = await self.db.fetch("SELECT tg_user_id FROM users WHERE free_credits=0")
-        elif segment == "buyers":
-            rows = await self.db.fetch(
-                """SELECT DISTINCT u.tg_user_id
-                   FROM users u
-                   JOIN payments p ON p.user_id=u.id
-                  WHERE p.status='SUCCEEDED'"""
-            )
-        else:
-            rows = []
-        return [int(r["tg_user_id"]) for r in rows]
+    async def claim_deliveries(self, limit: int, stale_after_sec: int) -> list[tuple[int, int]]:
+        """
+        Забирает до limit получателей активных рассылок: PENDING, а также
+        SENDING, зависшие дольше stale_after_sec (процесс упал посреди пачки).
+        SKIP LOCKED — несколько процессов бота не мешают друг другу.
+        """
+        rows = await self.db.fetch(
+            """WITH picked AS (
+                   SELECT d.broadcast_id, d.tg_user_id
+                     FROM broadcast_deliveries d
+                     JOIN broadcasts b ON b.id = d.broadcast_id
+                    WHERE b.status = 'RUNNING'
+                      AND (d.status = 'PENDING'
+                           OR (d.status = 'SENDING' AND d.claimed_at < now() - make_interval(secs => $2)))
+                    ORDER BY d.broadcast_id, d.tg_user_id
+                    LIMIT $1
+                    FOR UPDATE OF d SKIP LOCKED
+               )
+               UPDATE broadcast_deliveries d
+                  SET status = 'SENDING', claimed_at = now()
+                 FROM picked
+                WHERE d.broadcast_id = picked.broadcast_id AND d.tg_user_id = picked.tg_user_id
+               RETURNING d.broadcast_id, d.tg_user_id""",
+            limit, stale_after_sec
+        )
+        return [(int(r["broadcast_id"]), int(r["tg_user_id"])) for r in rows]
+
+    async def finish_deliveries(self, results: list[tuple[int, int, str]]) -> None:
+        """
+        Итоги доставки пачкой: [(broadcast_id, tg_user_id, status)].
+        Заблокировавшим бота и удалённым аккаунтам ставится users.blocked_at.
+        """
+        if not results:
+            return
+        await self.db.execute(
+            """WITH r AS (
+                   SELECT * FROM unnest($1::bigint[], $2::bigint[], $3::text[]) AS r(broadcast_id, tg_user_id, status)
+               ), d AS (
+                   UPDATE broadcast_deliveries d
+                      SET status = r.status, sent_at = now()
+                     FROM r
+                    WHERE d.broadcast_id = r.broadcast_id AND d.tg_user_id = r.tg_user_id
+               )
+               UPDATE users u SET blocked_at = now()
+                 FROM r
+                WHERE u.tg_user_id = r.tg_user_id AND r.status IN ('BLOCKED', 'DEACTIVATED')
+                  AND u.blocked_at IS NULL""",
+            [r[0] for r in results], [r[1] for r in results], [r[2] for r in results]
+        )
+
+    async def broadcast_progress(self, broadcast_id: int) -> dict[str, int]:
+        rows = await self.db.fetch(
+            "SELECT status, COUNT(*) AS c FROM broadcast_deliveries WHERE broadcast_id=$1 GROUP BY status",
+            broadcast_id
+        )
+        return {r["status"]: int(r["c"]) for r in rows}
+
+    async def complete_broadcasts(self) -> list[dict]:
+        """Закрывает рассылки без открытых доставок; возвращает закрытые."""
+        rows = await self.db.fetch(
+            """UPDATE broadcasts b SET status = 'DONE', finished_at = now()
+                WHERE b.status = 'RUNNING'
+                  AND NOT EXISTS (
+                      SELECT 1 FROM broadcast_deliveries d
+                       WHERE d.broadcast_id = b.id AND d.status IN ('PENDING', 'SENDING')
+                  )
+               RETURNING b.*"""
+        )
+        return [dict(r) for r in rows]
 
     async def delete_calculation(self, tg_user_id: int, calc_id: int) -> bool:
-        user = await self.db.fetchrow("SELECT id FROM users WHERE tg_user_id=$1", tg_user_id)
-        if not user:
-            return False
-        
+        user, key = self._user_ref(tg_user_id)
         row = await self.db.fetchrow(
-            "DELETE FROM calculations WHERE id=$1 AND user_id=$2 RETURNING id",
+            f"DELETE FROM calculations WHERE id=$2 AND user_id={user} RETURNING id",
+            key,
             calc_id,
-            user["id"],
         )
         return row is not None
 
@@ -0,0 +1,393 @@
+from __future__ import annotations
+
+import asyncio
+import csv
+import logging
+import time
+from dataclasses import dataclass
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable, Iterator, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from app.repo import Repo
+
+logger = logging.getLogger(__name__)
+
+# Глобальный лимит Telegram — около 30 сообщений в секунду, держим запас
+BROADCAST_RATE = 28.0
+BROADCAST_CONCURRENCY = 16
+BROADCAST_MAX_ATTEMPTS = 4
+
+# Итог доставки одному получателю
+SENT = "SENT"
+BLOCKED = "BLOCKED"          # пользователь заблокировал бота
+DEACTIVATED = "DEACTIVATED"  # аккаунт удалён / чат не найден
+FAILED = "FAILED"            # прочие ошибки (после ретраев)
+
+
+class TokenBucket:
+    """
+    Token bucket для исходящих запросов: не больше rate в секунду,
+    всплеск до capacity. pause() останавливает выдачу для всех отправителей
+    (ответ Telegram retry_after относится ко всему боту).
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+
+@dataclass(frozen=True)
+class BroadcastMessage:
+    text: str
+    media: Optional[str] = None
+    media_type: Optional[str] = None  # photo / video / animation / document
+
+
+@dataclass
+class BroadcastStats:
+    total: int = 0
+    sent: int = 0
+    blocked: int = 0
+    deactivated: int = 0
+    failed: int = 0
+    retry_after_waits: int = 0
+    started_at: float = 0.0
+
+    @property
+    def done(self) -> int:
+        return self.sent + self.blocked + self.deactivated + self.failed
+
+    @property
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.started_at
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def add(self, status: str) -> None:
+        if status == SENT:
+            self.sent += 1
+        elif status == BLOCKED:
+            self.blocked += 1
+        elif status == DEACTIVATED:
+            self.deactivated += 1
+        else:
+            self.failed += 1
+
+
+async def send_one(bot: Bot, chat_id: int, msg: BroadcastMessage) -> None:
+    if msg.media and msg.media_type == "photo":
+        await bot.send_photo(chat_id, msg.media, caption=msg.text)
+    elif msg.media and msg.media_type == "video":
+        await bot.send_video(chat_id, msg.media, caption=msg.text)
+    elif msg.media and msg.media_type == "animation":
+        await bot.send_animation(chat_id, msg.media, caption=msg.text)
+    elif msg.media and msg.media_type == "document":
+        await bot.send_document(chat_id, msg.media, caption=msg.text)
+    else:
+        await bot.send_message(chat_id, msg.text)
+
+
+def classify_error(e: Exception) -> str:
+    """Во что превращается ошибка Telegram для получателя."""
+    text = str(e).lower()
+    if isinstance(e, TelegramForbiddenError):
+        return DEACTIVATED if "deactivated" in text else BLOCKED
+    if isinstance(e, TelegramBadRequest) and ("chat not found" in text or "user not found" in text):
+        return DEACTIVATED
+    return FAILED
+
+
+async def deliver(bot: Bot, chat_id: int, msg: BroadcastMessage, limiter: TokenBucket,
+                  stats: BroadcastStats | None = None, max_attempts: int = BROADCAST_MAX_ATTEMPTS) -> str:
+    """Отправка одному получателю с учётом лимита и ретраев; возвращает статус доставки."""
+    for attempt in range(1, max_attempts + 1):
+        await limiter.acquire()
+        try:
+            await send_one(bot, chat_id, msg)
+            return SENT
+        except TelegramRetryAfter as e:
+            # flood control: ставим на паузу всех отправителей и пробуем снова
+            limiter.pause(e.retry_after)
+            if stats is not None:
+                stats.retry_after_waits += 1
+            logger.warning("broadcast: retry_after=%s (chat %s)", e.retry_after, chat_id)
+        except (TelegramNetworkError, TelegramServerError) as e:
+            if attempt == max_attempts:
+                logger.warning("broadcast: giving up on chat %s: %s", chat_id, e)
+                return FAILED
+            await asyncio.sleep(min(2 ** attempt, 30))
+        except Exception as e:
+            status = classify_error(e)
+            if status == FAILED:
+                logger.warning("broadcast: chat %s failed: %s", chat_id, e)
+            return status
+    return FAILED
+
+
+class RecipientCsv:
+    """
+    Потоковое чтение CSV со списком получателей (первая колонка — tg user_id):
+    файл читается построчно, id отдаются пачками. Строки, где нет
+    корректного id (заголовок, мусор, число вне BIGINT), считаются в invalid.
+    """
+
+    def __init__(self, path: str, chunk_size: int = 5000):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.rows = 0
+        self.invalid = 0
+
+    def chunks(self) -> Iterator[list[int]]:
+        with open(self.path, newline="", encoding="utf-8-sig", errors="replace") as f:
+            chunk: list[int] = []
+            for row in csv.reader(f):
+                if not row or not row[0].strip():
+                    continue
+                self.rows += 1
+                cell = row[0].split(";")[0].strip()  # CSV из Excel (RU) — через ";"
+                # только ASCII-цифры (isdigit() пропускает «²», «١») и в пределах BIGINT
+                v = int(cell) if cell.isascii() and cell.isdigit() else 0
+                if not 0 < v < 2 ** 63:
+                    self.invalid += 1
+                    continue
+                chunk.append(v)
+                if len(chunk) >= self.chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
+    async def achunks(self) -> AsyncIterator[list[int]]:
+        """То же, но чтение каждой пачки — в отдельном потоке."""
+        it = self.chunks()
+        while True:
+            chunk = await asyncio.to_thread(next, it, None)
+            if chunk is None:
+                return
+            yield chunk
+
+
+async def _iter_ids(user_ids: Iterable[int] | AsyncIterable[int]):
+    if hasattr(user_ids, "__aiter__"):
+        async for uid in user_ids:
+            yield uid
+    else:
+        for uid in user_ids:
+            yield uid
+
+
+async def run_broadcast(
+    bot: Bot,
+    user_ids: Iterable[int] | AsyncIterable[int],
+    msg: BroadcastMessage,
+    *,
+    rate: float = BROADCAST_RATE,
+    concurrency: int = BROADCAST_CONCURRENCY,
+    total: int = 0,
+    limiter: TokenBucket | None = None,
+    on_result: Callable[[int, str], Awaitable[None]] | None = None,
+    on_progress: Callable[[BroadcastStats], Awaitable[None]] | None = None,
+    progress_every: float = 5.0,
+) -> BroadcastStats:
+    """
+    Рассылка пулом из concurrency отправителей под общим token bucket
+    (можно передать свой limiter, чтобы лимит был общим между вызовами).
+    on_result(chat_id, status) вызывается на каждого получателя,
+    on_progress(stats) — не чаще раза в progress_every секунд.
+    """
+    limiter = limiter or TokenBucket(rate)
+    stats = BroadcastStats(total=total, started_at=time.monotonic())
+    queue: asyncio.Queue[int | None] = asyncio.Queue(maxsize=concurrency * 4)
+    last_progress = time.monotonic()
+
+    async def worker() -> None:
+        nonlocal last_progress
+        while True:
+            uid = await queue.get()
+            if uid is None:
+                return
+            status = await deliver(bot, uid, msg, limiter, stats)
+            stats.add(status)
+            if on_result is not None:
+                await on_result(uid, status)
+            if on_progress is not None and time.monotonic() - last_progress >= progress_every:
+                last_progress = time.monotonic()
+                try:
+                    await on_progress(stats)
+                except Exception:
+                    logger.exception("broadcast progress callback failed")
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        async for uid in _iter_ids(user_ids):
+            await queue.put(uid)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for w in workers:
+            w.cancel()
+    stats.total = max(stats.total, stats.done)
+    return stats
+
+
+class BroadcastWorker:
+    """
+    Фоновый исполнитель рассылок из БД (broadcasts / broadcast_deliveries).
+    Забирает получателей пачками, отправляет через run_broadcast, пишет итоги
+    пачкой и обновляет сообщение с прогрессом у админа. stop() даёт текущей
+    пачке доотправиться (не дольше stop_timeout), итоги пишутся и при отмене —
+    иначе после рестарта уже отправленное ушло бы повторно. Если процесс упал,
+    незавершённые SENDING через stale_after_sec забираются снова.
+    Лимит rate — на процесс; при нескольких процессах бота его нужно делить.
+    """
+
+    def __init__(self, repo: Repo, bot: Bot, *, batch_size: int = 100, rate: float = BROADCAST_RATE,
+                 concurrency: int = BROADCAST_CONCURRENCY, poll_interval: float = 3.0,
+                 stale_after_sec: int = 600, progress_every: float = 5.0, stop_timeout: float = 30.0):
+        self.repo = repo
+        self.bot = bot
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.stale_after_sec = stale_after_sec
+        self.progress_every = progress_every
+        self.stop_timeout = stop_timeout
+        self.limiter = TokenBucket(rate)
+        # кэшируется только содержимое сообщения; id сообщения с прогрессом
+        # может появиться уже после старта рассылки, его читаем в _report
+        self._messages: dict[int, BroadcastMessage] = {}
+        self._progress_at: dict[int, float] = {}
+        self._cleanup_at = 0.0
+        self._task: asyncio.Task | None = None
+        self._stopping = asyncio.Event()
+
+    async def _message(self, broadcast_id: int) -> BroadcastMessage | None:
+        if broadcast_id not in self._messages:
+            b = await self.repo.get_broadcast(broadcast_id)
+            if not b:
+                return None
+            self._messages[broadcast_id] = BroadcastMessage(b["text"], b["media"], b["media_type"])
+        return self._messages[broadcast_id]
+
+    async def run_once(self) -> int:
+        """Одна пачка; возвращает число обработанных получателей."""
+        claimed = await self.repo.claim_deliveries(self.batch_size, self.stale_after_sec)
+        if not claimed:
+            if time.monotonic() - self._cleanup_at > 3600:
+                self._cleanup_at = time.monotonic()
+                await self.repo.cleanup_broadcast_drafts()
+            for b in await self.repo.complete_broadcasts():
+                await self._report(b, final=True)
+                self._messages.pop(b["id"], None)
+                self._progress_at.pop(b["id"], None)
+            return 0
+
+        by_broadcast: dict[int, list[int]] = {}
+        for bid, uid in claimed:
+            by_broadcast.setdefault(bid, []).append(uid)
+
+        for bid, uids in by_broadcast.items():
+            msg = await self._message(bid)
+            results: list[tuple[int, int, str]] = []
+            try:
+                if msg is None:
+                    results = [(bid, uid, FAILED) for uid in uids]
+                else:
+                    async def collect(uid: int, status: str, bid: int = bid) -> None:
+                        results.append((bid, uid, status))
+
+                    await run_broadcast(
+                        self.bot, uids, msg, concurrency=self.concurrency,
+                        limiter=self.limiter, on_result=collect,
+                    )
+            finally:
+                # и при отмене: уже отправленные не должны остаться SENDING
+                await self.repo.finish_deliveries(results)
+            if msg is not None and time.monotonic() - self._progress_at.get(bid, 0.0) >= self.progress_every:
+                self._progress_at[bid] = time.monotonic()
+                b = await self.repo.get_broadcast(bid)
+                if b:
+                    await self._report(b)
+        return len(claimed)
+
+    async def _report(self, b: dict, final: bool = False) -> None:
+        if not b.get("progress_chat_id"):
+            return
+        p = await self.repo.broadcast_progress(b["id"])
+        done = sum(v for k, v in p.items() if k not in ("PENDING", "SENDING"))
+        text = (
+            f"{'✅ Рассылка завершена' if final else '📣 Рассылка'} #{b['id']}: {done}/{b['total']}\n"
+            f"Отправлено: {p.get(SENT, 0)}, заблокировали бота: {p.get(BLOCKED, 0)}, "
+            f"удалённые аккаунты: {p.get(DEACTIVATED, 0)}, ошибок: {p.get(FAILED, 0)}"
+        )
+        try:
+            await self.bot.edit_message_text(text, chat_id=b["progress_chat_id"],
+                                             message_id=b["progress_message_id"])
+        except Exception:
+            logger.debug("broadcast #%s: progress message not updated", b["id"], exc_info=True)
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                n = await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("broadcast worker iteration failed")
+                n = 0
+            if n == 0:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    def start(self) -> None:
+        if self._task is None:
+            self._stopping.clear()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Новые пачки не берём, текущую доотправляем; по stop_timeout — отмена."""
+        if self._task is None:
+            return
+        self._stopping.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), self.stop_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("broadcast worker: batch not finished in %.0fs, cancelling", self.stop_timeout)
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
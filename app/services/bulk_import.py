@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import codecs
+import csv
+import math
+import os
+import zipfile
+from dataclasses import dataclass, field
+from typing import Iterator
+
+from openpyxl.utils.exceptions import InvalidFileException
+
+from app.constants import SCHEMES_BY_MP
+from app.reference_data import INPUT_REFERENCE_KEYS, get_default_input
+from app.services.calc import ADS_MODES, COMMISSION_MODES, TAX_MODES, CalcInputs, compute_batch, optimize_batch
+
+# Колонки файла: служебные + поля CalcInputs
+CALC_FIELDS = list(CalcInputs.__dataclass_fields__)
+BULK_COLUMNS = ["marketplace", "scheme", "sku_label", *CALC_FIELDS, "elasticity"]
+
+# Русские заголовки, которые тоже понимаем
+HEADER_ALIASES = {
+    "маркетплейс": "marketplace",
+    "схема": "scheme",
+    "название": "sku_label",
+    "артикул": "sku_label",
+    "sku": "sku_label",
+    "цена": "price",
+    "себестоимость": "cogs",
+}
+
+MODE_DEFAULTS = {
+    "commission_mode": "PCT",
+    "ads_mode": "DRR",
+    "tax_mode": "REV",
+}
+
+_MODE_CHOICES = {
+    "commission_mode": COMMISSION_MODES,
+    "ads_mode": ADS_MODES,
+    "tax_mode": TAX_MODES,
+}
+
+# Поля, которые в файле указываются в процентах (как в диалоге)
+_ALWAYS_PCT = {"returns_pct", "tax_rate"}
+
+
+class BulkFileError(Exception):
+    """Файл нельзя разобрать целиком (формат, заголовки, размер)."""
+
+
+@dataclass
+class BulkRow:
+    line: int
+    marketplace: str
+    scheme: str
+    sku_label: str | None
+    inputs: dict  # {field: {"value": ..., "source": ...}} — как в FSM диалога
+    elasticity: float | None = None  # если задана — подбираем оптимальную цену
+
+
+@dataclass
+class BulkParseResult:
+    rows: list[BulkRow] = field(default_factory=list)
+    errors: list[tuple[int, str]] = field(default_factory=list)
+
+
+def _parse_number(v) -> float:
+    if isinstance(v, (int, float)):
+        f = float(v)
+    else:
+        f = float(str(v).strip().replace(" ", "").replace("\xa0", "").replace(",", ".").rstrip("%"))
+    if not math.isfinite(f):
+        raise ValueError(v)
+    return f
+
+
+def _norm_header(h) -> str:
+    key = str(h or "").strip().lower()
+    return HEADER_ALIASES.get(key, key)
+
+
+def _csv_encoding(path: str) -> str:
+    """utf-8 (с BOM или без), иначе cp1251 — так сохраняет CSV Excel в RU."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    with open(path, "rb") as f:
+        try:
+            while block := f.read(64 * 1024):
+                decoder.decode(block)
+            decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            return "cp1251"
+    return "utf-8-sig"
+
+
+def _iter_csv(path: str) -> Iterator[list]:
+    with open(path, newline="", encoding=_csv_encoding(path), errors="replace") as f:
+        # разделитель — по строке заголовков (Excel в RU сохраняет CSV через ";")
+        first = f.readline()
+        f.seek(0)
+        delimiter = max(";,\t", key=first.count)
+        yield from csv.reader(f, delimiter=delimiter)
+
+
+def _iter_xlsx(path: str) -> Iterator[list]:
+    from openpyxl import load_workbook
+
+    try:
+        wb = load_workbook(path, read_only=True, data_only=True)
+    except KeyError as e:  # zip без частей книги (xlsx переименован из другого формата)
+        raise BulkFileError("Файл .xlsx повреждён") from e
+    try:
+        ws = wb.worksheets[0]
+        for row in ws.iter_rows(values_only=True):
+            yield list(row)
+    finally:
+        wb.close()
+
+
+def iter_table(path: str, filename: str) -> Iterator[tuple[int, dict]]:
+    """Построчно читает CSV/XLSX, отдаёт (номер строки, {колонка: значение})."""
+    ext = os.path.splitext(filename.lower())[1]
+    if ext == ".csv":
+        raw = _iter_csv(path)
+    elif ext == ".xlsx":
+        raw = _iter_xlsx(path)
+    else:
+        raise BulkFileError("Поддерживаются только .csv и .xlsx")
+
+    header: list[str] | None = None
+    for line, values in enumerate(raw, start=1):
+        if header is None:
+            header = [_norm_header(h) for h in values]
+            missing = [c for c in ("marketplace", "scheme", "price", "cogs") if c not in header]
+            if missing:
+                raise BulkFileError(f"Нет обязательных колонок: {', '.join(missing)}")
+            continue
+        if not any(v not in (None, "") for v in values):
+            continue
+        yield line, {h: v for h, v in zip(header, values) if h in BULK_COLUMNS}
+
+
+def _row_inputs(cells: dict, mp: str, scheme: str) -> dict:
+    """Заполняет inputs строки так же, как диалог: USER / DEFAULT / ZERO."""
+    inputs: dict = {}
+    for name, default in MODE_DEFAULTS.items():
+        raw = cells.get(name)
+        if raw in (None, ""):
+            inputs[name] = {"value": default, "source": "DEFAULT"}
+            continue
+        mode = str(raw).strip().upper()
+        if mode not in _MODE_CHOICES[name]:
+            raise ValueError(f"{name}: неизвестный режим {raw!r}")
+        inputs[name] = {"value": mode, "source": "USER"}
+
+    for name in CALC_FIELDS:
+        if name in MODE_DEFAULTS:
+            continue
+        raw = cells.get(name)
+        if raw in (None, ""):
+            if name == "price":
+                raise ValueError("не указана цена")
+            v = get_default_input(mp, scheme, name) if name in INPUT_REFERENCE_KEYS else 0.0
+            inputs[name] = {"value": v, "source": "DEFAULT" if v != 0 else "ZERO"}
+            continue
+        try:
+            v = _parse_number(raw)
+        except ValueError:
+            raise ValueError(f"{name}: не число ({raw!r})") from None
+        pct = (
+            name in _ALWAYS_PCT
+            or (name == "commission_value" and inputs["commission_mode"]["value"] == "PCT")
+            or (name == "ads_value" and inputs["ads_mode"]["value"] == "DRR")
+        )
+        inputs[name] = {"value": v / 100.0 if pct else v, "source": "USER"}
+
+    if inputs["price"]["value"] <= 0:
+        raise ValueError("цена должна быть больше 0")
+    return inputs
+
+
+# Ошибки чтения «чужих» файлов: битый/переименованный xlsx, мусор вместо CSV
+_UNREADABLE = (UnicodeDecodeError, csv.Error, zipfile.BadZipFile, InvalidFileException)
+
+
+def parse_file(path: str, filename: str, max_rows: int) -> BulkParseResult:
+    try:
+        return _parse_file(path, filename, max_rows)
+    except _UNREADABLE as e:
+        raise BulkFileError("Файл повреждён или сохранён не в формате CSV/XLSX") from e
+
+
+def _parse_file(path: str, filename: str, max_rows: int) -> BulkParseResult:
+    out = BulkParseResult()
+    for line, cells in iter_table(path, filename):
+        if len(out.rows) + len(out.errors) >= max_rows:
+            raise BulkFileError(f"Слишком много строк (максимум {max_rows})")
+        mp = str(cells.get("marketplace") or "").strip().upper()
+        scheme = str(cells.get("scheme") or "").strip().upper()
+        if mp not in SCHEMES_BY_MP:
+            out.errors.append((line, f"неизвестный маркетплейс {mp or '—'}"))
+            continue
+        if scheme not in {code for code, _ in SCHEMES_BY_MP[mp]}:
+            out.errors.append((line, f"схема {scheme or '—'} недоступна для {mp}"))
+            continue
+        try:
+            inputs = _row_inputs(cells, mp, scheme)
+        except ValueError as e:
+            out.errors.append((line, str(e)))
+            continue
+        elasticity = None
+        if cells.get("elasticity") not in (None, ""):
+            try:
+                elasticity = _parse_number(cells["elasticity"])
+            except ValueError:
+                out.errors.append((line, f"elasticity: не число ({cells['elasticity']!r})"))
+                continue
+        label = str(cells.get("sku_label") or "").strip() or None
+        out.rows.append(BulkRow(line, mp, scheme, label, inputs, elasticity))
+    return out
+
+
+def compute_rows(rows: list[BulkRow]) -> list[dict]:
+    """Считает все строки одним compute_batch; результаты — в формате compute()."""
+    if not rows:
+        return []
+    cols: dict[str, list] = {}
+    for name in CALC_FIELDS:
+        modes = _MODE_CHOICES.get(name)
+        if modes:
+            cols[name] = [modes.index(r.inputs[name]["value"]) for r in rows]
+        else:
+            cols[name] = [r.inputs[name]["value"] for r in rows]
+
+    res = compute_batch(cols)
+    if any(r.elasticity is not None for r in rows):
+        elasticity = [math.nan if r.elasticity is None else r.elasticity for r in rows]
+        res.update(optimize_batch(cols, elasticity))
+
+    keys = list(res)
+    columns = [res[k].tolist() for k in keys]
+    out = []
+    for values in zip(*columns):
+        out.append({k: None if math.isnan(v) else v for k, v in zip(keys, values)})
+    return out
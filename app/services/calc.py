@@ -1,6 +1,8 @@
 from __future__ import annotations
-from dataclasses import dataclass
-from typing import Literal, Optional
+from dataclasses import dataclass, replace
+from typing import Any, Literal, Mapping, Optional
+
+import numpy as np
 
 # Для совместимости:
 # - старые значения: "USN6", "USN15", "NPD", "CUSTOM"
@@ -9,6 +11,12 @@ TaxMode = Literal["REV", "PROFIT", "USN6", "USN15", "NPD", "CUSTOM"]
 AdsMode = Literal["PER_SALE", "DRR"]
 CommissionMode = Literal["PCT", "RUB"]
 
+# Коды режимов для пакетного расчёта: код = индекс в кортеже
+COMMISSION_MODES: tuple[str, ...] = ("PCT", "RUB")
+ADS_MODES: tuple[str, ...] = ("PER_SALE", "DRR")
+TAX_MODES: tuple[str, ...] = ("REV", "PROFIT", "USN6", "USN15", "NPD", "CUSTOM")
+_PROFIT_TAX_CODES = (TAX_MODES.index("PROFIT"), TAX_MODES.index("USN15"))
+
 
 @dataclass
 class CalcInputs:
@@ -111,13 +119,66 @@ def _core_compute(inputs: CalcInputs) -> dict:
 
 def _net_profit_for_price(price: float, inputs: CalcInputs) -> float:
     # Важно: используем _core_compute, а НЕ compute → нет рекурсии
-    tmp = CalcInputs(**{**inputs.__dict__, "price": price})
+    tmp = replace(inputs, price=price)
     res = _core_compute(tmp)
     return res["net_profit"]
 
 
-def _breakeven_price(inputs: CalcInputs) -> Optional[float]:
-    lo = 0.01
+# Границы поиска безубыточной цены (те же, что у бисекции)
+_BREAKEVEN_LO = 0.01
+_BREAKEVEN_HI = 1e7
+
+
+def _breakeven_search_hi(price: float) -> float:
+    """
+    Верхняя цена, до которой бисекция находит корень: max(3P, 1000),
+    удвоенная не более 10 раз и не выше _BREAKEVEN_HI. Аналитика отдаёт
+    None за той же границей, чтобы результаты совпадали с бисекцией.
+    """
+    hi = max(price * 3.0, 1000.0)
+    for _ in range(10):
+        if hi * 2.0 > _BREAKEVEN_HI:
+            break
+        hi *= 2.0
+    return hi
+
+
+def _net_profit_line(inputs: CalcInputs) -> Optional[tuple[float, float]]:
+    """
+    Чистая прибыль кусочно-линейна по цене. Возвращает (k, b) такие, что
+    на участке около нуля прибыли знак net_profit(P) совпадает со знаком k*P - b.
+    None — если прибыль не растёт с ценой и аналитика неприменима.
+    """
+    # Прибыль до налога: P * k - b
+    k = 1.0
+    b = inputs.cogs + inputs.logistics + inputs.storage + inputs.other_fees + inputs.opex_var
+    b += _clamp(inputs.returns_pct, 0.0, 1.0) * inputs.return_cost
+
+    if inputs.commission_mode == "PCT":
+        k -= inputs.commission_value
+    else:
+        b += inputs.commission_value
+
+    if inputs.ads_mode == "PER_SALE":
+        b += inputs.ads_value
+    else:
+        k -= inputs.ads_value
+
+    if inputs.tax_mode in ("PROFIT", "USN15"):
+        # net = pbt * (1 - t) при pbt > 0 и net = pbt иначе → корень совпадает с корнем pbt
+        if inputs.tax_rate >= 1.0:
+            return None
+    else:
+        # налог с выручки: net = P * (k - t) - b
+        k -= inputs.tax_rate
+
+    if k <= 0:
+        return None
+    return k, b
+
+
+def _breakeven_price_bisect(inputs: CalcInputs) -> Optional[float]:
+    lo = _BREAKEVEN_LO
     hi = max(inputs.price * 3.0, 1000.0)
 
     # расширяем верхнюю границу, пока прибыль не станет положительной
@@ -125,7 +186,7 @@ def _breakeven_price(inputs: CalcInputs) -> Optional[float]:
         if _net_profit_for_price(hi, inputs) > 0:
             break
         hi *= 2.0
-        if hi > 1e7:
+        if hi > _BREAKEVEN_HI:
             return None
 
     f_lo = _net_profit_for_price(lo, inputs)
@@ -148,8 +209,449 @@ def _breakeven_price(inputs: CalcInputs) -> Optional[float]:
     return (lo + hi) / 2.0
 
 
+def _breakeven_price(inputs: CalcInputs) -> Optional[float]:
+    line = _net_profit_line(inputs)
+    if line is None:
+        # вырожденные случаи (комиссия+ДРР+налог >= 100% и т.п.) — старая бисекция
+        return _breakeven_price_bisect(inputs)
+
+    k, b = line
+    price = b / k
+    if price <= _BREAKEVEN_LO:
+        return _BREAKEVEN_LO
+    if price > _breakeven_search_hi(inputs.price):
+        return None
+    return price
+
+
 def compute(inputs: CalcInputs) -> dict:
     base = _core_compute(inputs)
     be = _breakeven_price(inputs)
     base["breakeven_price"] = round(be, 2) if be is not None else None
     return base
+
+
+# ====== ПАКЕТНЫЙ РАСЧЁТ ======
+#
+# Колонки — те же поля, что у CalcInputs; режимы передаются кодами
+# (индексами в COMMISSION_MODES / ADS_MODES / TAX_MODES). Арифметика
+# повторяет _core_compute операция в операцию, поэтому округлённые
+# результаты совпадают с compute() бит в бит.
+
+_MODE_FIELDS = {
+    "commission_mode": COMMISSION_MODES,
+    "ads_mode": ADS_MODES,
+    "tax_mode": TAX_MODES,
+}
+
+
+def _pos(x: np.ndarray) -> np.ndarray:
+    # то же, что max(0.0, x) поэлементно (включая знак нуля)
+    return np.where(x > 0.0, x, 0.0)
+
+
+def _div_pos(num: np.ndarray, den: np.ndarray) -> np.ndarray:
+    # num / den при den > 0, иначе 0.0
+    out = np.zeros(np.broadcast(num, den).shape)
+    np.divide(num, den, out=out, where=den > 0)
+    return out
+
+
+def _round2(x: np.ndarray) -> np.ndarray:
+    """
+    round(x, 2) поэлементно с тем же результатом, что у встроенного round:
+    точное значение x*100 = y + err (разложение Деккера), половинки — к чётному.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    with np.errstate(invalid="ignore", over="ignore"):
+        y = x * 100.0
+        hi = x * 134217729.0  # 2**27 + 1
+        hi = hi - (hi - x)
+        err = (hi * 100.0 - y) + (x - hi) * 100.0
+
+        n = np.floor(y)
+        above_half = (y - n - 0.5) + err
+        odd = np.floor(n * 0.5) != n * 0.5
+        n = np.where((above_half > 0) | ((above_half == 0) & odd), n + 1.0, n)
+        out = np.copysign(n / 100.0, x)
+
+    # числа, где x*100 уже не помещается в мантиссу (inf и nan выше уже верны)
+    for i in np.flatnonzero(np.isfinite(x) & ~(np.abs(x) < 1e13)):
+        out.flat[i] = round(float(x.flat[i]), 2)
+    return out
+
+
+def _batch_columns(cols: Mapping[str, Any]) -> dict[str, np.ndarray]:
+    names = list(CalcInputs.__dataclass_fields__)
+    missing = [n for n in names if n not in cols]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+    arrays = np.broadcast_arrays(*[
+        np.asarray(cols[n], dtype=np.int64 if n in _MODE_FIELDS else np.float64)
+        for n in names
+    ])
+    return {n: np.ravel(a) for n, a in zip(names, arrays)}
+
+
+def _core_compute_batch(c: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    """Векторная версия _core_compute без округления."""
+    P = c["price"]
+    C = c["cogs"]
+    pct_commission = c["commission_mode"] == COMMISSION_MODES.index("PCT")
+    per_sale_ads = c["ads_mode"] == ADS_MODES.index("PER_SALE")
+    profit_tax = np.isin(c["tax_mode"], _PROFIT_TAX_CODES)
+
+    K = np.where(pct_commission, P * c["commission_value"], c["commission_value"])
+
+    A = np.where(per_sale_ads, c["ads_value"], P * c["ads_value"])
+    DRR = np.where(per_sale_ads, _div_pos(c["ads_value"], P), c["ads_value"])
+
+    L = c["logistics"]
+    S = c["storage"]
+    F_other = c["other_fees"]
+    Opex = c["opex_var"]
+
+    ret_rate = c["returns_pct"]
+    ret_rate = np.where(ret_rate < 1.0, ret_rate, 1.0)
+    ret_rate = np.where(ret_rate > 0.0, ret_rate, 0.0)
+    Ret = ret_rate * c["return_cost"]
+
+    profit_before_tax = P - (C + K + L + S + A + F_other + Ret + Opex)
+
+    tax_base = np.where(profit_tax, _pos(profit_before_tax), _pos(P))
+    tax = tax_base * c["tax_rate"]
+    net_profit = profit_before_tax - tax
+    margin_pct = _div_pos(net_profit, P)
+
+    fixed_costs = C + L + S + F_other + Ret + Opex
+    fixed_costs = fixed_costs + K
+    max_ads = np.where(profit_tax, P - fixed_costs, P - fixed_costs - c["tax_rate"] * P)
+    max_ads = _pos(max_ads)
+    max_drr = _div_pos(max_ads, P)
+
+    return {
+        "profit_before_tax": profit_before_tax,
+        "tax": tax,
+        "net_profit": net_profit,
+        "margin_pct": margin_pct * 100,
+        "ads_rub": A,
+        "drr_pct": DRR * 100,
+        "max_ads_rub": max_ads,
+        "max_drr_pct": max_drr * 100,
+        "commission_rub": K,
+        "returns_cost_expected": Ret,
+    }
+
+
+def _net_profit_line_batch(c: dict[str, np.ndarray]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Векторная версия _net_profit_line: (k, b, маска строк, где линия неприменима)."""
+    profit_tax = np.isin(c["tax_mode"], _PROFIT_TAX_CODES)
+    pct_commission = c["commission_mode"] == COMMISSION_MODES.index("PCT")
+    per_sale_ads = c["ads_mode"] == ADS_MODES.index("PER_SALE")
+
+    ret_rate = c["returns_pct"]
+    ret_rate = np.where(ret_rate < 1.0, ret_rate, 1.0)
+    ret_rate = np.where(ret_rate > 0.0, ret_rate, 0.0)
+
+    k = np.ones_like(c["price"])
+    b = c["cogs"] + c["logistics"] + c["storage"] + c["other_fees"] + c["opex_var"]
+    b = b + ret_rate * c["return_cost"]
+    k = np.where(pct_commission, k - c["commission_value"], k)
+    b = np.where(pct_commission, b, b + c["commission_value"])
+    b = np.where(per_sale_ads, b + c["ads_value"], b)
+    k = np.where(per_sale_ads, k, k - c["ads_value"])
+    k = np.where(profit_tax, k, k - c["tax_rate"])
+
+    fallback = (k <= 0) | (profit_tax & (c["tax_rate"] >= 1.0))
+    return k, b, fallback
+
+
+def _net_profit_for_price_batch(c: dict[str, np.ndarray], price: np.ndarray) -> np.ndarray:
+    return _round2(_core_compute_batch({**c, "price": price})["net_profit"])
+
+
+def _breakeven_price_bisect_batch(c: dict[str, np.ndarray]) -> np.ndarray:
+    """
+    Векторная _breakeven_price_bisect: те же шаги (расширение границы,
+    проверка концов, 60 делений) сразу для всех строк; None → nan.
+    """
+    n = len(c["price"])
+    out = np.full(n, np.nan)
+    lo = np.full(n, _BREAKEVEN_LO)
+    hi = np.maximum(c["price"] * 3.0, 1000.0)
+    open_ = np.ones(n, dtype=bool)
+
+    growing = open_.copy()
+    for _ in range(10):
+        growing &= ~(_net_profit_for_price_batch(c, hi) > 0)
+        hi = np.where(growing, hi * 2.0, hi)
+        gave_up = growing & (hi > _BREAKEVEN_HI)
+        open_ &= ~gave_up
+        growing &= ~gave_up
+
+    f_lo = _net_profit_for_price_batch(c, lo)
+    f_hi = _net_profit_for_price_batch(c, hi)
+    both_pos = open_ & (f_lo > 0) & (f_hi > 0)
+    out[both_pos] = lo[both_pos]
+    open_ &= ~both_pos & ~((f_lo < 0) & (f_hi < 0))
+
+    for _ in range(60):
+        if not open_.any():
+            break
+        mid = (lo + hi) / 2.0
+        f_mid = _net_profit_for_price_batch(c, mid)
+        hit = open_ & (np.abs(f_mid) < 0.01)
+        out[hit] = mid[hit]
+        open_ &= ~hit
+        hi = np.where(open_ & (f_mid > 0), mid, hi)
+        lo = np.where(open_ & ~(f_mid > 0), mid, lo)
+    out[open_] = ((lo + hi) / 2.0)[open_]
+    return out
+
+
+def _breakeven_price_batch(c: dict[str, np.ndarray]) -> np.ndarray:
+    """Векторная версия _breakeven_price; None → nan."""
+    k, b, fallback = _net_profit_line_batch(c)
+    safe_k = np.where(fallback, 1.0, k)
+    price = b / safe_k
+    hi = np.maximum(c["price"] * 3.0, 1000.0)  # векторный _breakeven_search_hi
+    for _ in range(10):
+        hi = np.where(hi * 2.0 > _BREAKEVEN_HI, hi, hi * 2.0)
+    be = np.where(price <= _BREAKEVEN_LO, _BREAKEVEN_LO, price)
+    be = np.where(price > hi, np.nan, be)
+
+    # При k <= 0 (и налоге < 100%) прибыль не растёт с ценой: если она
+    # отрицательна уже на нижней границе, корня нет — бисекция дала бы None
+    profit_tax = np.isin(c["tax_mode"], _PROFIT_TAX_CODES)
+    non_increasing = (k <= 0) & ~(profit_tax & (c["tax_rate"] >= 1.0))
+    idx = np.flatnonzero(fallback)
+    if idx.size:
+        sub = {name: arr[idx] for name, arr in c.items()}
+        f_lo = _net_profit_for_price_batch(sub, np.full(idx.size, _BREAKEVEN_LO))
+        rest = ~(non_increasing[idx] & (f_lo < 0))
+        be[idx] = np.nan
+        if rest.any():
+            be[idx[rest]] = _breakeven_price_bisect_batch({name: arr[rest] for name, arr in sub.items()})
+    return be
+
+
+def compute_batch(cols: Mapping[str, Any]) -> dict[str, np.ndarray]:
+    """
+    Пакетный compute(): на входе колонки CalcInputs (массивы одной длины
+    или скаляры), на выходе колонки тех же результатов, что у compute().
+    breakeven_price = nan там, где compute() вернул бы None.
+    """
+    c = _batch_columns(cols)
+    res = _core_compute_batch(c)
+    out = {k: _round2(v) for k, v in res.items()}
+    out["breakeven_price"] = _round2(_breakeven_price_batch(c))
+    return out
+
+
+# ====== ЧУВСТВИТЕЛЬНОСТЬ К ЦЕНЕ ======
+
+SWEEP_KEYS = ("net_profit", "margin_pct", "max_drr_pct")
+
+
+def _inputs_columns(inputs: CalcInputs, **overrides: Any) -> dict[str, Any]:
+    """Колонки для _batch_columns из одного CalcInputs (режимы → коды)."""
+    cols: dict[str, Any] = {}
+    for name in CalcInputs.__dataclass_fields__:
+        v = overrides.get(name, getattr(inputs, name))
+        modes = _MODE_FIELDS.get(name)
+        cols[name] = modes.index(v) if modes else v
+    return cols
+
+
+def price_grid(price: float, breakeven: Optional[float] = None, points: int = 121) -> np.ndarray:
+    """Сетка цен ±50% от текущей, расширенная до точки безубыточности (но не дальше 3× цены)."""
+    lo, hi = 0.5 * price, 1.5 * price
+    if breakeven is not None:
+        lo = min(lo, 0.9 * breakeven)
+        hi = max(hi, min(1.1 * breakeven, 3.0 * price))
+    return np.linspace(max(lo, _BREAKEVEN_LO), max(hi, _BREAKEVEN_LO * 2), points)
+
+
+def sweep_price(
+    inputs: CalcInputs,
+    prices: Any = None,
+    *,
+    ads_values: Any = None,
+    returns_pct: Any = None,
+) -> dict[str, np.ndarray]:
+    """
+    Чистая прибыль, маржа и макс. ДРР на сетке цен — одним векторным проходом.
+    ads_values (в единицах inputs.ads_mode) и returns_pct добавляют оси сетки:
+    форма значений (len(returns_pct), len(ads_values), len(prices)) без незаданных осей.
+    """
+    axes = {"price": price_grid(inputs.price) if prices is None else np.asarray(prices, dtype=np.float64)}
+    if ads_values is not None:
+        axes["ads_value"] = np.asarray(ads_values, dtype=np.float64)
+    if returns_pct is not None:
+        axes["returns_pct"] = np.asarray(returns_pct, dtype=np.float64)
+
+    names = list(axes)[::-1]  # цена — последняя ось
+    grids = np.meshgrid(*[axes[n] for n in names], indexing="ij")
+    c = _batch_columns(_inputs_columns(inputs, **dict(zip(names, grids))))
+    res = _core_compute_batch(c)
+
+    out = dict(axes)
+    for key in SWEEP_KEYS:
+        out[key] = _round2(res[key]).reshape(grids[0].shape)
+    return out
+
+
+# ====== РИСК (МОНТЕ-КАРЛО) ======
+
+def simulate_risk(
+    inputs: CalcInputs,
+    ranges: Mapping[str, tuple[float, float, float]],
+    samples: int = 20000,
+    seed: Optional[int] = None,
+) -> dict:
+    """
+    Прогоняет модель на samples сценариях: поля из ranges берутся из
+    треугольного распределения (min, наиболее вероятное, max), остальные —
+    как в inputs. Возвращает вероятность убытка и перцентили чистой прибыли.
+    """
+    rng = np.random.default_rng(seed)
+    overrides: dict[str, np.ndarray] = {}
+    for name, (lo, mode, hi) in ranges.items():
+        if hi > lo:
+            overrides[name] = rng.triangular(lo, _clamp(mode, lo, hi), hi, samples)
+        else:
+            overrides[name] = np.full(samples, float(lo))
+
+    if not overrides:
+        overrides["price"] = np.full(samples, inputs.price)
+    c = _batch_columns(_inputs_columns(inputs, **overrides))
+    net = _core_compute_batch(c)["net_profit"]
+    p5, p50, p95 = np.percentile(net, [5, 50, 95]).tolist()
+    return {
+        "samples": int(net.size),
+        "p_loss": round(float(np.mean(net < 0)) * 100, 2),
+        "p5": round(p5, 2),
+        "p50": round(p50, 2),
+        "p95": round(p95, 2),
+    }
+
+
+# ====== ОПТИМАЛЬНАЯ ЦЕНА ======
+#
+# Спрос с постоянной эластичностью: объём(P) = (P / P0) ** -e * lift(ДРР).
+# На участке положительной прибыли net(P) = k*P - b (см. _net_profit_line),
+# поэтому максимум объём × net по цене — в точке P* = e*b / ((e - 1)*k).
+# Для каждого варианта ДРР сравниваются четыре кандидата (P*, излом прибыли
+# в P = b/k, нижняя и верхняя граница цены), так что число вычислений модели
+# не зависит от данных.
+
+OPT_PRICE_BOUNDS = (0.5, 2.0)  # допустимая цена относительно текущей
+OPT_DRR_POINTS = 41
+
+# Готовые таблицы (ДРР долей, множитель продаж) для подбора ДРР в диалоге
+ADS_RESPONSE_TABLES = {
+    "weak": [(0.0, 1.0), (0.05, 1.08), (0.10, 1.13), (0.20, 1.18), (0.30, 1.2)],
+    "medium": [(0.0, 1.0), (0.05, 1.2), (0.10, 1.35), (0.20, 1.5), (0.30, 1.57)],
+    "strong": [(0.0, 1.0), (0.05, 1.4), (0.10, 1.7), (0.20, 2.0), (0.30, 2.15)],
+}
+
+
+def _best_price_columns(
+    c: dict[str, np.ndarray],
+    elasticity: np.ndarray,
+    lift: np.ndarray,
+    lo: np.ndarray,
+    hi: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """По каждой строке: (лучшая цена, прибыль на 1 продажу, общая прибыль относительно объёма при P0)."""
+    P0 = c["price"]
+    k, b, _ = _net_profit_line_batch(c)
+    e = elasticity
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        # прибыль линейна по цене с изломом в нуле прибыли до налога (P = b/k):
+        # максимум — на границе, в изломе или в стационарной точке участка
+        p_star = e * b / ((e - 1.0) * k)
+        p_star = np.where(np.isfinite(p_star), np.clip(p_star, lo, hi), lo)
+        p_kink = b / k
+        p_kink = np.where(np.isfinite(p_kink), np.clip(p_kink, lo, hi), lo)
+
+        cand = np.stack(np.broadcast_arrays(lo, hi, p_star, p_kink))  # (4, n)
+        cc = {name: np.broadcast_to(arr, cand.shape).ravel() for name, arr in c.items()}
+        cc["price"] = cand.ravel()
+        net = _core_compute_batch(cc)["net_profit"].reshape(cand.shape)
+        total = (cand / P0) ** (-e) * lift * net
+
+    best = np.argmax(np.nan_to_num(total, nan=-np.inf), axis=0)
+    idx = np.arange(cand.shape[1])
+    return cand[best, idx], net[best, idx], total[best, idx]
+
+
+def optimize_price(
+    inputs: CalcInputs,
+    elasticity: float,
+    *,
+    drr_table: Optional[list[tuple[float, float]]] = None,
+    bounds: tuple[float, float] = OPT_PRICE_BOUNDS,
+) -> Optional[dict]:
+    """
+    Цена, максимизирующая общую прибыль (объём × прибыль на 1 продажу) при
+    эластичности спроса elasticity. Если задана drr_table — список
+    (ДРР долей, множитель продаж), подбирается и ДРР (между точками таблицы —
+    линейная интерполяция). None — если текущая цена не задана или по
+    таблице продажи при текущем ДРР нулевые (не от чего считать изменение).
+    """
+    P0 = inputs.price
+    if P0 <= 0:
+        return None
+
+    if drr_table:
+        xs, ys = np.asarray(sorted(drr_table), dtype=np.float64).T
+        current_drr = inputs.ads_value if inputs.ads_mode == "DRR" else inputs.ads_value / P0
+        base_lift = float(np.interp(current_drr, xs, ys))
+        if base_lift <= 0:
+            return None
+        drrs = np.linspace(xs[0], xs[-1], OPT_DRR_POINTS)
+        lift = np.interp(drrs, xs, ys) / base_lift
+        c = _batch_columns(_inputs_columns(inputs, ads_mode="DRR", ads_value=drrs))
+    else:
+        drrs = None
+        lift = np.ones(1)
+        c = _batch_columns(_inputs_columns(inputs))
+
+    e = np.full(lift.shape, float(elasticity))
+    price, net, total = _best_price_columns(c, e, lift, P0 * bounds[0], P0 * bounds[1])
+    i = int(np.argmax(np.nan_to_num(total, nan=-np.inf)))
+
+    base_net = float(_core_compute_batch(_batch_columns(_inputs_columns(inputs)))["net_profit"][0])
+    volume = (price[i] / P0) ** -elasticity * lift[i]
+    return {
+        "price": round(float(price[i]), 2),
+        "drr_pct": round(float(drrs[i]) * 100, 2) if drrs is not None else None,
+        "net_profit": round(float(net[i]), 2),
+        "volume_change_pct": round((float(volume) - 1) * 100, 2),
+        "profit_change_pct": round((float(total[i]) / base_net - 1) * 100, 2) if base_net > 0 else None,
+        # 4 кандидата на вариант ДРР + текущая конфигурация
+        "evaluations": 4 * int(lift.size) + 1,
+    }
+
+
+def optimize_batch(cols: Mapping[str, Any], elasticity: Any) -> dict[str, np.ndarray]:
+    """
+    optimize_price() без подбора ДРР для колонок compute_batch. elasticity —
+    скаляр или колонка; nan в ней — строку не оптимизировать (результат nan).
+    """
+    c = _batch_columns(cols)
+    P0 = c["price"]
+    e = np.broadcast_to(np.asarray(elasticity, dtype=np.float64), P0.shape)
+    lo, hi = P0 * OPT_PRICE_BOUNDS[0], P0 * OPT_PRICE_BOUNDS[1]
+    price, net, total = _best_price_columns(c, e, np.ones_like(P0), lo, hi)
+
+    base_net = _core_compute_batch(c)["net_profit"]
+    valid = np.isfinite(e) & (P0 > 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        change = np.where(valid & (base_net > 0), (total / base_net - 1) * 100, np.nan)
+    return {
+        "optimal_price": _round2(np.where(valid, price, np.nan)),
+        "optimal_net_profit": _round2(np.where(valid, net, np.nan)),
+        "optimal_profit_change_pct": _round2(change),
+    }
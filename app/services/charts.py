@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import math
+from io import BytesIO
+from typing import Optional, Sequence
+
+from PIL import Image, ImageDraw, ImageFont
+
+from app.services.pdf_report import find_font_path
+
+_W, _H = 900, 500
+_PAD_L, _PAD_R, _PAD_T, _PAD_B = 90, 30, 50, 60
+
+_GREEN = (46, 160, 67)
+_RED = (207, 34, 46)
+_GRID = (225, 228, 232)
+_AXIS = (90, 96, 105)
+_MARK = (9, 105, 218)
+
+
+def _font(size: int):
+    path = find_font_path()
+    if path:
+        return ImageFont.truetype(path, size)
+    return ImageFont.load_default(size)
+
+
+def _nice_step(span: float, ticks: int = 6) -> float:
+    raw = span / ticks if span > 0 else 1.0
+    mag = 10 ** math.floor(math.log10(raw))
+    for m in (1, 2, 2.5, 5, 10):
+        if raw <= m * mag:
+            return m * mag
+    return 10 * mag
+
+
+def build_profit_chart(
+    prices: Sequence[float],
+    net_profit: Sequence[float],
+    current_price: Optional[float] = None,
+    breakeven_price: Optional[float] = None,
+) -> bytes:
+    """
+    PNG-график чистой прибыли на 1 продажу в зависимости от цены
+    (результат sweep_price). Отмечает текущую цену и точку безубыточности.
+    """
+    xs = [float(p) for p in prices]
+    ys = [float(v) for v in net_profit]
+    x0, x1 = xs[0], xs[-1]
+    y0, y1 = min(min(ys), 0.0), max(max(ys), 0.0)
+    if y1 - y0 < 1e-9:
+        y1 = y0 + 1.0
+    y_pad = (y1 - y0) * 0.08
+    y0, y1 = y0 - y_pad, y1 + y_pad
+
+    img = Image.new("RGB", (_W, _H), "white")
+    d = ImageDraw.Draw(img)
+    font, small = _font(18), _font(13)
+
+    def px(x: float) -> float:
+        return _PAD_L + (x - x0) / (x1 - x0) * (_W - _PAD_L - _PAD_R)
+
+    def py(y: float) -> float:
+        return _H - _PAD_B - (y - y0) / (y1 - y0) * (_H - _PAD_T - _PAD_B)
+
+    # Сетка и подписи осей
+    step = _nice_step(y1 - y0)
+    t = (int(y0 / step) - 1) * step
+    while t <= y1:
+        if t >= y0:
+            d.line([(_PAD_L, py(t)), (_W - _PAD_R, py(t))], fill=_GRID)
+            d.text((_PAD_L - 8, py(t)), f"{t:,.0f}".replace(",", " "), fill=_AXIS, font=small, anchor="rm")
+        t += step
+    step = _nice_step(x1 - x0)
+    t = (int(x0 / step) + 1) * step
+    while t < x1:
+        d.line([(px(t), _PAD_T), (px(t), _H - _PAD_B)], fill=_GRID)
+        d.text((px(t), _H - _PAD_B + 8), f"{t:,.0f}".replace(",", " "), fill=_AXIS, font=small, anchor="mt")
+        t += step
+
+    d.line([(_PAD_L, py(0)), (_W - _PAD_R, py(0))], fill=_AXIS, width=2)
+    d.rectangle([(_PAD_L, _PAD_T), (_W - _PAD_R, _H - _PAD_B)], outline=_AXIS)
+
+    # Кривая прибыли: зелёная выше нуля, красная ниже
+    for (xa, ya), (xb, yb) in zip(zip(xs, ys), zip(xs[1:], ys[1:])):
+        color = _GREEN if (ya + yb) / 2 >= 0 else _RED
+        d.line([(px(xa), py(ya)), (px(xb), py(yb))], fill=color, width=3)
+
+    marks = ((breakeven_price, "безубыток"), (current_price, "текущая"))
+    for row, (price, label) in enumerate(marks):
+        if price is None or not (x0 <= price <= x1):
+            continue
+        d.line([(px(price), _PAD_T), (px(price), _H - _PAD_B)], fill=_MARK, width=1)
+        d.text((px(price) + 4, _PAD_T + 4 + 18 * row), f"{label}: {price:,.0f} ₽".replace(",", " "),
+               fill=_MARK, font=small)
+
+    d.text((_PAD_L, _PAD_T - 12), "Чистая прибыль на 1 продажу, ₽", fill=(0, 0, 0), font=font, anchor="lb")
+    d.text((_W - _PAD_R, _H - 14), "Цена, ₽", fill=_AXIS, font=small, anchor="rb")
+
+    buf = BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
@@ -3,6 +3,7 @@ from io import BytesIO
 from typing import Iterable
 
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.utils import get_column_letter
 from openpyxl.styles import Font
 
@@ -14,74 +15,140 @@ def _normalize_cell_value(value):
     return value
 
 
-def build_admin_export(users_rows: Iterable[dict], payments_rows: Iterable[dict]) -> bytes:
-    wb = Workbook()
-    
-    # --- Сегменты пользователей ---
-    segments = {
-        "Все пользователи": "all",
-        "Нажали старт": "started", 
-        "Использовали бесплатные": "free_used",
-        "Бесплатные закончились": "free_finished",
-        "Купили расчёты": "buyers",
-        "Неактивные (без расчётов)": "inactive"
-    }
-    
-    for sheet_name, segment in segments.items():
-        ws = wb.create_sheet(sheet_name[:31])  # Excel ограничение 31 символ
-        
-        headers = [
-            "ID", "TG User ID", "Создан", "Последний вход",
-            "Запусков", "Бесплатных осталось", "Платных осталось",
-            "Всего расчётов", "Бесплатных использовано", "Платных использовано"
-        ]
-        ws.append(headers)
-        
-        # Стили заголовков
-        for cell in ws[1]:
-            cell.font = Font(bold=True)
-    
-    # Основной лист со всеми пользователями
-    ws_main = wb.active
-    ws_main.title = "Все данные"
-    
-    main_headers = [
-        "tg_user_id", "created_at", "last_seen", "started_count",
-        "free_credits", "paid_credits", "free_used", "paid_used", "total_calcs"
-    ]
-    ws_main.append(main_headers)
-    
-    for cell in ws_main[1]:
-        cell.font = Font(bold=True)
-    
-    for r in users_rows:
-        ws_main.append([_normalize_cell_value(r.get(h)) for h in main_headers])
-    
-    # --- Платежи ---
-    ws_payments = wb.create_sheet("Платежи")
-    
-    payment_headers = [
-        "id", "user_id", "created_at", "amount_rub", 
-        "credits", "provider", "external_id", "status"
-    ]
-    ws_payments.append(payment_headers)
-    
-    for cell in ws_payments[1]:
-        cell.font = Font(bold=True)
-    
-    for r in payments_rows:
-        ws_payments.append([_normalize_cell_value(r.get(h)) for h in payment_headers])
-    
-    # Автоширина колонок
-    for ws in wb.worksheets:
-        for column_cells in ws.columns:
-            length = max(
-                len(str(cell.value)) if cell.value is not None else 0
-                for cell in column_cells
-            )
-            ws.column_dimensions[get_column_letter(column_cells[0].column)].width = max(10, length + 2)
-    
+ADMIN_SEGMENT_SHEETS = {
+    "Все пользователи": "all",
+    "Нажали старт": "started",
+    "Использовали бесплатные": "free_used",
+    "Бесплатные закончились": "free_finished",
+    "Купили расчёты": "buyers",
+    "Неактивные (без расчётов)": "inactive",
+}
+SEGMENT_HEADERS = [
+    "ID", "TG User ID", "Создан", "Последний вход",
+    "Запусков", "Бесплатных осталось", "Платных осталось",
+    "Всего расчётов", "Бесплатных использовано", "Платных использовано",
+]
+USER_COLUMNS = [
+    "tg_user_id", "created_at", "last_seen", "started_count",
+    "free_credits", "paid_credits", "free_used", "paid_used", "total_calcs",
+]
+SEGMENT_COLUMNS = [
+    "id", "tg_user_id", "created_at", "last_seen",
+    "started_count", "free_credits", "paid_credits",
+    "total_calcs", "free_used", "paid_used",
+]
+# Правила сегментов по строке пользователя (см. Repo.iter_export_users)
+SEGMENT_RULES = {
+    "all": lambda r: True,
+    "started": lambda r: r["started_count"] > 0,
+    "free_used": lambda r: r["free_used"] > 0,
+    "free_finished": lambda r: r["free_credits"] == 0,
+    "buyers": lambda r: r["payments_succeeded"] > 0,
+    "inactive": lambda r: r["total_calcs"] == 0,
+}
+PAYMENT_COLUMNS = [
+    "id", "user_id", "created_at", "amount_rub",
+    "credits", "provider", "external_id", "status",
+]
+# Ширины колонок задаются заранее (в write-only режиме ячейки не перечитать)
+_WIDE_COLUMNS = {"created_at": 22, "last_seen": 22, "Создан": 22, "Последний вход": 22, "external_id": 40}
+
+
+class AdminExportWriter:
+    """
+    Потоковая выгрузка для админки: openpyxl write-only, строки пишутся
+    пачками по мере чтения из БД и сразу уходят во временные файлы openpyxl,
+    поэтому память не растёт с размером таблиц. Методы синхронные —
+    вызывать через asyncio.to_thread.
+    """
+
+    def __init__(self):
+        self.wb = Workbook(write_only=True)
+        self.ws_main = self._sheet("Все данные", USER_COLUMNS)
+        self.segments = {
+            segment: self._sheet(title, SEGMENT_HEADERS) for title, segment in ADMIN_SEGMENT_SHEETS.items()
+        }
+        self.ws_payments = self._sheet("Платежи", PAYMENT_COLUMNS)
+
+    def _sheet(self, title: str, headers: list[str]):
+        ws = self.wb.create_sheet(title[:31])  # Excel ограничение 31 символ
+        for idx, h in enumerate(headers, start=1):
+            ws.column_dimensions[get_column_letter(idx)].width = _WIDE_COLUMNS.get(h, max(10, len(h) + 2))
+        ws.append([_bold_cell(ws, h) for h in headers])
+        return ws
+
+    def add_users(self, rows: Iterable[dict]) -> None:
+        """Один проход по строкам: основной лист и все сегменты сразу."""
+        rules = [(self.segments[name], rule) for name, rule in SEGMENT_RULES.items()]
+        for r in rows:
+            self.ws_main.append([_normalize_cell_value(r.get(h)) for h in USER_COLUMNS])
+            seg_row = [_normalize_cell_value(r.get(h)) for h in SEGMENT_COLUMNS]
+            for ws, rule in rules:
+                if rule(r):
+                    ws.append(seg_row)
+
+    def add_payments(self, rows: Iterable[dict]) -> None:
+        for r in rows:
+            self.ws_payments.append([_normalize_cell_value(r.get(h)) for h in PAYMENT_COLUMNS])
+
+    def save(self, path: str) -> None:
+        self.wb.save(path)
+
+
+BULK_RESULT_COLUMNS = [
+    ("Строка файла", None),
+    ("Название / SKU", None),
+    ("Маркетплейс", None),
+    ("Схема", None),
+    ("Цена", None),
+    ("Чистая прибыль", "net_profit"),
+    ("Маржа, %", "margin_pct"),
+    ("Прибыль до налогов", "profit_before_tax"),
+    ("Налог", "tax"),
+    ("Комиссия", "commission_rub"),
+    ("Реклама", "ads_rub"),
+    ("ДРР, %", "drr_pct"),
+    ("Ожид. затраты на возвраты", "returns_cost_expected"),
+    ("Безубыток (цена)", "breakeven_price"),
+    ("Макс. реклама", "max_ads_rub"),
+    ("Макс. ДРР, %", "max_drr_pct"),
+    ("Оптимальная цена", "optimal_price"),
+    ("Прибыль при опт. цене", "optimal_net_profit"),
+    ("Рост общей прибыли, %", "optimal_profit_change_pct"),
+    ("Точность", None),
+]
+
+
+def build_bulk_result(rows, results: list[dict], accuracies: list[str],
+                      errors: list[tuple[int, str]]) -> bytes:
+    """Итоговый файл пакетного расчёта: лист результатов + лист ошибок."""
+    wb = Workbook(write_only=True)
+
+    ws = wb.create_sheet("Результаты")
+    for idx, (title, _) in enumerate(BULK_RESULT_COLUMNS, start=1):
+        ws.column_dimensions[get_column_letter(idx)].width = max(10, len(title) + 2)
+    ws.append([_bold_cell(ws, title) for title, _ in BULK_RESULT_COLUMNS])
+    for row, res, acc in zip(rows, results, accuracies):
+        ws.append(
+            [row.line, row.sku_label, row.marketplace, row.scheme, row.inputs["price"]["value"]]
+            + [res.get(key) for _, key in BULK_RESULT_COLUMNS[5:-1]]
+            + [acc]
+        )
+
+    if errors:
+        ws_err = wb.create_sheet("Ошибки")
+        ws_err.column_dimensions["A"].width = 14
+        ws_err.column_dimensions["B"].width = 60
+        ws_err.append([_bold_cell(ws_err, "Строка файла"), _bold_cell(ws_err, "Ошибка")])
+        for line, msg in errors:
+            ws_err.append([line, msg])
+
     buf = BytesIO()
     wb.save(buf)
-    buf.seek(0)
     return buf.getvalue()
+
+
+def _bold_cell(ws, value):
+    cell = WriteOnlyCell(ws, value=value)
+    cell.font = Font(bold=True)
+    return cell
@@ -0,0 +1,126 @@
+from __future__ import annotations
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+
+from app.repo import Repo
+from app.services.payments import PaymentError, PaymentProvider
+
+logger = logging.getLogger(__name__)
+
+# Конечные статусы YooKassa -> статус в payments; остальные (pending,
+# waiting_for_capture) ещё могут измениться — такие платежи не трогаем
+FINAL_STATUSES = {"succeeded": "SUCCEEDED", "canceled": "CANCELED"}
+
+
+async def notify_paid(bot: Bot, res: dict) -> None:
+    """Сообщает пользователю о начислении (res — из Repo.settle_payment)."""
+    try:
+        await bot.send_message(res["tg_user_id"], f"✅ Оплата подтверждена! Начислено {res['credits']} SKU.")
+    except TelegramAPIError:
+        pass
+
+
+class PaymentPoller:
+    """
+    Сверка оплат в фоне: раз в interval секунд проходит по всем PENDING
+    платежам пачками, запрашивает статусы у провайдера (не больше concurrency
+    запросов одновременно) и закрывает завершённые через
+    Repo.settle_payment — начисление идемпотентно, поэтому гонка
+    с кнопкой «Я оплатил» не приводит к двойному начислению.
+    """
+
+    def __init__(self, repo: Repo, bot: Bot, client: PaymentProvider, *, interval: float = 60.0,
+                 batch_size: int = 200, concurrency: int = 8, min_age_sec: int = 30, max_age_hours: int = 48):
+        self.repo = repo
+        self.bot = bot
+        self.client = client
+        self.interval = interval
+        self.batch_size = batch_size
+        self.min_age_sec = min_age_sec
+        self.max_age_hours = max_age_hours
+        self._sem = asyncio.Semaphore(concurrency)
+        self._task: asyncio.Task | None = None
+        # метрики
+        self.runs = 0
+        self.checked = 0
+        self.credited = 0
+        self.canceled = 0
+        self.errors = 0
+        self.last_run_ms = 0.0
+
+    async def _check(self, provider_payment_id: str) -> None:
+        async with self._sem:
+            try:
+                status = await self.client.get_status(provider_payment_id)
+            except PaymentError as e:
+                self.errors += 1
+                logger.warning("payment %s status check failed: %s", provider_payment_id, e)
+                return
+        self.checked += 1
+        final = FINAL_STATUSES.get(status)
+        if final is None:
+            return
+        res = await self.repo.settle_payment(provider_payment_id, final, {"status": status})
+        if res is None or not res["applied"]:
+            return
+        if final != "SUCCEEDED":
+            self.canceled += 1
+            return
+        self.credited += 1
+        logger.info("payment %s credited by poller: %s SKU", provider_payment_id, res["credits"])
+        await notify_paid(self.bot, res)
+
+    async def run_once(self) -> int:
+        """Один проход по всем PENDING; возвращает число проверенных платежей."""
+        started = time.perf_counter()
+        after_id, total = 0, 0
+        while True:
+            rows = await self.repo.list_pending_payments(
+                after_id=after_id, limit=self.batch_size,
+                min_age_sec=self.min_age_sec, max_age_hours=self.max_age_hours,
+            )
+            if not rows:
+                break
+            after_id = rows[-1]["id"]
+            total += len(rows)
+            await asyncio.gather(*(self._check(r["provider_payment_id"]) for r in rows))
+        self.runs += 1
+        self.last_run_ms = (time.perf_counter() - started) * 1000
+        if total:
+            logger.info("payment poller: %d pending checked in %.0f ms", total, self.last_run_ms)
+        return total
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("payment poller failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def metrics(self) -> dict:
+        return {
+            "runs": self.runs,
+            "checked": self.checked,
+            "credited": self.credited,
+            "canceled": self.canceled,
+            "errors": self.errors,
+            "last_run_ms": round(self.last_run_ms, 1),
+        }
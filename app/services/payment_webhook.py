@@ -0,0 +1,111 @@
+from __future__ import annotations
+import ipaddress
+import logging
+import re
+
+from aiogram import Bot
+from aiohttp import web
+
+from app.repo import Repo
+from app.services.payment_poller import FINAL_STATUSES, notify_paid
+from app.services.payments import PaymentError, PaymentProvider
+
+logger = logging.getLogger(__name__)
+
+# Адреса, с которых YooKassa шлёт уведомления (документация API, раздел «Входящие уведомления»)
+YOOKASSA_NETWORKS = [
+    ipaddress.ip_network(n) for n in (
+        "185.71.76.0/27", "185.71.77.0/27", "77.75.153.0/25", "77.75.156.11/32",
+        "77.75.156.35/32", "77.75.154.128/25", "2a02:5180::/32",
+    )
+]
+
+HANDLED_EVENTS = ("payment.succeeded", "payment.canceled")
+
+# id платежа идёт в путь запроса к API — пропускаем только «обычные» id
+PAYMENT_ID_RE = re.compile(r"[\w-]{1,64}", re.ASCII)
+
+
+class PaymentWebhook:
+    """
+    HTTP-приёмник уведомлений YooKassa (payment.succeeded / payment.canceled).
+    Телу уведомления не доверяем: статус платежа перезапрашивается в API,
+    и уже он применяется через Repo.settle_payment — повторные и
+    дублирующие уведомления ничего не меняют. При ошибке API отвечаем 503,
+    YooKassa повторит доставку; PaymentPoller остаётся страховкой.
+    """
+
+    def __init__(self, repo: Repo, bot: Bot, client: PaymentProvider, *, path: str = "/yookassa/webhook",
+                 check_ip: bool = False):
+        self.repo = repo
+        self.bot = bot
+        self.client = client
+        self.path = path
+        self.check_ip = check_ip
+        self._runner: web.AppRunner | None = None
+        # метрики
+        self.received = 0
+        self.applied = 0
+        self.rejected = 0
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    def _ip_allowed(self, remote: str | None) -> bool:
+        try:
+            ip = ipaddress.ip_address(remote or "")
+        except ValueError:
+            return False
+        return any(ip in net for net in YOOKASSA_NETWORKS)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.received += 1
+        if self.check_ip and not self._ip_allowed(request.remote):
+            self.rejected += 1
+            logger.warning("payment webhook: rejected request from %s", request.remote)
+            return web.Response(status=403)
+        try:
+            body = await request.json()
+            event = body.get("event")
+            payment_id = body["object"]["id"]
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self.rejected += 1
+            return web.Response(status=400)
+        if not isinstance(payment_id, str) or not PAYMENT_ID_RE.fullmatch(payment_id):
+            self.rejected += 1
+            return web.Response(status=400)
+        if event not in HANDLED_EVENTS:
+            return web.Response(status=200)
+
+        try:
+            status = await self.client.get_status(payment_id)
+        except PaymentError as e:
+            logger.warning("payment webhook: status check for %s failed: %s", payment_id, e)
+            return web.Response(status=503)
+        final = FINAL_STATUSES.get(status)
+        if final is None:
+            return web.Response(status=200)
+
+        res = await self.repo.settle_payment(payment_id, final, {"status": status, "event": event})
+        if res is not None and res["applied"]:
+            self.applied += 1
+            logger.info("payment %s %s via webhook", payment_id, final)
+            if final == "SUCCEEDED":
+                await notify_paid(self.bot, res)
+        return web.Response(status=200)
+
+    async def start(self, host: str, port: int) -> None:
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info("payment webhook listening on %s:%d%s", host, port, self.path)
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def metrics(self) -> dict:
+        return {"received": self.received, "applied": self.applied, "rejected": self.rejected}
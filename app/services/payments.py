@@ -1,35 +1,241 @@
 from __future__ import annotations
+import asyncio
+import logging
+import math
+import time
 import uuid
+from abc import ABC, abstractmethod
 from dataclasses import dataclass
-from typing import Optional
-from yookassa import Configuration, Payment
+from typing import Any, Optional
+
+import aiohttp
+
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+YOOKASSA_API_URL = "https://api.yookassa.ru/v3"
+
+# Верхние границы корзин гистограммы задержек, мс (последняя корзина — «больше»)
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class PaymentError(RuntimeError):
+    """Ошибка платёжного API (после ретраев)."""
+
 
 @dataclass
 class PaymentCreateResult:
     payment_id: str
     confirmation_url: str
 
-class YooKassaClient:
-    def __init__(self, shop_id: Optional[str], secret_key: Optional[str]):
+
+class ProviderMetrics:
+    """Счётчики провайдера: вызовы и гистограмма задержек по операциям, ошибки по видам."""
+
+    def __init__(self):
+        self.calls: dict[str, int] = {}
+        self.latency: dict[str, list[int]] = {}
+        self.errors: dict[str, int] = {}
+        self.retries = 0
+
+    def observe(self, op: str, ms: float) -> None:
+        self.calls[op] = self.calls.get(op, 0) + 1
+        hist = self.latency.setdefault(op, [0] * (len(LATENCY_BUCKETS_MS) + 1))
+        i = 0
+        while i < len(LATENCY_BUCKETS_MS) and ms > LATENCY_BUCKETS_MS[i]:
+            i += 1
+        hist[i] += 1
+
+    def error(self, kind: str) -> None:
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def percentile(self, q: float) -> float | None:
+        """
+        Оценка q-перцентиля задержки по всем операциям: граница корзины в мс,
+        inf — выше последней корзины, None — вызовов ещё не было.
+        """
+        hist = [sum(h[i] for h in self.latency.values()) for i in range(len(LATENCY_BUCKETS_MS) + 1)]
+        total = sum(hist)
+        if not total:
+            return None
+        acc = 0
+        for i, n in enumerate(hist):
+            acc += n
+            if acc >= q * total:
+                break
+        return float(LATENCY_BUCKETS_MS[i]) if i < len(LATENCY_BUCKETS_MS) else math.inf
+
+    def snapshot(self) -> dict:
+        labels = [*map(str, LATENCY_BUCKETS_MS), "inf"]
+        return {
+            "calls": dict(self.calls),
+            "latency_ms": {op: dict(zip(labels, h)) for op, h in self.latency.items()},
+            "errors": dict(self.errors),
+            "retries": self.retries,
+        }
+
+
+class PaymentProvider(ABC):
+    """
+    Интерфейс платёжного провайдера. Один экземпляр на процесс создаётся
+    в main и попадает в хендлеры через InjectMiddleware как data["payments"].
+    """
+
+    name = "base"
+    enabled = False
+
+    def __init__(self):
+        self.metrics = ProviderMetrics()
+
+    @abstractmethod
+    async def create_payment(self, amount_rub: int, description: str, return_url: str) -> PaymentCreateResult:
+        ...
+
+    @abstractmethod
+    async def get_status(self, payment_id: str) -> str:
+        """Статус в терминах YooKassa: pending / waiting_for_capture / succeeded / canceled."""
+
+    async def close(self) -> None:
+        pass
+
+
+class YooKassaProvider(PaymentProvider):
+    """
+    YooKassa API v3 на aiohttp: своя keep-alive сессия, таймауты, ретраи на
+    сетевые ошибки / 5xx / 429 с backoff. Повтор POST безопасен — ключ
+    идемпотентности один на все попытки.
+    """
+
+    name = "yookassa"
+
+    def __init__(self, shop_id: Optional[str], secret_key: Optional[str], *,
+                 base_url: str = YOOKASSA_API_URL, timeout: float = 10.0, retries: int = 3):
+        super().__init__()
         self.enabled = bool(shop_id and secret_key)
-        if self.enabled:
-            Configuration.account_id = shop_id
-            Configuration.secret_key = secret_key
+        self._auth = aiohttp.BasicAuth(shop_id, secret_key) if self.enabled else None
+        self.base_url = base_url.rstrip("/")
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self._session: aiohttp.ClientSession | None = None
 
-    def create_payment(self, amount_rub: int, description: str, return_url: str) -> PaymentCreateResult:
+    def _get_session(self) -> aiohttp.ClientSession:
+        # создаётся лениво — внутри работающего event loop
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=20, keepalive_timeout=30))
+        return self._session
+
+    async def _request(self, op: str, method: str, path: str, payload: dict | None = None,
+                       idempotence_key: str | None = None) -> dict[str, Any]:
         if not self.enabled:
             raise RuntimeError("YooKassa is not configured")
-        idempotence_key = str(uuid.uuid4())
-        payment = Payment.create({
+        headers = {"Idempotence-Key": idempotence_key} if idempotence_key else {}
+        last_error: Exception | None = None
+        started = time.perf_counter()
+        try:
+            for attempt in range(1, self.retries + 1):
+                try:
+                    async with self._get_session().request(
+                        method, f"{self.base_url}{path}", json=payload, headers=headers,
+                        auth=self._auth, timeout=self.timeout,
+                    ) as resp:
+                        if resp.status < 400:
+                            return await resp.json(content_type=None)
+                        if resp.status != 429 and resp.status < 500:
+                            self.metrics.error("http_4xx")
+                            raise PaymentError(f"YooKassa {resp.status}: {await resp.text()}")
+                        self.metrics.error("http_429" if resp.status == 429 else "http_5xx")
+                        last_error = PaymentError(f"YooKassa {resp.status}")
+                except asyncio.TimeoutError as e:
+                    self.metrics.error("timeout")
+                    last_error = e
+                except aiohttp.ClientError as e:
+                    self.metrics.error("network")
+                    last_error = e
+                if attempt < self.retries:
+                    self.metrics.retries += 1
+                    logger.warning("YooKassa %s %s failed (%r), retry %d", method, path, last_error, attempt)
+                    await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+            raise PaymentError(f"YooKassa request failed: {last_error}") from last_error
+        finally:
+            self.metrics.observe(op, (time.perf_counter() - started) * 1000)
+
+    async def create_payment(self, amount_rub: int, description: str, return_url: str) -> PaymentCreateResult:
+        payment = await self._request("create", "POST", "/payments", {
             "amount": {"value": f"{amount_rub:.2f}", "currency": "RUB"},
             "confirmation": {"type": "redirect", "return_url": return_url},
             "capture": True,
             "description": description,
-        }, idempotence_key)
-        return PaymentCreateResult(payment.id, payment.confirmation.confirmation_url)
+        }, idempotence_key=str(uuid.uuid4()))
+        try:
+            return PaymentCreateResult(payment["id"], payment["confirmation"]["confirmation_url"])
+        except (KeyError, TypeError) as e:
+            self.metrics.error("bad_response")
+            raise PaymentError(f"YooKassa: unexpected create response: {payment!r:.200}") from e
 
-    def get_status(self, payment_id: str) -> str:
-        if not self.enabled:
-            raise RuntimeError("YooKassa is not configured")
-        p = Payment.find_one(payment_id)
-        return p.status
+    async def get_status(self, payment_id: str) -> str:
+        payment = await self._request("status", "GET", f"/payments/{payment_id}")
+        status = payment.get("status") if isinstance(payment, dict) else None
+        if not isinstance(status, str):
+            self.metrics.error("bad_response")
+            raise PaymentError(f"YooKassa: no status in response: {payment!r:.200}")
+        return status
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+class FakePaymentProvider(PaymentProvider):
+    """
+    Провайдер в памяти — для проверок и локальной разработки без YooKassa.
+    Новые платежи получают initial_status; set_status меняет статус вручную.
+    Через create_payment_provider включается только вместе с
+    ALLOW_FAKE_PAYMENTS=1: с ним любая покупка начисляет SKU бесплатно.
+    """
+
+    name = "fake"
+    enabled = True
+
+    def __init__(self, *, initial_status: str = "pending", latency: float = 0.0):
+        super().__init__()
+        self.initial_status = initial_status
+        self.latency = latency
+        self.statuses: dict[str, str] = {}
+
+    async def create_payment(self, amount_rub: int, description: str, return_url: str) -> PaymentCreateResult:
+        started = time.perf_counter()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        payment_id = f"fake-{uuid.uuid4()}"
+        self.statuses[payment_id] = self.initial_status
+        self.metrics.observe("create", (time.perf_counter() - started) * 1000)
+        return PaymentCreateResult(payment_id, f"https://example.com/pay/{payment_id}")
+
+    async def get_status(self, payment_id: str) -> str:
+        started = time.perf_counter()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.metrics.observe("status", (time.perf_counter() - started) * 1000)
+        if payment_id not in self.statuses:
+            self.metrics.error("http_4xx")
+            raise PaymentError(f"Unknown payment {payment_id}")
+        return self.statuses[payment_id]
+
+    def set_status(self, payment_id: str, status: str) -> None:
+        self.statuses[payment_id] = status
+
+
+def create_payment_provider(config: Config) -> PaymentProvider:
+    """Провайдер по PAYMENT_PROVIDER: yookassa (по умолчанию) / fake."""
+    kind = config.payment_provider
+    if kind == "yookassa":
+        return YooKassaProvider(config.yookassa_shop_id, config.yookassa_secret_key)
+    if kind == "fake":
+        if not config.allow_fake_payments:
+            raise RuntimeError("PAYMENT_PROVIDER=fake grants SKU without payment; "
+                               "set ALLOW_FAKE_PAYMENTS=1 to use it for local development")
+        logger.warning("PAYMENT_PROVIDER=fake: payments are simulated and succeed immediately")
+        return FakePaymentProvider(initial_status="succeeded")
+    raise RuntimeError(f"Unknown PAYMENT_PROVIDER: {kind}")
@@ -2,29 +2,35 @@ from __future__ import annotations
 
 from io import BytesIO
 from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader
 from reportlab.pdfgen import canvas
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 import os
 
+# Шрифт DejaVu с поддержкой русского (используется и для графиков)
+FONT_PATHS = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu-sans-fonts/DejaVuSans.ttf",
+    "/home/sku_bot/sku_profit_bot/app/fonts/DejaVuSans.ttf",  # Добавил локальный путь
+]
+
+
+def find_font_path() -> str | None:
+    for path in FONT_PATHS:
+        if os.path.exists(path):
+            return path
+    return None
+
+
 # Регистрируем шрифт с поддержкой русского
 def _setup_fonts():
     """Настройка шрифтов для поддержки русского текста"""
     try:
         # Пробуем найти и зарегистрировать шрифт DejaVu
-        possible_paths = [
-            "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-            "/usr/share/fonts/TTF/DejaVuSans.ttf",
-            "/usr/share/fonts/dejavu-sans-fonts/DejaVuSans.ttf",
-            "/home/sku_bot/sku_profit_bot/app/fonts/DejaVuSans.ttf",  # Добавил локальный путь
-        ]
-        
-        font_path = None
-        for path in possible_paths:
-            if os.path.exists(path):
-                font_path = path
-                break
-        
+        font_path = find_font_path()
+
         if font_path:
             # Регистрируем обычный и жирный шрифты
             pdfmetrics.registerFont(TTFont('DejaVu', font_path))
@@ -47,6 +53,7 @@ def build_pdf(
     accuracy_notes: list[str],
     options: list[str],
     sku_name: str = None,  # Добавил параметр для названия SKU
+    chart_png: bytes | None = None,  # график прибыли от цены (PNG)
 ) -> bytes:
     """
     Строим простой читаемый отчёт в одну-две страницы А4.
@@ -87,14 +94,14 @@ def build_pdf(
             y = height - 40
             c.setFont(font_name, 10)
 
-	    # Убираем эмодзи из заголовков или заменяем на текст
-    	    header_clean = header
-    	    emoji_replacements = {
-        	"📋": "[Данные]",
-        	"💰": "[Результаты]", 
-        	"🎯": "[Точность]",
-        	"💡": "[Рекомендации]"
-    	    }
+        # Убираем эмодзи из заголовков или заменяем на текст
+        header_clean = header
+        emoji_replacements = {
+            "📋": "[Данные]",
+            "💰": "[Результаты]", 
+            "🎯": "[Точность]",
+            "💡": "[Рекомендации]"
+        }
 
         c.setFont(f"{font_name}-Bold", 12)
         c.drawString(40, y, header)
@@ -154,6 +161,18 @@ def build_pdf(
     
     # Результаты
     draw_section("💰 Результаты расчёта", results_summary)
+
+    # График прибыли от цены
+    if chart_png:
+        img = ImageReader(BytesIO(chart_png))
+        img_w, img_h = img.getSize()
+        draw_w = width - 80
+        draw_h = draw_w * img_h / img_w
+        if y - draw_h < 60:
+            c.showPage()
+            y = height - 40
+        c.drawImage(img, 40, y - draw_h, width=draw_w, height=draw_h)
+        y -= draw_h + 20
     
     # Точность
     c.setFont(f"{font_name}-Bold", 12)
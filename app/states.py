@@ -9,6 +9,9 @@ class CalcFlow(StatesGroup):
     entering_value = State()        # 4. Ввод значений
     confirm = State()               # 5. Результат
 
+class BulkFlow(StatesGroup):
+    waiting_file = State()          # Ждём CSV/XLSX со списком SKU
+
 class BroadcastFlow(StatesGroup):
     choosing_segment = State()
     waiting_csv = State()
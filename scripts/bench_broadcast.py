@@ -0,0 +1,103 @@
+"""
+Бенчмарк рассылки (run_broadcast) против локального фейкового Bot API:
+настоящий aiogram Bot ходит по HTTP в aiohttp-сервер, который отвечает на
+sendMessage с заданной задержкой, иногда возвращает 429 retry_after и
+403 «bot was blocked». Печатает скорость, статусы и максимум сообщений,
+принятых сервером за одну секунду (должен держаться ниже лимита ~30/с).
+
+    python -m scripts.bench_broadcast --users 600 --latency 0.05
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import random
+import sys
+import time
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import web
+
+from app.services.broadcast import BROADCAST_RATE, BroadcastMessage, run_broadcast
+
+TELEGRAM_LIMIT = 30
+
+
+class FakeBotApi:
+    def __init__(self, latency: float, blocked_share: float, flood_every: int):
+        self.latency = latency
+        self.blocked_share = blocked_share
+        self.flood_every = flood_every
+        self.accepted: list[float] = []
+        self.requests = 0
+
+    async def send_message(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        form = await request.post()
+        chat_id = int(form["chat_id"])
+        await asyncio.sleep(self.latency)
+        if self.flood_every and self.requests % self.flood_every == 0:
+            return web.json_response({"ok": False, "error_code": 429, "parameters": {"retry_after": 1},
+                                      "description": "Too Many Requests: retry after 1"}, status=429)
+        if random.Random(chat_id).random() < self.blocked_share:
+            return web.json_response({"ok": False, "error_code": 403,
+                                      "description": "Forbidden: bot was blocked by the user"}, status=403)
+        self.accepted.append(time.monotonic())
+        return web.json_response({"ok": True, "result": {
+            "message_id": self.requests, "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"}, "text": form.get("text", ""),
+        }})
+
+    def peak_per_second(self) -> int:
+        ts, peak, j = self.accepted, 0, 0
+        for i, t in enumerate(ts):
+            while ts[j] <= t - 1.0:
+                j += 1
+            peak = max(peak, i - j + 1)
+        return peak
+
+
+async def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--users", type=int, default=600)
+    ap.add_argument("--rate", type=float, default=BROADCAST_RATE)
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--latency", type=float, default=0.05, help="задержка ответа API, сек")
+    ap.add_argument("--blocked", type=float, default=0.05, help="доля заблокировавших бота")
+    ap.add_argument("--flood-every", type=int, default=250, help="каждый N-й запрос — 429 (0 — без 429)")
+    ap.add_argument("--port", type=int, default=8581)
+    args = ap.parse_args()
+
+    api = FakeBotApi(args.latency, args.blocked, args.flood_every)
+    app = web.Application()
+    app.router.add_post("/bot{token}/sendMessage", api.send_message)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+
+    session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{args.port}"))
+    bot = Bot("123456:fake", session=session)
+    try:
+        stats = await run_broadcast(
+            bot, range(1, args.users + 1), BroadcastMessage("benchmark"),
+            rate=args.rate, concurrency=args.concurrency, total=args.users,
+        )
+    finally:
+        await bot.session.close()
+        await runner.cleanup()
+
+    elapsed = time.monotonic() - stats.started_at
+    statuses = {"sent": stats.sent, "blocked": stats.blocked,
+                "deactivated": stats.deactivated, "failed": stats.failed}
+    peak = api.peak_per_second()
+    print(f"{stats.done}/{args.users} recipients in {elapsed:.1f} s ({stats.done / elapsed:.1f} msg/s), "
+          f"API requests {api.requests}, retry_after waits {stats.retry_after_waits}")
+    print(f"statuses: {statuses}; peak accepted per 1 s window: {peak} (limit {TELEGRAM_LIMIT})")
+    ok = stats.done == args.users and peak <= TELEGRAM_LIMIT
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
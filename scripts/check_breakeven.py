@@ -0,0 +1,100 @@
+"""
+Проверка аналитической точки безубыточности против бисекции: на случайных
+входах всех режимов (комиссия, реклама, налог, в том числе дорогие товары
+и вырожденные доли >= 100%) сравнивает
+
+- _breakeven_price (аналитика) и _breakeven_price_bisect: None в одних и тех
+  же случаях, иначе цены совпадают в пределах точности бисекции;
+- compute() и compute_batch(): одинаковый breakeven_price.
+
+    python -m scripts.check_breakeven --cases 20000 --seed 1
+"""
+from __future__ import annotations
+import argparse
+import math
+import random
+import sys
+
+from app.services.calc import (
+    ADS_MODES,
+    COMMISSION_MODES,
+    TAX_MODES,
+    CalcInputs,
+    _breakeven_price,
+    _breakeven_price_bisect,
+    _net_profit_for_price,
+    _net_profit_line,
+    compute,
+    compute_batch,
+)
+
+
+def _money(rng: random.Random) -> float:
+    # в основном обычные суммы, иногда очень большие (проверка границы поиска)
+    return round(10 ** rng.uniform(0, 7 if rng.random() < 0.1 else 4), 2) if rng.random() > 0.1 else 0.0
+
+
+def random_inputs(rng: random.Random) -> CalcInputs:
+    commission_mode = rng.choice(COMMISSION_MODES)
+    ads_mode = rng.choice(ADS_MODES)
+    return CalcInputs(
+        price=round(10 ** rng.uniform(1, 5), 2),
+        cogs=_money(rng),
+        commission_mode=commission_mode,
+        commission_value=rng.uniform(0, 0.6) if commission_mode == "PCT" else _money(rng),
+        logistics=_money(rng),
+        storage=_money(rng),
+        returns_pct=rng.choice((0.0, rng.uniform(0, 0.5), 1.2)),
+        return_cost=_money(rng),
+        ads_mode=ads_mode,
+        ads_value=rng.uniform(0, 0.6) if ads_mode == "DRR" else _money(rng),
+        other_fees=_money(rng),
+        opex_var=_money(rng),
+        tax_mode=rng.choice(TAX_MODES),
+        tax_rate=rng.choice((0.0, 0.06, 0.15, rng.uniform(0, 1.2))),
+    )
+
+
+def check_case(ci: CalcInputs) -> str | None:
+    """Текст расхождения или None."""
+    a = _breakeven_price(ci)
+    b = _breakeven_price_bisect(ci)
+    if (a is None) != (b is None):
+        return f"analytic {a} vs bisection {b}"
+    if a is not None and abs(a - b) > 1e-6:
+        # бисекция останавливается при |прибыль| < 0.01 — сравниваем с учётом наклона
+        line = _net_profit_line(ci)
+        slope = line[0] if line else 1.0
+        if abs(a - b) > 0.011 / slope + 1e-9 * a and abs(_net_profit_for_price(a, ci)) > 0.011:
+            return f"analytic {a} vs bisection {b}"
+    return None
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--cases", type=int, default=20000)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    cases = [random_inputs(rng) for _ in range(args.cases)]
+    failures = [(ci, msg) for ci in cases if (msg := check_case(ci))]
+
+    cols = {name: [getattr(ci, name) for ci in cases] for name in CalcInputs.__dataclass_fields__}
+    for name, modes in (("commission_mode", COMMISSION_MODES), ("ads_mode", ADS_MODES), ("tax_mode", TAX_MODES)):
+        cols[name] = [modes.index(v) for v in cols[name]]
+    batch = compute_batch(cols)["breakeven_price"]
+    for ci, v in zip(cases, batch.tolist()):
+        scalar = compute(ci)["breakeven_price"]
+        if (scalar is None) != math.isnan(v) or (scalar is not None and abs(scalar - v) > 0.005):
+            failures.append((ci, f"compute {scalar} vs compute_batch {v}"))
+
+    none_count = sum(compute(ci)["breakeven_price"] is None for ci in cases)
+    print(f"{args.cases} cases (seed {args.seed}), breakeven None in {none_count}, mismatches: {len(failures)}")
+    for ci, msg in failures[:10]:
+        print(f"  {msg}: {ci}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
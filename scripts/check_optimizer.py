@@ -0,0 +1,120 @@
+"""
+Проверка optimize_price / optimize_batch против перебора: на случайных
+входах (все режимы, эластичность 0.2..5, с таблицей ДРР и без) общая
+прибыль найденной конфигурации сравнивается с максимумом на плотной сетке
+цен (и тех же вариантах ДРР), а число вычислений модели — с оценкой
+4 × вариантов ДРР + 1, не зависящей от входа.
+
+    python -m scripts.check_optimizer --cases 2000 --grid 4001 --seed 1
+"""
+from __future__ import annotations
+import argparse
+import math
+import random
+import sys
+
+import numpy as np
+
+from app.services.calc import (
+    ADS_RESPONSE_TABLES,
+    COMMISSION_MODES,
+    ADS_MODES,
+    OPT_DRR_POINTS,
+    OPT_PRICE_BOUNDS,
+    TAX_MODES,
+    CalcInputs,
+    _batch_columns,
+    _core_compute_batch,
+    _inputs_columns,
+    optimize_batch,
+    optimize_price,
+)
+from scripts.check_breakeven import random_inputs
+
+EVAL_BOUND = 4 * OPT_DRR_POINTS + 1
+
+
+def total_profit(ci: CalcInputs, e: float, table, prices: np.ndarray, drrs: np.ndarray | None) -> np.ndarray:
+    """Объём × прибыль на 1 продажу, форма (вариантов ДРР, цен)."""
+    P0 = ci.price
+    if drrs is None:
+        c = _batch_columns(_inputs_columns(ci, price=prices))
+        return ((prices / P0) ** -e * _core_compute_batch(c)["net_profit"])[None, :]
+    xs, ys = np.asarray(sorted(table), dtype=np.float64).T
+    current = ci.ads_value if ci.ads_mode == "DRR" else ci.ads_value / P0
+    lift = np.interp(drrs, xs, ys) / float(np.interp(current, xs, ys))
+    d, p = np.meshgrid(drrs, prices, indexing="ij")
+    c = _batch_columns(_inputs_columns(ci, price=p, ads_mode="DRR", ads_value=d))
+    net = _core_compute_batch(c)["net_profit"].reshape(p.shape)
+    return (p / P0) ** -e * lift[:, None] * net
+
+
+def check_case(ci: CalcInputs, e: float, table, grid: int) -> tuple[str | None, float]:
+    """(текст расхождения или None, превышение найденного над максимумом сетки, руб.)."""
+    res = optimize_price(ci, e, drr_table=table)
+    if res is None:
+        return "optimize_price returned None", 0.0
+    if res["evaluations"] > EVAL_BOUND:
+        return f"{res['evaluations']} evaluations > {EVAL_BOUND}", 0.0
+
+    P0 = ci.price
+    drrs = None
+    if table:
+        xs = [x for x, _ in table]
+        drrs = np.linspace(min(xs), max(xs), OPT_DRR_POINTS)
+    prices = np.linspace(P0 * OPT_PRICE_BOUNDS[0], P0 * OPT_PRICE_BOUNDS[1], grid)
+    brute = float(total_profit(ci, e, table, prices, drrs).max())
+
+    # цена в ответе округлена до копеек: допуск — изменение прибыли на полкопейки
+    p = res["price"]
+    opt_drr = None if res["drr_pct"] is None else np.array([res["drr_pct"] / 100])
+    near = total_profit(ci, e, table, np.array([p - 0.005, p, p + 0.005]), opt_drr)[0]
+    found = float(near[1])
+    tol = float(np.abs(near - found).max()) + 1e-9 * abs(brute) + 1e-9
+    if found < brute - tol:
+        return f"found {found:.6f} at price {p}, grid max {brute:.6f}", 0.0
+    return None, found - brute
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--cases", type=int, default=2000)
+    ap.add_argument("--grid", type=int, default=4001, help="точек сетки цен")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    cases = []
+    for _ in range(args.cases):
+        ci = random_inputs(rng)
+        e = round(rng.uniform(0.2, 5.0), 2)
+        table = ADS_RESPONSE_TABLES[rng.choice(sorted(ADS_RESPONSE_TABLES))] if rng.random() < 0.5 else None
+        cases.append((ci, e, table))
+
+    failures, excess = [], []
+    for ci, e, table in cases:
+        msg, ex = check_case(ci, e, table, args.grid)
+        if msg:
+            failures.append((ci, e, table, msg))
+        excess.append(ex)
+
+    # пакетный путь (без подбора ДРР) совпадает со скалярным
+    plain = [(ci, e) for ci, e, table in cases if table is None]
+    cols = {name: [getattr(ci, name) for ci, _ in plain] for name in CalcInputs.__dataclass_fields__}
+    for name, modes in (("commission_mode", COMMISSION_MODES), ("ads_mode", ADS_MODES), ("tax_mode", TAX_MODES)):
+        cols[name] = [modes.index(v) for v in cols[name]]
+    batch = optimize_batch(cols, [e for _, e in plain])["optimal_price"]
+    for (ci, e), v in zip(plain, batch.tolist()):
+        scalar = optimize_price(ci, e)["price"]
+        if not math.isclose(scalar, v, abs_tol=0.005):
+            failures.append((ci, e, None, f"optimize_price {scalar} vs optimize_batch {v}"))
+
+    print(f"{args.cases} cases (seed {args.seed}), price grid {args.grid}, evaluations <= {EVAL_BOUND}; "
+          f"found above grid max by up to {max(excess):.4f} RUB, mismatches: {len(failures)}")
+    for ci, e, table, msg in failures[:10]:
+        print(f"  {msg}: e={e} table={'yes' if table else 'no'} {ci}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""
+Проверка YooKassaProvider против локального stub-сервера, повторяющего
+YooKassa API v3 (POST /payments, GET /payments/{id}):
+
+- 503, затем 200 на создание платежа — повтор с тем же Idempotence-Key;
+- 429 на статус — повтор, затем успех;
+- 4xx — ошибка сразу, без повторов;
+- ответ дольше таймаута — все попытки исчерпаны, таймауты видны в метриках.
+
+    python -m scripts.check_yookassa_client
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import sys
+
+from aiohttp import web
+
+from app.services.payments import PaymentError, YooKassaProvider
+
+
+class YooKassaStub:
+    """Отвечает по сценарию: очередь (HTTP-статус, задержка) на каждый путь, дальше — 200."""
+
+    def __init__(self):
+        self.script: dict[str, list[tuple[int, float]]] = {}
+        self.requests: list[dict] = []
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v3/payments", self.handle)
+        app.router.add_get("/v3/payments/{id}", self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests.append({
+            "method": request.method,
+            "path": request.path,
+            "idempotence_key": request.headers.get("Idempotence-Key"),
+            "auth": request.headers.get("Authorization"),
+        })
+        queue = self.script.get(request.path) or []
+        status, delay = queue.pop(0) if queue else (200, 0.0)
+        if delay:
+            await asyncio.sleep(delay)
+        if status != 200:
+            return web.json_response({"type": "error", "code": str(status)}, status=status)
+        payment_id = request.match_info.get("id", "stub-1")
+        return web.json_response({
+            "id": payment_id,
+            "status": "succeeded" if request.method == "GET" else "pending",
+            "confirmation": {"type": "redirect", "confirmation_url": f"https://stub/pay/{payment_id}"},
+        })
+
+
+async def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--port", type=int, default=8601)
+    args = ap.parse_args()
+
+    stub = YooKassaStub()
+    runner = web.AppRunner(stub.app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+    base_url = f"http://127.0.0.1:{args.port}/v3"
+    failures: list[str] = []
+
+    def check(name: str, ok: bool, detail: object = "") -> None:
+        print(f"  {'ok  ' if ok else 'FAIL'} {name}" + (f": {detail}" if not ok else ""))
+        if not ok:
+            failures.append(name)
+
+    try:
+        # 503 → 200: один ключ идемпотентности на обе попытки
+        client = YooKassaProvider("shop", "secret", base_url=base_url, timeout=2.0, retries=3)
+        stub.script = {"/v3/payments": [(503, 0.0)]}
+        stub.requests.clear()
+        res = await client.create_payment(100, "stub", "https://example.com")
+        keys = [r["idempotence_key"] for r in stub.requests]
+        print("create: 503, then 200")
+        check("created after retry", res.payment_id == "stub-1" and res.confirmation_url.endswith("/stub-1"), res)
+        check("two attempts", len(stub.requests) == 2, stub.requests)
+        check("same Idempotence-Key", len(keys) == 2 and keys[0] and keys[0] == keys[1], keys)
+        check("basic auth sent", all((r["auth"] or "").startswith("Basic ") for r in stub.requests))
+        check("metrics: 1 retry, 1 http_5xx", client.metrics.retries == 1
+              and client.metrics.errors == {"http_5xx": 1}, client.metrics.snapshot())
+        await client.close()
+
+        # 429 → 200 на статус
+        client = YooKassaProvider("shop", "secret", base_url=base_url, timeout=2.0, retries=3)
+        stub.script = {"/v3/payments/p-429": [(429, 0.0)]}
+        stub.requests.clear()
+        status = await client.get_status("p-429")
+        print("status: 429, then 200")
+        check("status after retry", status == "succeeded", status)
+        check("two attempts", len(stub.requests) == 2, stub.requests)
+        check("metrics: http_429", client.metrics.errors == {"http_429": 1}, client.metrics.snapshot())
+        await client.close()
+
+        # 4xx — без повторов
+        client = YooKassaProvider("shop", "secret", base_url=base_url, timeout=2.0, retries=3)
+        stub.script = {"/v3/payments/p-400": [(400, 0.0), (400, 0.0), (400, 0.0)]}
+        stub.requests.clear()
+        print("status: 400")
+        try:
+            await client.get_status("p-400")
+            check("PaymentError raised", False, "no error")
+        except PaymentError:
+            check("PaymentError raised", True)
+        check("single attempt", len(stub.requests) == 1, stub.requests)
+        check("metrics: http_4xx, no retries", client.metrics.errors == {"http_4xx": 1}
+              and client.metrics.retries == 0, client.metrics.snapshot())
+        await client.close()
+
+        # таймауты: каждая попытка дольше timeout
+        client = YooKassaProvider("shop", "secret", base_url=base_url, timeout=0.2, retries=3)
+        stub.script = {"/v3/payments/p-slow": [(200, 1.0)] * 3}
+        stub.requests.clear()
+        print("status: every attempt times out")
+        try:
+            await client.get_status("p-slow")
+            check("PaymentError raised", False, "no error")
+        except PaymentError:
+            check("PaymentError raised", True)
+        snap = client.metrics.snapshot()
+        check("three attempts", len(stub.requests) == 3, stub.requests)
+        check("metrics: 3 timeouts, 2 retries", snap["errors"] == {"timeout": 3} and snap["retries"] == 2, snap)
+        check("latency observed once", snap["calls"] == {"status": 1}
+              and sum(snap["latency_ms"]["status"].values()) == 1, snap)
+        await client.close()
+    finally:
+        await runner.cleanup()
+
+    print("OK" if not failures else f"FAILED: {', '.join(failures)}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))